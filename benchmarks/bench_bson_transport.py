@@ -0,0 +1,70 @@
+import argparse
+import gzip
+import json
+import os
+import pickle
+import tempfile
+import time
+
+import bson
+from bson.raw_bson import RawBSONDocument
+
+from benchmarks.synthetic import write_hour_file
+from utils import gharchive_gzreader
+from utils.gharchive_time import normalize_created_at
+
+
+def load_records(gz_path):
+    records = []
+    with gzip.open(gz_path, "rt", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            record["created_at"] = normalize_created_at(record["created_at"])
+            records.append(record)
+    return records
+
+
+def receiver_dict(payload):
+    # 原路径：写入进程反序列化 dict，insert_many 时再由 pymongo 编码成 BSON
+    records = pickle.loads(payload)["content"]["records"]
+    return sum(len(bson.encode(record)) for record in records)
+
+
+def receiver_raw(payload):
+    # 预编码路径：写入进程只包装 RawBSONDocument，pymongo 直接复用原始字节
+    col_docs = pickle.loads(payload)["content"]["col_docs"]
+    return sum(len(bson.encode(RawBSONDocument(raw_doc))) for raw_docs in col_docs.values() for raw_doc in raw_docs)
+
+
+def timed(func, *args):
+    start = time.process_time()
+    result = func(*args)
+    return result, time.process_time() - start
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="对比写入进程在 dict 消息与预编码 BSON 消息上的 CPU 开销")
+    arg_parser.add_argument("--events", type=int, default=100000)
+    arg_parser.add_argument("--batch-size", type=int, default=gharchive_gzreader.RECORD_BATCH_SIZE)
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        records = load_records(write_hour_file(os.path.join(tmp_dir, "2015-01-01-15.json.gz"), args.events))
+    batches = [records[i:i + args.batch_size] for i in range(0, len(records), args.batch_size)]
+
+    dict_payloads = [pickle.dumps({"type": "records", "content": {"records": batch, "gz_file_path": None}})
+                     for batch in batches]
+    raw_payloads, worker_seconds = timed(lambda: [
+        pickle.dumps({"type": "raw_records",
+                      "content": {"col_docs": gharchive_gzreader.encode_raw_records(batch), "gz_file_path": None}})
+        for batch in batches])
+    dict_bytes, dict_seconds = timed(lambda: sum(receiver_dict(payload) for payload in dict_payloads))
+    raw_bytes, raw_seconds = timed(lambda: sum(receiver_raw(payload) for payload in raw_payloads))
+    assert dict_bytes == raw_bytes
+
+    print(f"{len(records)} events, {len(batches)} batches")
+    print(f"worker encode: {worker_seconds:.2f}s CPU")
+    print(f"receiver dict: {dict_seconds:.2f}s CPU, {len(records) / dict_seconds:,.0f} events/s")
+    print(f" receiver raw: {raw_seconds:.2f}s CPU, {len(records) / raw_seconds:,.0f} events/s")
+    print(f"queue payload: dict {sum(map(len, dict_payloads)) / 2 ** 20:.1f} MB, "
+          f"raw {sum(map(len, raw_payloads)) / 2 ** 20:.1f} MB")
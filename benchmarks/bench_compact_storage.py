@@ -0,0 +1,66 @@
+import argparse
+import time
+
+from pymongo import MongoClient
+
+import config
+from db.mongodb_gh_dictionary import GHIdDictionary
+from db.mongodb_gh_utilities import GHArchiveMongoDBUtil
+
+SCRATCH_DB_NAME = "gharchive_bench_compact"
+
+
+def collection_stats(db, collection_name):
+    stats = db.command("collStats", collection_name)
+    return stats["size"], stats["storageSize"], stats["totalIndexSize"]
+
+
+def group_seconds(collection):
+    start_time = time.time()
+    for _ in collection.aggregate([{"$group": {
+        "_id": {"proj_id": "$proj_id", "user_id": "$user_id", "type": "$type"}, "count": {"$sum": 1}}},
+        {"$count": "n"}], allowDiskUse=True):
+        pass
+    return time.time() - start_time
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="对比字符串 id 与整数代理键的存储与聚合开销（需要可用的 MongoDB）")
+    arg_parser.add_argument("source", help="样本月份的源集合，例如 events_id_2015_01_neo")
+    arg_parser.add_argument("--limit", type=int, default=1000000, help="从样本月份读取的文档数")
+    arg_parser.add_argument("--keep", action="store_true", help="保留临时库")
+    args = arg_parser.parse_args()
+
+    client = MongoClient(config.get_config("mongodb_conn_str"))
+    client.drop_database(SCRATCH_DB_NAME)
+    scratch_db = client[SCRATCH_DB_NAME]
+    # 两个集合使用 GHArchiveMongoDBUtil 相同的索引定义
+    index_util = GHArchiveMongoDBUtil(config.get_config("mongodb_conn_str"))
+    index_util.mongo_db = scratch_db
+    id_dictionary = GHIdDictionary(scratch_db)
+    for name in ("plain", "compact"):
+        scratch_db.create_collection(name)
+        index_util.create_indexes(name)
+
+    batch = []
+    for doc in client["gharchive"][args.source].find({}, {"_id": 0}).limit(args.limit):
+        batch.append(doc)
+        if len(batch) >= 50000:
+            scratch_db["plain"].insert_many([dict(d) for d in batch], ordered=False)
+            scratch_db["compact"].insert_many(id_dictionary.encode_records(batch), ordered=False)
+            batch = []
+    if batch:
+        scratch_db["plain"].insert_many([dict(d) for d in batch], ordered=False)
+        scratch_db["compact"].insert_many(id_dictionary.encode_records(batch), ordered=False)
+
+    print(f"{'':>8} {'data(MB)':>10} {'storage(MB)':>12} {'indexes(MB)':>12} {'$group(s)':>10}")
+    for name in ("plain", "compact"):
+        size, storage_size, index_size = collection_stats(scratch_db, name)
+        print(f"{name:>8} {size / 2 ** 20:>10.1f} {storage_size / 2 ** 20:>12.1f} {index_size / 2 ** 20:>12.1f} "
+              f"{group_seconds(scratch_db[name]):>10.2f}")
+    dim_mb = sum(collection_stats(scratch_db, c)[1] + collection_stats(scratch_db, c)[2]
+                 for c in ("dim_proj", "dim_user"))
+    print(f"dimension collections (storage + indexes): {dim_mb / 2 ** 20:.1f} MB")
+    index_util.close()
+    if not args.keep:
+        client.drop_database(SCRATCH_DB_NAME)
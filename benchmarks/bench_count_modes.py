@@ -0,0 +1,29 @@
+import argparse
+
+import config
+from db.mongodb_gh_count import GHArchiveMongoDBCountUtil
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="对比 count_events 各模式的耗时（需要可用的 MongoDB）")
+    arg_parser.add_argument("source", help="源集合，例如 events_id_2015_01_neo")
+    arg_parser.add_argument("--modes", nargs="+", default=list(GHArchiveMongoDBCountUtil.COUNT_MODES))
+    arg_parser.add_argument("--keep", action="store_true", help="保留临时目标集合")
+    args = arg_parser.parse_args()
+
+    count_db_util = GHArchiveMongoDBCountUtil(config.get_config("mongodb_conn_str"))
+    results = {}
+    for mode in args.modes:
+        target = f"bench_count_{args.source}_{mode}"
+        count_db_util.mongo_target_db.drop_collection(target)
+        results[mode] = count_db_util.count_events(args.source, target, mode)
+        if not args.keep:
+            count_db_util.mongo_target_db.drop_collection(target)
+
+    print(f"{'mode':>8} {'pipeline(s)':>12} {'write(s)':>10} {'total(s)':>10} {'records':>12}")
+    for mode, result in results.items():
+        if result is None:
+            print(f"{mode:>8} {'n/a':>12}")
+            continue
+        total = result["pipeline_seconds"] + result["insert_seconds"]
+        print(f"{mode:>8} {result['pipeline_seconds']:>12.1f} {result['insert_seconds']:>10.1f} {total:>10.1f} "
+              f"{result['records']:>12}")
@@ -0,0 +1,46 @@
+import argparse
+import random
+import time
+
+from utils import gharchive_time
+
+
+def sample_timestamps(n, seed=0):
+    rnd = random.Random(seed)
+    samples = []
+    for i in range(n):
+        year = rnd.randint(2011, 2025)
+        month = rnd.randint(1, 12)
+        day = rnd.randint(1, 28)
+        clock = f"{rnd.randint(0, 23):02d}:{rnd.randint(0, 59):02d}:{rnd.randint(0, 59):02d}"
+        shape = i % 4
+        if shape == 0:
+            samples.append(f"{year}-{month:02d}-{day:02d}T{clock}-07:00")
+        elif shape == 1:
+            samples.append(f"{year}-{month:02d}-{day:02d}T{clock}-08:00")
+        else:
+            samples.append(f"{year}-{month:02d}-{day:02d}T{clock}Z")
+    # 少量未知格式，走 dateutil 回退
+    samples.extend(["2012/03/10 22:23:35 -0800", "2014-12-31T23:59:59.123Z", "2013-05-05T05:05:05+05:30"])
+    return samples
+
+
+def bench(func, samples):
+    start = time.perf_counter()
+    for s in samples:
+        func(s)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="created_at 归一化微基准：dateutil 与快速路径对比")
+    arg_parser.add_argument("--samples", type=int, default=200000)
+    args = arg_parser.parse_args()
+
+    samples = sample_timestamps(args.samples)
+    mismatches = [s for s in samples if gharchive_time._parse_slow(s) != gharchive_time.normalize_created_at(s)]
+    print(f"{len(samples)} timestamps, {len(mismatches)} mismatches {mismatches[:5]}")
+    slow = bench(gharchive_time._parse_slow, samples)
+    fast = bench(gharchive_time.normalize_created_at, samples)
+    print(f"dateutil: {len(samples) / slow:,.0f} /s")
+    print(f"    fast: {len(samples) / fast:,.0f} /s ({slow / fast:.1f}x)")
@@ -0,0 +1,154 @@
+import argparse
+import gc
+import gzip
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import write_hour_file
+from db.mongodb_gh_utilities import GHArchiveMongoDBUtil
+from utils.gharchive_normalizer import GHArchiveNormalizer, generate_sha_hash, normalize_record
+from utils.gharchive_time import normalize_created_at
+
+
+def reference_normalize(record):
+    # 改动前 unzip2queue 中逐条探测字段的实现，逐行照搬作为对照；
+    # created_at 在那时已经使用 normalize_created_at（快速路径），这里不比较最初的 dateutil 解析
+    record_to_send = {}
+    if "id" in record:
+        record_to_send["id"] = record["id"]
+
+    if "repo" in record:
+        repo_name = record["repo"]["name"]
+    elif "repository" in record:
+        repo_name = f"{record['repository']['owner']}/{record['repository']['name']}"
+    elif "url" in record:
+        repo_name = f"{record['url'].replace('https://github.com/', '')}"
+    else:
+        return None
+
+    if "actor_attributes" in record:
+        actor_login = record["actor_attributes"]["login"]
+    elif "actor" in record:
+        actor_login = record["actor"]["login"]
+    else:
+        return None
+    record_to_send["proj_id"] = f"github:{repo_name}"
+    record_to_send["user_id"] = f"github:{actor_login}"
+    record_to_send["type"] = record["type"]
+    record_to_send["created_at"] = normalize_created_at(record["created_at"])
+    if "id" not in record:
+        id_str = f'{record_to_send["proj_id"]}_{record_to_send["user_id"]}_{record_to_send["type"]}_{record_to_send["created_at"]}'
+        record_to_send["id"] = generate_sha_hash(id_str)
+    if "payload" in record:
+        if "action" in record["payload"]:
+            record_to_send["action"] = record["payload"]["action"]
+
+        if "issue" in record["payload"]:
+            if isinstance(record["payload"]["issue"], dict):
+                if "number" in record["payload"]["issue"]:
+                    record_to_send["number"] = record["payload"]["issue"]["number"]
+            else:
+                record_to_send["number"] = record["payload"]["number"]
+        elif "issue_id" in record["payload"]:
+            record_to_send["number"] = record["payload"]["issue_id"]
+
+        if "pull_request" in record["payload"]:
+            if isinstance(record["payload"]["pull_request"], dict):
+                if "number" in record["payload"]["pull_request"]:
+                    record_to_send["number"] = record["payload"]["pull_request"]["number"]
+            else:
+                record_to_send["number"] = record["payload"]["number"]
+    if "action" not in record_to_send:
+        record_to_send["action"] = ""
+    if "number" not in record_to_send:
+        record_to_send["number"] = np.nan
+    return record_to_send
+
+
+def load_records(gz_path):
+    with gzip.open(gz_path, "rt", encoding="utf-8") as fd:
+        return [record for record in map(json.loads, fd) if record["type"] != "GistEvent"]
+
+
+def run_reference(records):
+    # 原路径：解析后 unzip2queue 为路由算一次 col_id，写入端 insert_gh_record 再算一次
+    results = []
+    for record in records:
+        record_to_send = reference_normalize(record)
+        if record_to_send is not None:
+            GHArchiveMongoDBUtil.get_col_id(record_to_send["created_at"])
+            results.append((record_to_send, GHArchiveMongoDBUtil.get_col_id(record_to_send["created_at"])))
+    return results
+
+
+def run_reference_extract(records):
+    for record in records:
+        reference_normalize(record)
+
+
+def run_extract(records):
+    for record in records:
+        normalize_record(record)
+
+
+def run_normalizer(records):
+    normalizer = GHArchiveNormalizer()
+    results = []
+    for record in records:
+        normalized = normalizer.normalize(record)
+        if normalized is not None:
+            results.append(normalized)
+    return results
+
+
+def same_output(a, b):
+    # 字段顺序也必须一致（决定 BSON 中的字段顺序）；NaN 按 repr 比较
+    return [[(k, repr(v)) for k, v in r.items()] + [c] for r, c in a] == \
+        [[(k, repr(v)) for k, v in r.items()] + [c] for r, c in b]
+
+
+def timed(func, records):
+    start = time.perf_counter()
+    func(records)
+    return time.perf_counter() - start
+
+
+def compare(records, repeat):
+    """
+    各实现交替运行 repeat 轮、关闭 GC，取中位数，避免先后顺序与机器抖动影响比例
+    """
+    funcs = {"reference": run_reference, "normalizer": run_normalizer,
+             "reference_extract": run_reference_extract, "extract": run_extract}
+    seconds = {name: [] for name in funcs}
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            for name, func in funcs.items():
+                seconds[name].append(timed(func, records))
+    finally:
+        gc.enable()
+    return {name: statistics.median(values) for name, values in seconds.items()}
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="对比改动前的逐条解析与 GHArchiveNormalizer（解析时附上缓存的 col_id）")
+    arg_parser.add_argument("--events", type=int, default=200000)
+    arg_parser.add_argument("--repeat", type=int, default=9)
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for era, year in (("legacy", 2013), ("modern", 2016)):
+            records = load_records(write_hour_file(os.path.join(tmp_dir, f"{year}-06-01-12.json.gz"), args.events,
+                                                   year, 6, 1, 12, era=era))
+            assert same_output(run_reference(records), run_normalizer(records)), f"{era}: output differs"
+            seconds = compare(records, args.repeat)
+            # 前两列包含为路由与写入端计算 col_id 的开销；extract 只比较字段提取本身
+            print(f"{era:>7}: reference {len(records) / seconds['reference']:,.0f} events/s, "
+                  f"normalizer {len(records) / seconds['normalizer']:,.0f} events/s "
+                  f"({seconds['reference'] / seconds['normalizer']:.2f}x); "
+                  f"extract only {seconds['reference_extract'] / seconds['extract']:.2f}x, identical output")
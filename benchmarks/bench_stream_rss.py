@@ -0,0 +1,75 @@
+import argparse
+import gzip
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic import write_hour_file
+from utils import gharchive_gzreader
+
+
+class NullQueue:
+    # 丢弃所有消息，只测量解压与解析本身
+    def qsize(self):
+        return 0
+
+    def put(self, msg):
+        pass
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 下单位是 KB，macOS 下是字节
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def readlines_worker(gz_path, result_qu):
+    # 旧实现：先 readlines() 读出整个解压后的文件再逐行解析
+    start = time.time()
+    with gzip.open(gz_path) as ghfd:
+        lines = ghfd.readlines()
+    for line in lines:
+        json.loads(line.strip())
+    result_qu.put((time.time() - start, peak_rss_mb()))
+
+
+def streaming_worker(gz_path, result_qu):
+    start = time.time()
+    gharchive_gzreader.unzip2queue(gz_path, [NullQueue()])
+    result_qu.put((time.time() - start, peak_rss_mb()))
+
+
+def idle_worker(gz_path, result_qu):
+    result_qu.put((0.0, peak_rss_mb()))
+
+
+def run(target, gz_path):
+    # 每种模式使用新的 spawn 进程，保证峰值 RSS 互不影响
+    ctx = multiprocessing.get_context("spawn")
+    result_qu = ctx.Queue()
+    p = ctx.Process(target=target, args=(gz_path, result_qu))
+    p.start()
+    result = result_qu.get()
+    p.join()
+    return result
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="测量单个 worker 解压一个小时文件时的峰值 RSS")
+    arg_parser.add_argument("--events", type=int, default=200000)
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        gz_path = write_hour_file(os.path.join(tmp_dir, "2015-01-01-15.json.gz"), args.events)
+        with gzip.open(gz_path) as fd:
+            decompressed_mb = sum(len(line) for line in fd) / (1024 * 1024)
+        print(f"{args.events} events, {os.path.getsize(gz_path) / (1024 * 1024):.1f} MB gz, "
+              f"{decompressed_mb:.1f} MB decompressed, "
+              f"gzip backend: {'isal' if gharchive_gzreader.fast_gzip else 'stdlib'}")
+        for name, target in [("idle", idle_worker), ("readlines", readlines_worker), ("streaming", streaming_worker)]:
+            elapsed, peak = run(target, gz_path)
+            print(f"{name:>10}: peak RSS {peak:.1f} MB, {elapsed:.2f}s")
@@ -0,0 +1,51 @@
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import write_hour_file
+from utils import gharchive_gzreader
+
+
+def drain(msg_qu, result_qu):
+    # 模拟 GHReceiver._worker 的消费过程，只计数不写库
+    events = 0
+    while True:
+        msg = msg_qu.get()
+        if msg["type"] == "records":
+            events += len(msg["content"]["records"])
+        elif msg["type"] == "record":
+            events += 1
+        elif msg["type"] == "complete":
+            result_qu.put(events)
+            return
+
+
+def run(gz_path, batch_size):
+    manager = multiprocessing.Manager()
+    msg_qu = manager.Queue()
+    result_qu = manager.Queue()
+    consumer = multiprocessing.Process(target=drain, args=(msg_qu, result_qu))
+    consumer.start()
+    start = time.time()
+    gharchive_gzreader.unzip2queue(gz_path, [msg_qu], batch_size=batch_size)
+    consumer.join()
+    elapsed = time.time() - start
+    events = result_qu.get()
+    manager.shutdown()
+    return events, elapsed
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="对比逐条消息与批量消息的队列传输吞吐")
+    arg_parser.add_argument("--events", type=int, default=100000)
+    arg_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 500, gharchive_gzreader.RECORD_BATCH_SIZE])
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        gz_path = write_hour_file(os.path.join(tmp_dir, "2015-01-01-15.json.gz"), args.events)
+        for batch_size in args.batch_sizes:
+            events, elapsed = run(gz_path, batch_size)
+            label = "per-event" if batch_size == 1 else f"batch={batch_size}"
+            print(f"{label:>12}: {events} events in {elapsed:.2f}s, {events / elapsed:,.0f} events/s")
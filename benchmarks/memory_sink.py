@@ -0,0 +1,84 @@
+from bson.raw_bson import RawBSONDocument
+
+from db.mongodb_gh_utilities import GHArchiveMongoDBUtil
+
+
+class MemorySink:
+    """
+    代替 GHArchiveMongoDBUtil 的内存写入端，用于离线基准测试：
+    按集合缓冲，满批时按事件 id 去重（相当于唯一索引），返回值与 GHArchiveMongoDBUtil 一致
+    """
+
+    def __init__(self, batch_size=50000):
+        self.batch_size = batch_size
+        self.buffer = {}
+        self.collections = {}
+        self.source_stats = {}
+
+    def insert_gh_record(self, gh_record, source=None, col_id=None):
+        if col_id is None:
+            col_id = GHArchiveMongoDBUtil.get_col_id(gh_record["created_at"])
+        return self.__buffer_flush(gh_record["id"], col_id, source)
+
+    def insert_gh_records(self, gh_records, source=None, col_ids=None):
+        return self.__merge_results(self.insert_gh_record(gh_record, source, col_ids[i] if col_ids else None)
+                                    for i, gh_record in enumerate(gh_records))
+
+    def insert_raw_records(self, col_docs, source=None):
+        return self.__merge_results(self.__buffer_flush(RawBSONDocument(raw_doc)["id"], col_id, source)
+                                    for col_id, raw_docs in col_docs.items() for raw_doc in raw_docs)
+
+    def __merge_results(self, results):
+        inserted_ids = -1
+        write_errors = -1
+        for s, e in results:
+            if s >= 0:
+                inserted_ids = max(inserted_ids, 0) + s
+                write_errors = max(write_errors, 0) + e
+        return inserted_ids, write_errors
+
+    def __buffer_flush(self, event_id, col_id, source):
+        if col_id not in self.buffer:
+            self.buffer[col_id] = []
+        self.buffer[col_id].append((event_id, source))
+        if len(self.buffer[col_id]) >= self.batch_size:
+            return self.__insert(col_id)
+        return -1, -1
+
+    def __insert(self, col_id):
+        ids = self.collections.setdefault(col_id, set())
+        inserted_ids = 0
+        duplicates = 0
+        for event_id, source in self.buffer[col_id]:
+            stats = self.source_stats.setdefault(source, [0, 0])
+            if event_id in ids:
+                stats[1] += 1
+                duplicates += 1
+            else:
+                ids.add(event_id)
+                stats[0] += 1
+                inserted_ids += 1
+        self.buffer[col_id] = []
+        return inserted_ids, duplicates
+
+    def flush(self):
+        inserted_ids = 0
+        write_errors = 0
+        for col_id in self.buffer:
+            if self.buffer[col_id]:
+                s, e = self.__insert(col_id)
+                inserted_ids += s
+                write_errors += e
+        return inserted_ids, write_errors
+
+    def pop_source_stats(self, source):
+        return tuple(self.source_stats.pop(source, (0, 0)))
+
+    def count_documents(self):
+        return sum(len(ids) for ids in self.collections.values())
+
+    def build_deferred_indexes(self, col_id=None):
+        pass
+
+    def close(self):
+        pass
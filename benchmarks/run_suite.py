@@ -0,0 +1,168 @@
+import argparse
+import datetime
+import functools
+import gzip
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+from benchmarks.memory_sink import MemorySink
+from benchmarks.synthetic import write_hour_file
+from db import columnar_gh_sink
+from utils import gharchive_gzreader, gharchive_receiver
+from utils.gharchive_flow import MemoryBudget
+from utils.gharchive_time import normalize_created_at
+from utils.ingest_manifest import IngestManifest
+
+# 每个时代的文件所在的小时：legacy 落在 2012 年夏令时（-07:00），modern 落在 2015 年
+ERA_HOURS = {"legacy": (2012, 6, 1), "modern": (2015, 1, 1)}
+
+
+class NullQueue:
+    # 丢弃所有消息，只测量解压与解析本身
+    def qsize(self):
+        return 0
+
+    def put(self, msg):
+        pass
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+def generate_files(data_dir, era, num_files, num_events):
+    year, month, day = ERA_HOURS[era]
+    return [write_hour_file(os.path.join(data_dir, f"{year}-{month:02d}-{day:02d}-{hour}.json.gz"), num_events,
+                            year, month, day, hour, seed=hour, era=era)
+            for hour in range(num_files)]
+
+
+def bench_normalize(gz_paths):
+    created_ats = []
+    for gz_path in gz_paths:
+        with gzip.open(gz_path, "rt", encoding="utf-8") as fd:
+            created_ats.extend(json.loads(line)["created_at"] for line in fd)
+    start = time.perf_counter()
+    for created_at in created_ats:
+        normalize_created_at(created_at)
+    return len(created_ats), time.perf_counter() - start
+
+
+def bench_parse(gz_paths):
+    start = time.perf_counter()
+    for gz_path in gz_paths:
+        gharchive_gzreader.unzip2queue(gz_path, [NullQueue()])
+    return None, time.perf_counter() - start
+
+
+def bench_ingest(gz_paths, num_workers, num_writers, raw_bson=False, db_factory=MemorySink):
+    """
+    下载之外的完整流水线：解析进程池 -> 分片队列 -> GHReceiver（默认内存写入端）-> GHCompletionTracker
+    """
+    manifest_path = os.path.join(os.path.dirname(gz_paths[0]), f"bench-{time.time_ns()}.manifest.sqlite")
+    manager = multiprocessing.Manager()
+    ready_qu = manager.Queue()
+    for gz_path in gz_paths:
+        ready_qu.put((None, gz_path))
+    for _ in range(num_workers):
+        ready_qu.put(None)
+    msg_qus = [manager.Queue() for _ in range(num_writers)]
+    completion_qu = manager.Queue()
+    memory_budget = MemoryBudget(manager, 256 * 1024 * 1024)
+    start = time.perf_counter()
+    tracker = gharchive_receiver.GHCompletionTracker(manifest_path, completion_qu, len(gz_paths), num_writers)
+    tracker.start()
+    receivers = [gharchive_receiver.GHReceiver(msg_qus[i], completion_qu, i, memory_budget=memory_budget,
+                                               db_factory=db_factory) for i in range(num_writers)]
+    for receiver in receivers:
+        receiver.start()
+    arg_list = [{"ready_queue": ready_qu, "message_queues": msg_qus, "worker_idx": i, "manifest_path": manifest_path,
+                 "raw_bson": raw_bson, "memory_budget": memory_budget} for i in range(num_workers)]
+    with multiprocessing.Pool(num_workers) as p:
+        p.map(gharchive_gzreader.gz_reader, arg_list)
+    for msg_qu in msg_qus:
+        msg_qu.put({"type": "terminate", "content": None})
+    for receiver in receivers:
+        receiver.join()
+    completion_qu.put({"type": "terminate", "content": None})
+    tracker.join()
+    seconds = time.perf_counter() - start
+    manager.shutdown()
+    manifest = IngestManifest(manifest_path)
+    completed = len(manifest.completed_file_names())
+    manifest.close()
+    if completed != len(gz_paths):
+        raise RuntimeError(f"only {completed}/{len(gz_paths)} files completed")
+    return None, seconds
+
+
+def best_of(repeat, func, *args):
+    results = [func(*args) for _ in range(repeat)]
+    return min(results, key=lambda x: x[1])
+
+
+def run_suite(args):
+    results = {}
+    with tempfile.TemporaryDirectory() as data_dir:
+        for era in ("legacy", "modern"):
+            gz_paths = generate_files(data_dir, era, args.files, args.events)
+            num_events = args.files * args.events
+            cases = [
+                ("normalize", bench_normalize, (gz_paths,)),
+                ("parse", bench_parse, (gz_paths,)),
+                ("ingest", bench_ingest, (gz_paths, args.workers, args.writers)),
+                ("ingest_raw_bson", bench_ingest, (gz_paths, args.workers, args.writers, True)),
+            ]
+            if columnar_gh_sink.pa is not None:
+                # 安装了 pyarrow 时同时测量 parquet 写入端
+                parquet_sink = functools.partial(columnar_gh_sink.GHArchiveColumnarSink,
+                                                 os.path.join(data_dir, "parquet"))
+                cases.append(("ingest_parquet", bench_ingest,
+                              (gz_paths, args.workers, args.writers, False, parquet_sink)))
+            for case, func, func_args in cases:
+                count, seconds = best_of(args.repeat, func, *func_args)
+                count = num_events if count is None else count
+                results[f"{case}_{era}"] = {"events": count, "seconds": seconds, "events_per_second": count / seconds}
+    return results
+
+
+def print_results(results, baseline=None):
+    for name, result in results.items():
+        line = f"{name:>24}: {result['events_per_second']:>12,.0f} events/s  ({result['seconds']:.3f}s)"
+        if baseline is not None and name in baseline["results"]:
+            ratio = result["events_per_second"] / baseline["results"][name]["events_per_second"]
+            line += f"  {ratio:.2f}x vs {baseline.get('revision')}"
+        print(line)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="离线基准测试：合成的 legacy / modern 小时文件上的归一化、解析与端到端导入")
+    arg_parser.add_argument("--events", type=int, default=50000, help="每个小时文件的事件数")
+    arg_parser.add_argument("--files", type=int, default=4, help="每个时代生成的小时文件数")
+    arg_parser.add_argument("--workers", type=int, default=2)
+    arg_parser.add_argument("--writers", type=int, default=2)
+    arg_parser.add_argument("--repeat", type=int, default=3, help="每项重复次数，取最快的一次")
+    arg_parser.add_argument("--output", default=None, help="把结果写成 JSON，供之后 --compare")
+    arg_parser.add_argument("--compare", default=None, help="与之前 --output 写出的结果对比")
+    args = arg_parser.parse_args()
+
+    results = run_suite(args)
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare, "r", encoding="utf-8") as fd:
+            baseline = json.load(fd)
+    print_results(results, baseline)
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as fd:
+            json.dump({"revision": git_revision(), "time": datetime.datetime.now().isoformat(),
+                       "python": platform.python_version(), "machine": platform.machine(),
+                       "cpu_count": os.cpu_count(), "params": vars(args), "results": results}, fd, indent=1)
@@ -0,0 +1,92 @@
+import gzip
+import json
+import random
+
+EVENT_TYPES = ["PushEvent", "WatchEvent", "CreateEvent", "IssuesEvent", "PullRequestEvent", "IssueCommentEvent",
+               "ForkEvent", "DeleteEvent"]
+
+
+def modern_event(rnd, event_id, year, month, day, hour):
+    event_type = rnd.choice(EVENT_TYPES)
+    login = f"user{rnd.randint(0, 50000)}"
+    repo = f"owner{rnd.randint(0, 20000)}/repo{rnd.randint(0, 10)}"
+    payload = {}
+    if event_type in ("IssuesEvent", "IssueCommentEvent"):
+        payload = {"action": "opened", "issue": {"number": rnd.randint(1, 5000), "title": "x" * 40}}
+    elif event_type == "PullRequestEvent":
+        payload = {"action": "closed", "number": rnd.randint(1, 5000),
+                   "pull_request": {"number": rnd.randint(1, 5000), "body": "y" * 200}}
+    elif event_type == "PushEvent":
+        payload = {"push_id": event_id, "size": 1, "commits": [{"sha": "0" * 40, "message": "z" * 80}]}
+    return {
+        "id": str(event_id),
+        "type": event_type,
+        "actor": {"id": rnd.randint(1, 10 ** 7), "login": login, "url": f"https://api.github.com/users/{login}"},
+        "repo": {"id": rnd.randint(1, 10 ** 8), "name": repo, "url": f"https://api.github.com/repos/{repo}"},
+        "payload": payload,
+        "public": True,
+        "created_at": f"{year}-{month:02d}-{day:02d}T{hour:02d}:{rnd.randint(0, 59):02d}:{rnd.randint(0, 59):02d}Z",
+    }
+
+
+def legacy_event(rnd, year, month, day, hour):
+    """
+    2011–2014 时间线格式：repository / actor_attributes，带时区偏移的 created_at，没有 id
+    """
+    event_type = rnd.choice(EVENT_TYPES + ["FollowEvent", "GistEvent"])
+    login = f"user{rnd.randint(0, 50000)}"
+    owner = f"owner{rnd.randint(0, 20000)}"
+    name = f"repo{rnd.randint(0, 10)}"
+    # 太平洋时间：夏令时 -07:00，其余 -08:00
+    offset = "-07:00" if 3 < month < 11 else "-08:00"
+    event = {
+        "created_at": f"{year}-{month:02d}-{day:02d}T{hour:02d}:{rnd.randint(0, 59):02d}:{rnd.randint(0, 59):02d}"
+                      f"{offset}",
+        "payload": {},
+        "public": True,
+        "type": event_type,
+        "actor": login,
+        "actor_attributes": {"login": login, "type": "User", "gravatar_id": "0" * 32},
+    }
+    if event_type in ("FollowEvent", "GistEvent"):
+        # 没有 repository 的事件只有 url
+        event["url"] = f"https://github.com/{owner}/{name}"
+        return event
+    event["url"] = f"https://github.com/{owner}/{name}"
+    event["repository"] = {"id": rnd.randint(1, 10 ** 7), "name": name, "owner": owner,
+                           "url": f"https://github.com/{owner}/{name}", "description": "d" * 60,
+                           "watchers": rnd.randint(0, 500), "stargazers": rnd.randint(0, 500),
+                           "forks": rnd.randint(0, 50), "language": "Python", "private": False}
+    if event_type == "IssuesEvent":
+        event["payload"] = {"action": "opened", "issue": rnd.randint(1, 10 ** 7), "number": rnd.randint(1, 5000)}
+    elif event_type == "IssueCommentEvent":
+        event["payload"] = {"issue_id": rnd.randint(1, 10 ** 7), "comment_id": rnd.randint(1, 10 ** 7)}
+    elif event_type == "PullRequestEvent":
+        event["payload"] = {"action": "closed", "number": rnd.randint(1, 5000),
+                            "pull_request": {"number": rnd.randint(1, 5000), "body": "y" * 200}}
+    elif event_type == "PushEvent":
+        event["payload"] = {"shas": [["0" * 40, f"{login}@example.com", "z" * 80, login, True]], "size": 1,
+                            "ref": "refs/heads/master", "head": "0" * 40}
+    return event
+
+
+def write_hour_file(path, num_events, year=2015, month=1, day=1, hour=15, seed=0, era=None):
+    """
+    生成一个合成的 GH Archive 小时文件（.json.gz），用于离线基准测试
+    era 为 "legacy"（2011–2014 时间线格式）或 "modern"，默认按年份选择；相同参数生成的文件完全相同
+    """
+    if era is None:
+        era = "legacy" if year < 2015 else "modern"
+    rnd = random.Random(seed)
+    # 不同 seed 的文件 id 不重叠
+    id_base = 2489651045 + seed * 10 ** 8
+    # mtime=0 使同样的参数生成逐字节相同的文件
+    with gzip.GzipFile(path, "wb", mtime=0) as fd:
+        for i in range(num_events):
+            if era == "legacy":
+                event = legacy_event(rnd, year, month, day, hour)
+            else:
+                event = modern_event(rnd, id_base + i, year, month, day, hour)
+            fd.write(json.dumps(event).encode("utf-8"))
+            fd.write(b"\n")
+    return path
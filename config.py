@@ -1,20 +1,38 @@
+import copy
+import functools
+
 import yaml
 
 
-def __get_config(field_name, file_path):
+@functools.lru_cache(maxsize=None)
+def __load_config(file_path):
+    # 每个进程只读取并解析一次 config.yaml；文件不存在时抛出的异常不会被缓存
     with open(file_path, "r", encoding="utf-8") as file:
-        data = yaml.safe_load(file)  # 安全加载，防止恶意代码执行
-        if field_name in data:
-            return data[field_name]
-        else:
-            raise Exception(f"Cannot find '{field_name}' in config.yaml")
+        return yaml.safe_load(file)  # 安全加载，防止恶意代码执行
+
+
+def __get_config(field_name, file_path):
+    data = __load_config(file_path)
+    if field_name in data:
+        # 返回副本，调用方修改返回值不会影响缓存
+        return copy.deepcopy(data[field_name])
+    else:
+        raise KeyError(f"Cannot find '{field_name}' in config.yaml")
+
+
+_NO_DEFAULT = object()
 
 
-def get_config(field_name):
+def get_config(field_name, default=_NO_DEFAULT):
     yaml_paths = ["../gharchive_db_builder_private_data/config.yaml", "../../gharchive_db_builder_private_data/config.yaml"]
     for file_path in yaml_paths:
         try:
             return __get_config(field_name, file_path)
         except FileNotFoundError:
             pass
+        except KeyError:
+            # 只有可选字段在 config.yaml 中缺失时才使用默认值；YAML 格式错误、权限错误等照常抛出
+            if default is _NO_DEFAULT:
+                raise
+            return default
     raise Exception("Cannot find config.yaml")
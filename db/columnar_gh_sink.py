@@ -0,0 +1,150 @@
+import datetime
+import os
+
+import bson
+
+from db.mongodb_gh_utilities import GHArchiveMongoDBUtil
+
+try:
+    # 可选依赖：只有列式输出需要 pyarrow
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+FILE_FORMATS = ("parquet", "arrow")
+FILE_SUFFIXES = {"parquet": ".parquet", "arrow": ".arrow"}
+COLUMNS = ("id", "proj_id", "user_id", "type", "action", "number", "created_at")
+# 以字典编码存储的低基数 / 高重复列
+DICTIONARY_COLUMNS = ("proj_id", "user_id", "type", "action")
+CREATED_AT_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def get_schema():
+    string_dictionary = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([("id", pa.string()), ("proj_id", string_dictionary), ("user_id", string_dictionary),
+                      ("type", string_dictionary), ("action", string_dictionary), ("number", pa.int64()),
+                      ("created_at", pa.timestamp("s", tz="UTC"))])
+
+
+def get_partition_dir(output_root, col_id):
+    return os.path.join(output_root, f"year={col_id[0:4]}", f"month={col_id[5:7]}")
+
+
+def get_source_name(source):
+    # "/data/2015/2015-01-01-15.json.gz" -> "2015-01-01-15"
+    name = os.path.basename(source)
+    for suffix in (".gz", ".json"):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
+
+
+class GHArchiveColumnarSink:
+    """
+    列式文件写入端，与 GHArchiveMongoDBUtil 的写入接口相同，可以直接替换 GHReceiver 中的 Mongo 写入。
+    输出按 output_root/year=YYYY/month=MM/<小时文件名>.parquet（或 .arrow）分区，
+    proj_id / user_id / type / action 为字典编码列。
+
+    每个来源文件在各分区中的记录先缓存在内存里，来源文件完成时（pop_source_stats）一次性写出并原子替换，
+    因此同一个小时文件重新导入只会覆盖自己的输出，不会产生重复；同一来源文件内重复的 id 只保留第一条。
+    """
+
+    def __init__(self, output_root, file_format="parquet", compression="zstd"):
+        if pa is None:
+            raise ImportError("pyarrow is required for the parquet / arrow sinks")
+        if file_format not in FILE_FORMATS:
+            raise ValueError(f"unsupported file format {file_format}, expected one of {FILE_FORMATS}")
+        self.output_root = output_root
+        self.file_format = file_format
+        self.compression = compression
+        self.schema = get_schema()
+        # {source: {col_id: {列名: [值, ...]}}}
+        self.buffer = {}
+        # {source: set(id)}，用于来源文件内去重
+        self.seen_ids = {}
+        self.duplicates = {}
+
+    def insert_gh_record(self, gh_record, source=None, col_id=None):
+        event_id = gh_record["id"]
+        seen_ids = self.seen_ids.setdefault(source, set())
+        if event_id in seen_ids:
+            self.duplicates[source] = self.duplicates.get(source, 0) + 1
+            return -1, -1
+        seen_ids.add(event_id)
+        if col_id is None:
+            col_id = GHArchiveMongoDBUtil.get_col_id(gh_record["created_at"])
+        columns = self.buffer.setdefault(source, {}).get(col_id)
+        if columns is None:
+            columns = {column: [] for column in COLUMNS}
+            self.buffer[source][col_id] = columns
+        for column in COLUMNS:
+            columns[column].append(gh_record.get(column))
+        return -1, -1
+
+    def insert_gh_records(self, gh_records, source=None, col_ids=None):
+        for i, gh_record in enumerate(gh_records):
+            self.insert_gh_record(gh_record, source, col_ids[i] if col_ids is not None else None)
+        return -1, -1
+
+    def insert_raw_records(self, col_docs, source=None):
+        for col_id, raw_docs in col_docs.items():
+            for raw_doc in raw_docs:
+                self.insert_gh_record(bson.decode(raw_doc), source, col_id)
+        return -1, -1
+
+    def flush(self):
+        # 未完成的来源文件不能写出一部分，写出发生在 pop_source_stats
+        return -1, -1
+
+    def __build_table(self, columns):
+        arrays = []
+        for column in COLUMNS:
+            values = columns[column]
+            if column in DICTIONARY_COLUMNS:
+                arrays.append(pa.array(values, pa.string()).dictionary_encode())
+            elif column == "number":
+                # 缺失的 number 在解析时是 NaN，列式存储中记为 null
+                arrays.append(pa.array([v if isinstance(v, int) else None for v in values], pa.int64()))
+            elif column == "created_at":
+                arrays.append(pc.assume_timezone(pc.strptime(pa.array(values, pa.string()), CREATED_AT_FORMAT, "s"),
+                                                 "UTC"))
+            else:
+                arrays.append(pa.array(values, pa.string()))
+        return pa.Table.from_arrays(arrays, schema=self.schema)
+
+    def __write_table(self, table, path):
+        tmp_path = path + ".tmp"
+        if self.file_format == "parquet":
+            pq.write_table(table, tmp_path, compression=self.compression)
+        else:
+            with pa.OSFile(tmp_path, "wb") as fd:
+                with pa.ipc.new_file(fd, table.schema,
+                                     options=pa.ipc.IpcWriteOptions(compression=self.compression)) as writer:
+                    writer.write_table(table)
+        os.replace(tmp_path, path)
+
+    def pop_source_stats(self, source):
+        """
+        写出来源文件在各个月份分区中的记录，返回 (写入条数, 重复条数)
+        """
+        inserted = 0
+        for col_id, columns in self.buffer.pop(source, {}).items():
+            partition_dir = get_partition_dir(self.output_root, col_id)
+            os.makedirs(partition_dir, exist_ok=True)
+            path = os.path.join(partition_dir, get_source_name(source) + FILE_SUFFIXES[self.file_format])
+            self.__write_table(self.__build_table(columns), path)
+            inserted += len(columns["id"])
+        self.seen_ids.pop(source, None)
+        return inserted, self.duplicates.pop(source, 0)
+
+    def build_deferred_indexes(self, col_id=None):
+        pass
+
+    def close(self):
+        if self.buffer:
+            # 没有收到完成消息的文件不写出，manifest 中也不会标记完成，下次运行会重新导入
+            print(f"[{datetime.datetime.now()}] 丢弃 {len(self.buffer)} 个未完成来源文件的缓冲")
+        self.buffer = {}
+        self.seen_ids = {}
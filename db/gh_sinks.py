@@ -0,0 +1,24 @@
+import config
+from db.columnar_gh_sink import GHArchiveColumnarSink
+from db.mongodb_gh_utilities import GHArchiveMongoDBUtil
+
+SINK_TYPES = ("mongodb", "parquet", "arrow")
+
+
+def create_sink(sink_type="mongodb", db_options=None, sink_output=None, metrics=None, metrics_labels=None):
+    """
+    创建 GHReceiver 使用的写入端，所有写入端都提供 insert_gh_records / insert_raw_records / flush /
+    pop_source_stats / build_deferred_indexes / close
+
+    mongodb：GHArchiveMongoDBUtil，db_options 为其构造参数
+    parquet / arrow：GHArchiveColumnarSink，按年月分区写到 sink_output 目录
+    """
+    if sink_type == "mongodb":
+        db_options = db_options if db_options is not None else {}
+        return GHArchiveMongoDBUtil(config.get_config("mongodb_conn_str"), metrics=metrics,
+                                    metrics_labels=metrics_labels, **db_options)
+    if sink_type in ("parquet", "arrow"):
+        if sink_output is None:
+            raise ValueError(f"sink_output is required for the {sink_type} sink")
+        return GHArchiveColumnarSink(sink_output, file_format=sink_type)
+    raise ValueError(f"unsupported sink type {sink_type}, expected one of {SINK_TYPES}")
@@ -1,34 +1,163 @@
 from pymongo import MongoClient, ASCENDING, UpdateOne
 from pymongo.errors import BulkWriteError
+import re
 import time
 import datetime
 
+SOURCE_COLLECTION_PATTERN = re.compile(r"^events_id_(\d{4})_(\d{2})(_neo)?$")
+# 记录每个月统计完成情况的集合（在 gharchive_count 库中）
+COUNT_STATUS_COLLECTION = "count_status"
+
+
+def get_sort_key(values):
+    """
+    把计数键 (proj_id, user_id, type) 换成可比较的元组，顺序与 MongoDB 的排序一致：
+    null（含字段缺失）< 数字 < 字符串；None 与字符串、整数代理键混在一起时不会抛出 TypeError
+    """
+    sort_key = []
+    for value in values:
+        if value is None:
+            sort_key.append((0, 0))
+        elif isinstance(value, (int, float)):
+            sort_key.append((1, value))
+        elif isinstance(value, str):
+            sort_key.append((2, value))
+        else:
+            sort_key.append((3, str(value)))
+    return tuple(sort_key)
+
+
+def get_count_collection_name(col_id):
+    # "2015_01_neo" -> "events_count_2015_01"
+    return f"events_count_{col_id[0:7]}"
+
+
+def create_count_collection(count_db, collection_name):
+    count_db.create_collection(collection_name)
+    # 为proj_id创建索引
+    count_db[collection_name].create_index([("proj_id", ASCENDING)])
+    # 为user_id创建索引
+    count_db[collection_name].create_index([("user_id", ASCENDING)])
+    # 为proj_id+type创建复合索引
+    count_db[collection_name].create_index([("proj_id", ASCENDING), ("type", ASCENDING)])
+    # 为user_id+type创建复合索引
+    count_db[collection_name].create_index([("user_id", ASCENDING), ("type", ASCENDING)])
+    # 为proj_id+user_id创建复合索引
+    count_db[collection_name].create_index([("proj_id", ASCENDING), ("user_id", ASCENDING)])
+    # 计数键的唯一索引（$merge 与 $inc upsert 使用）
+    count_db[collection_name].create_index([("proj_id", ASCENDING), ("user_id", ASCENDING), ("type", ASCENDING)],
+                                           unique=True)
+
 
 class GHArchiveMongoDBCountUtil:
-    def __init__(self, mongodb_conn_str):
+    def __init__(self, mongodb_conn_str, source_db_name='gharchive', target_db_name='gharchive_count'):
         self.mongo_client = MongoClient(mongodb_conn_str)
-        self.mongo_source_db = self.mongo_client['gharchive']
-        self.mongo_target_db = self.mongo_client['gharchive_count']
+        self.mongo_source_db = self.mongo_client[source_db_name]
+        self.mongo_target_db = self.mongo_client[target_db_name]
 
     def safe_create_target_collection(self, collection_name):
         if collection_name not in self.mongo_target_db.list_collection_names():
-            self.mongo_target_db.create_collection(collection_name)
-            # 为proj_id创建索引
-            self.mongo_target_db[collection_name].create_index([("proj_id", ASCENDING)])
-            # 为user_id创建索引
-            self.mongo_target_db[collection_name].create_index([("user_id", ASCENDING)])
-            # 为proj_id+type创建复合索引
-            self.mongo_target_db[collection_name].create_index([("proj_id", ASCENDING), ("type", ASCENDING)])
-            # 为user_id+type创建复合索引
-            self.mongo_target_db[collection_name].create_index([("user_id", ASCENDING), ("type", ASCENDING)])
-            # 为proj_id+user_id创建复合索引
-            self.mongo_target_db[collection_name].create_index([("proj_id", ASCENDING), ("user_id", ASCENDING)])
-
-    def count_events(self, source_collection_name, target_collection_name):
-        print(f"[{datetime.datetime.now()}] 开始处理集合 '{source_collection_name}' 到 '{target_collection_name}'")
+            create_count_collection(self.mongo_target_db, collection_name)
+
+    COUNT_MODES = ("merge", "stream", "list")
+
+    def reconcile(self, source_collection_name, target_collection_name, max_samples=10):
+        """
+        对比目标集合中的计数与源集合的完整重算结果（两边按键排序后归并比较，内存占用恒定）
+        返回 {"checked": ..., "mismatched": ..., "missing": ..., "extra": ..., "samples": [...]}
+        """
+        key_fields = ("proj_id", "user_id", "type")
+        recount = self.mongo_source_db[source_collection_name].aggregate([
+            {"$group": {
+                "_id": {"proj_id": "$proj_id", "user_id": "$user_id", "type": "$type"},
+                "count": {"$sum": 1}
+            }},
+            {"$sort": {"_id.proj_id": 1, "_id.user_id": 1, "_id.type": 1}}
+        ], allowDiskUse=True, batchSize=10000)
+        stored = self.mongo_target_db[target_collection_name].find(
+            {}, {"_id": 0, "proj_id": 1, "user_id": 1, "type": 1, "count": 1}
+        ).sort([(k, ASCENDING) for k in key_fields]).batch_size(10000)
+        report = {"checked": 0, "mismatched": 0, "missing": 0, "extra": 0, "samples": []}
+
+        def add_sample(kind, key, expected, actual):
+            if len(report["samples"]) < max_samples:
+                report["samples"].append({"kind": kind, "key": key, "expected": expected, "actual": actual})
+
+        expected_item = next(recount, None)
+        stored_item = next(stored, None)
+        while expected_item is not None or stored_item is not None:
+            expected_key = tuple(expected_item["_id"].get(k) for k in key_fields) if expected_item else None
+            stored_key = tuple(stored_item.get(k) for k in key_fields) if stored_item else None
+            if stored_key is None or (expected_key is not None
+                                      and get_sort_key(expected_key) < get_sort_key(stored_key)):
+                report["missing"] += 1
+                add_sample("missing", expected_key, expected_item["count"], None)
+                expected_item = next(recount, None)
+            elif expected_key is None or get_sort_key(stored_key) < get_sort_key(expected_key):
+                report["extra"] += 1
+                add_sample("extra", stored_key, None, stored_item.get("count"))
+                stored_item = next(stored, None)
+            else:
+                report["checked"] += 1
+                if expected_item["count"] != stored_item.get("count"):
+                    report["mismatched"] += 1
+                    add_sample("mismatched", expected_key, expected_item["count"], stored_item.get("count"))
+                expected_item = next(recount, None)
+                stored_item = next(stored, None)
+        print(f"[{datetime.datetime.now()}] 对账 '{source_collection_name}' -> '{target_collection_name}': "
+              f"一致 {report['checked'] - report['mismatched']}, 不一致 {report['mismatched']}, "
+              f"缺失 {report['missing']}, 多余 {report['extra']}")
+        return report
+
+    def discover_source_collections(self):
+        """
+        返回 [(source_collection_name, target_collection_name), ...]，按月份排序
+        同一个月同时存在 _neo 与非 _neo 集合时使用 _neo（insert_gh_record 对 2021 年及以前写入 _neo）
+        """
+        months = {}
+        for collection_name in self.mongo_source_db.list_collection_names():
+            match = SOURCE_COLLECTION_PATTERN.match(collection_name)
+            if match is None:
+                continue
+            year, month, neo = match.groups()
+            if (year, month) not in months or neo:
+                months[(year, month)] = collection_name
+        return [(months[key], get_count_collection_name(f"{key[0]}_{key[1]}")) for key in sorted(months)]
+
+    def is_counted(self, source_collection_name, target_collection_name):
+        # 已统计且源集合此后没有新增文档
+        status = self.mongo_target_db[COUNT_STATUS_COLLECTION].find_one({"_id": target_collection_name})
+        if status is None or status.get("source") != source_collection_name:
+            return False
+        return status.get("source_count") == self.mongo_source_db[source_collection_name].estimated_document_count()
+
+    def mark_counted(self, source_collection_name, target_collection_name, source_count, seconds, mode):
+        self.mongo_target_db[COUNT_STATUS_COLLECTION].replace_one(
+            {"_id": target_collection_name},
+            {"_id": target_collection_name, "source": source_collection_name, "source_count": source_count,
+             "seconds": seconds, "mode": mode, "completed_at": datetime.datetime.now(datetime.timezone.utc)},
+            upsert=True)
+
+    def ensure_count_key_index(self, collection_name):
+        # $merge 的 on 字段必须有唯一索引
+        self.mongo_target_db[collection_name].create_index(
+            [("proj_id", ASCENDING), ("user_id", ASCENDING), ("type", ASCENDING)], unique=True)
+
+    def count_events(self, source_collection_name, target_collection_name, mode="merge"):
+        """
+        统计 (proj_id, user_id, type) 的事件数写入 gharchive_count
+
+        mode="merge": 聚合结果由服务器直接 $merge 到目标集合，不经过客户端（需要 MongoDB 4.2+）
+        mode="stream": 逐批读取聚合游标并批量 upsert，内存只保留一个批次
+        mode="list": 旧实现，先把全部聚合结果读成列表再 upsert
+        返回 {"pipeline_seconds": ..., "insert_seconds": ..., "records": ...}
+        """
+        if mode not in self.COUNT_MODES:
+            raise ValueError(f"Unknown count mode '{mode}', expected one of {self.COUNT_MODES}")
+        print(f"[{datetime.datetime.now()}] 开始处理集合 '{source_collection_name}' 到 '{target_collection_name}' ({mode})")
         if source_collection_name not in self.mongo_source_db.list_collection_names():
             print(f"[{datetime.datetime.now()}] 集合 '{source_collection_name}' 不存在")
-            return
+            return None
         self.safe_create_target_collection(target_collection_name)
         source_collection = self.mongo_source_db[source_collection_name]
         target_collection = self.mongo_target_db[target_collection_name]
@@ -45,28 +174,48 @@ class GHArchiveMongoDBCountUtil:
                 "count": 1
             }}
         ]
-        
+
+        if mode == "merge":
+            self.ensure_count_key_index(target_collection_name)
+            pipeline.append({"$merge": {
+                "into": {"db": self.mongo_target_db.name, "coll": target_collection_name},
+                "on": ["proj_id", "user_id", "type"],
+                "whenMatched": "merge",
+                "whenNotMatched": "insert"
+            }})
+            pipeline_start_time = time.time()
+            source_collection.aggregate(pipeline, allowDiskUse=True)
+            pipeline_seconds = time.time() - pipeline_start_time
+            count = target_collection.estimated_document_count()
+            print(f"[{datetime.datetime.now()}] 集合 '{source_collection_name}' $merge 执行时间: {pipeline_seconds / 60:.2f} 分钟, "
+                  f"目标集合共 {count} 条记录")
+            return {"pipeline_seconds": pipeline_seconds, "insert_seconds": 0.0, "records": count}
+
         # 记录管道执行开始时间
         pipeline_start_time = time.time()
-        
+
         # 使用allowDiskUse=True和batchSize参数来优化aggregate操作
-        # 同时将结果转换为列表，避免长时间保持cursor打开
-        result = list(source_collection.aggregate(pipeline, allowDiskUse=True, batchSize=10000))
-        
-        # 记录管道执行结束时间
-        pipeline_end_time = time.time()
-        pipeline_time_minutes = (pipeline_end_time - pipeline_start_time) / 60
-        print(f"[{datetime.datetime.now()}] 集合 '{source_collection_name}' 管道执行时间: {pipeline_time_minutes:.2f} 分钟")
-        print(f"[{datetime.datetime.now()}] 聚合结果总数: {len(result)} 条记录")
-        
+        cursor = source_collection.aggregate(pipeline, allowDiskUse=True, batchSize=10000)
+        if mode == "list":
+            # 将结果转换为列表，避免长时间保持cursor打开
+            result = list(cursor)
+            # 记录管道执行结束时间
+            pipeline_seconds = time.time() - pipeline_start_time
+            print(f"[{datetime.datetime.now()}] 集合 '{source_collection_name}' 管道执行时间: {pipeline_seconds / 60:.2f} 分钟")
+            print(f"[{datetime.datetime.now()}] 聚合结果总数: {len(result)} 条记录")
+        else:
+            # 流式读取：聚合与写入交替进行，管道时间只计到第一批结果返回
+            result = cursor
+            pipeline_seconds = time.time() - pipeline_start_time
+
         # 记录插入操作开始时间
         insert_start_time = time.time()
-        
+
         # 使用批量写入方式，每次处理50000条记录
         bulk_operations = []
         batch_size = 50000
         count = 0
-        
+
         try:
             for item in result:
                 # 创建更新操作
@@ -81,26 +230,25 @@ class GHArchiveMongoDBCountUtil:
                 )
                 bulk_operations.append(update_operation)
                 count += 1
-                
+
                 # 当批量操作达到指定大小时，执行批量写入
                 if len(bulk_operations) >= batch_size:
-                    target_collection.bulk_write(bulk_operations)
+                    target_collection.bulk_write(bulk_operations, ordered=False)
                     print(f"[{datetime.datetime.now()}] 已处理 {count} 条记录")
                     bulk_operations = []
-            
+
             # 处理剩余的记录
             if bulk_operations:
-                target_collection.bulk_write(bulk_operations)
+                target_collection.bulk_write(bulk_operations, ordered=False)
                 print(f"[{datetime.datetime.now()}] 已处理 {count} 条记录")
         except BulkWriteError as bwe:
             print(f"[{datetime.datetime.now()}] 批量写入错误: {bwe.details}")
         except Exception as e:
             print(f"[{datetime.datetime.now()}] 处理过程中发生错误: {str(e)}")
-        
+
         # 记录插入操作结束时间
-        insert_end_time = time.time()
-        insert_time_minutes = (insert_end_time - insert_start_time) / 60
-        
+        insert_seconds = time.time() - insert_start_time
+
         # 打印执行时间，精确到分钟
-        print(f"[{datetime.datetime.now()}] 集合 '{target_collection_name}' 插入操作执行时间: {insert_time_minutes:.2f} 分钟")
-        
\ No newline at end of file
+        print(f"[{datetime.datetime.now()}] 集合 '{target_collection_name}' 插入操作执行时间: {insert_seconds / 60:.2f} 分钟")
+        return {"pipeline_seconds": pipeline_seconds, "insert_seconds": insert_seconds, "records": count}
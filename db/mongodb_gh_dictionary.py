@@ -0,0 +1,109 @@
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError
+
+# 字段 -> 维度集合，文档形如 {"_id": 整数代理键, "key": "github:owner/repo"}
+DIMENSION_COLLECTIONS = {"proj_id": "dim_proj", "user_id": "dim_user"}
+SEQUENCE_COLLECTION = "dim_sequence"
+
+
+class GHIdDictionary:
+    """
+    proj_id / user_id 字符串与整数代理键的双向映射
+
+    写入端在本地缓存已知的映射，只为缓存中没有的字符串查询或分配新键；
+    多个写入进程同时分配同一个字符串时，由 key 上的唯一索引保证只有一个生效
+    """
+
+    def __init__(self, mongo_db, max_cache_entries=5000000):
+        self.mongo_db = mongo_db
+        # 本地缓存上限（每个字段），超过后清空重新积累，避免长时间运行的写入进程内存无限增长
+        self.max_cache_entries = max_cache_entries
+        self.cache = {field: {} for field in DIMENSION_COLLECTIONS}
+        self.reverse_cache = {field: {} for field in DIMENSION_COLLECTIONS}
+        for collection_name in DIMENSION_COLLECTIONS.values():
+            self.mongo_db[collection_name].create_index([("key", ASCENDING)], unique=True)
+
+    def __remember(self, field, key, surrogate):
+        self.cache[field][key] = surrogate
+        self.reverse_cache[field][surrogate] = key
+
+    def __lookup(self, field, keys):
+        dimension = self.mongo_db[DIMENSION_COLLECTIONS[field]]
+        for i in range(0, len(keys), 10000):
+            for doc in dimension.find({"key": {"$in": keys[i:i + 10000]}}):
+                self.__remember(field, doc["key"], doc["_id"])
+
+    def __allocate(self, field, keys):
+        # 一次性为所有新字符串预留一段连续的整数
+        sequence = self.mongo_db[SEQUENCE_COLLECTION].find_one_and_update(
+            {"_id": field}, {"$inc": {"seq": len(keys)}}, upsert=True, return_document=ReturnDocument.AFTER)
+        first = sequence["seq"] - len(keys) + 1
+        docs = [{"_id": first + i, "key": key} for i, key in enumerate(keys)]
+        try:
+            self.mongo_db[DIMENSION_COLLECTIONS[field]].insert_many(docs, ordered=False)
+            for doc in docs:
+                self.__remember(field, doc["key"], doc["_id"])
+        except BulkWriteError as e:
+            # 其他写入进程抢先插入了部分字符串：成功的直接记住，冲突的重新查询
+            failed = {write_error["index"] for write_error in e.details["writeErrors"]}
+            for i, doc in enumerate(docs):
+                if i not in failed:
+                    self.__remember(field, doc["key"], doc["_id"])
+            self.__lookup(field, [docs[i]["key"] for i in failed])
+
+    def encode_many(self, field, keys):
+        if len(self.cache[field]) > self.max_cache_entries:
+            self.cache[field].clear()
+            self.reverse_cache[field].clear()
+        cache = self.cache[field]
+        missing = list({key for key in keys if key not in cache})
+        if missing:
+            self.__lookup(field, missing)
+            missing = [key for key in missing if key not in cache]
+            if missing:
+                self.__allocate(field, missing)
+        return cache
+
+    def encode_records(self, records):
+        """
+        把记录中的 proj_id / user_id 原地替换成整数代理键
+        """
+        for field in DIMENSION_COLLECTIONS:
+            cache = self.encode_many(field, [record[field] for record in records])
+            for record in records:
+                record[field] = cache[record[field]]
+        return records
+
+    def encode_filter(self, query):
+        """
+        把查询条件中的 proj_id / user_id 字符串（或 {"$in": [...]}）换成代理键，供读取端使用
+        """
+        encoded = dict(query)
+        for field in DIMENSION_COLLECTIONS:
+            if field not in query:
+                continue
+            value = query[field]
+            if isinstance(value, dict) and "$in" in value:
+                self.__lookup(field, [key for key in value["$in"] if key not in self.cache[field]])
+                encoded[field] = {"$in": [self.cache[field][key] for key in value["$in"] if key in self.cache[field]]}
+            else:
+                if value not in self.cache[field]:
+                    self.__lookup(field, [value])
+                # 字典中不存在的字符串不可能匹配任何事件
+                encoded[field] = self.cache[field].get(value, -1)
+        return encoded
+
+    def decode_records(self, docs):
+        """
+        读取端：把整数代理键换回字符串，原地修改并返回 docs
+        """
+        for field, collection_name in DIMENSION_COLLECTIONS.items():
+            reverse_cache = self.reverse_cache[field]
+            missing = list({doc[field] for doc in docs if field in doc and doc[field] not in reverse_cache})
+            for i in range(0, len(missing), 10000):
+                for dim_doc in self.mongo_db[collection_name].find({"_id": {"$in": missing[i:i + 10000]}}):
+                    self.__remember(field, dim_doc["key"], dim_doc["_id"])
+            for doc in docs:
+                if field in doc:
+                    doc[field] = reverse_cache.get(doc[field], doc[field])
+        return docs
@@ -0,0 +1,197 @@
+import datetime
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import ASCENDING, DESCENDING
+
+from db.mongodb_gh_count import SOURCE_COLLECTION_PATTERN
+from db.mongodb_gh_utilities import GHArchiveMongoDBUtil
+from utils.gharchive_time import UTC_FORMAT, normalize_created_at
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_BATCH_SIZE = 1000
+# 每个月份最多预取多少批结果，内存上限约为 max_workers * PREFETCH_BATCHES * batch_size 条事件
+PREFETCH_BATCHES = 4
+
+_END = object()
+
+
+def to_created_at(value):
+    """
+    把查询的时间边界统一成事件中 created_at 的格式 "YYYY-MM-DDTHH:MM:SSZ"
+    支持 datetime（无时区时视为 UTC）、"YYYY-MM"、"YYYY-MM-DD" 与带时区的完整时间字符串
+    """
+    if value is None:
+        return None
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc)
+        return value.strftime(UTC_FORMAT)
+    if len(value) == 7:
+        return f"{value}-01T00:00:00Z"
+    if len(value) == 10:
+        return f"{value}T00:00:00Z"
+    return normalize_created_at(value)
+
+
+class GHArchiveMongoDBQuery:
+    """
+    跨月份集合的读取接口：按时间范围找出相关的 events_id_YYYY_MM[_neo] 集合，用线程池并行查询，
+    按 created_at 的顺序流式返回事件。
+
+    每个集合只包含 created_at 落在该月的事件，各月份的时间范围互不重叠，所以按时间归并就是按月份顺序
+    依次输出各集合内部排好序的结果；后面的 max_workers - 1 个月份同时在后台预取，
+    每个月份最多缓存 PREFETCH_BATCHES 批，内存占用与月份总数无关。
+
+    compact_ids=True 时读取 gharchive_compact 库，过滤条件与结果中的 proj_id / user_id 自动与整数代理键互相转换
+
+    排序依赖 (created_at, id) 索引，否则每个月份都要先在服务器上整体排序才能返回第一批；
+    写入端默认不建该索引（time_index=False），使用读取接口前用 ensure_indexes 补建
+    """
+
+    def __init__(self, mongodb_conn_str=None, compact_ids=False, max_workers=DEFAULT_MAX_WORKERS, db_util=None):
+        # MongoClient 自带连接池，各查询线程共享同一个客户端
+        self.db_util = db_util if db_util is not None else GHArchiveMongoDBUtil(mongodb_conn_str,
+                                                                                compact_ids=compact_ids)
+        self.mongo_db = self.db_util.mongo_db
+        self.id_dictionary = self.db_util.id_dictionary
+        self.max_workers = max_workers
+
+    def resolve_collections(self, start=None, end=None):
+        """
+        返回 [start, end) 时间范围内实际存在的事件集合名，按月份升序；
+        集合名与写入端相同，由 GHArchiveMongoDBUtil.get_col_id 决定（2021 年及以前为 _neo）
+        """
+        start = to_created_at(start)
+        end = to_created_at(end)
+        collection_names = []
+        for collection_name in self.mongo_db.list_collection_names():
+            match = SOURCE_COLLECTION_PATTERN.match(collection_name)
+            if match is None:
+                continue
+            year, month, _ = match.groups()
+            if collection_name != f"events_id_{GHArchiveMongoDBUtil.get_col_id(f'{year}-{month}')}":
+                continue
+            if start is not None and f"{year}-{month}" < start[0:7]:
+                continue
+            if end is not None and f"{year}-{month}-01T00:00:00Z" >= end:
+                continue
+            collection_names.append(collection_name)
+        return sorted(collection_names)
+
+    def build_filter(self, start=None, end=None, proj_id=None, user_id=None, type=None, query=None):
+        event_filter = dict(query) if query is not None else {}
+        for field, value in (("proj_id", proj_id), ("user_id", user_id), ("type", type)):
+            if value is not None:
+                # 传入列表时匹配其中任意一个
+                event_filter[field] = {"$in": list(value)} if isinstance(value, (list, tuple, set)) else value
+        created_at = {}
+        if start is not None:
+            created_at["$gte"] = to_created_at(start)
+        if end is not None:
+            created_at["$lt"] = to_created_at(end)
+        if created_at:
+            event_filter["created_at"] = created_at
+        if self.id_dictionary is not None:
+            event_filter = self.id_dictionary.encode_filter(event_filter)
+        return event_filter
+
+    def ensure_indexes(self, start=None, end=None, num_workers=2):
+        """
+        为 [start, end) 内已有的月份集合补建缺失的索引（包括 (created_at, id)），返回处理的集合名
+        """
+        collection_names = self.resolve_collections(start, end)
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            list(executor.map(lambda name: self.db_util.create_indexes(name, time_index=True), collection_names))
+        return collection_names
+
+    @staticmethod
+    def __put(out_qu, item, stop):
+        # 消费端提前结束（limit、异常、生成器被关闭）时不再阻塞在已满的队列上
+        while not stop.is_set():
+            try:
+                out_qu.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __produce(self, collection_name, event_filter, projection, sort, batch_size, limit, out_qu, stop):
+        try:
+            cursor = self.mongo_db[collection_name].find(event_filter, projection).sort(sort) \
+                .batch_size(batch_size).allow_disk_use(True)
+            if limit is not None:
+                cursor = cursor.limit(limit)
+            with cursor:
+                batch = []
+                for doc in cursor:
+                    batch.append(doc)
+                    if len(batch) >= batch_size:
+                        if not self.__put(out_qu, batch, stop):
+                            return
+                        batch = []
+                if batch and not self.__put(out_qu, batch, stop):
+                    return
+            self.__put(out_qu, _END, stop)
+        except Exception as e:
+            self.__put(out_qu, e, stop)
+
+    def find_events(self, start=None, end=None, proj_id=None, user_id=None, type=None, query=None, projection=None,
+                    descending=False, limit=None, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        按 created_at 顺序（descending=True 时倒序）流式返回 [start, end) 内满足条件的事件
+
+        proj_id / user_id / type 可以是单个值或列表，query 为附加的 MongoDB 过滤条件；
+        例如 find_events(proj_id="github:owner/repo") 返回该仓库的完整历史
+        """
+        collection_names = self.resolve_collections(start, end)
+        if descending:
+            collection_names.reverse()
+        event_filter = self.build_filter(start, end, proj_id, user_id, type, query)
+        direction = DESCENDING if descending else ASCENDING
+        # id 作为第二排序键，同一秒内的事件顺序也是确定的
+        sort = [("created_at", direction), ("id", direction)]
+        stop = threading.Event()
+        out_qus = []
+        returned = 0
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            for i in range(len(collection_names)):
+                # 保持当前月份及其后 max_workers - 1 个月份在后台查询
+                while len(out_qus) < min(len(collection_names), i + self.max_workers):
+                    out_qu = queue.Queue(maxsize=PREFETCH_BATCHES)
+                    remaining = limit - returned if limit is not None else None
+                    executor.submit(self.__produce, collection_names[len(out_qus)], event_filter, projection, sort,
+                                    batch_size, remaining, out_qu, stop)
+                    out_qus.append(out_qu)
+                while True:
+                    batch = out_qus[i].get()
+                    if batch is _END:
+                        break
+                    if isinstance(batch, Exception):
+                        raise batch
+                    if self.id_dictionary is not None:
+                        self.id_dictionary.decode_records(batch)
+                    for doc in batch:
+                        yield doc
+                        returned += 1
+                        if limit is not None and returned >= limit:
+                            return
+                out_qus[i] = None
+        finally:
+            stop.set()
+            executor.shutdown(wait=True)
+
+    def count_events(self, start=None, end=None, proj_id=None, user_id=None, type=None, query=None):
+        """
+        并行统计每个月份集合中满足条件的事件数，返回 {collection_name: count}
+        """
+        collection_names = self.resolve_collections(start, end)
+        event_filter = self.build_filter(start, end, proj_id, user_id, type, query)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            counts = executor.map(lambda name: self.mongo_db[name].count_documents(event_filter), collection_names)
+            return dict(zip(collection_names, counts))
+
+    def close(self):
+        self.db_util.close()
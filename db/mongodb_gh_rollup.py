@@ -0,0 +1,347 @@
+import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import MongoClient, ASCENDING, UpdateOne
+
+from db.mongodb_gh_count import SOURCE_COLLECTION_PATTERN
+from db.mongodb_gh_dictionary import GHIdDictionary
+
+ROLLUP_DB_NAME = "gharchive_rollup"
+COMPACT_ROLLUP_DB_NAME = "gharchive_compact_rollup"
+# 由细到粗排列；day 是其余粒度的来源，总是会建立
+GRANULARITIES = ("day", "week", "month")
+DEFAULT_GRANULARITIES = ("day", "week")
+# 维度名 -> 事件中的字段
+ROLLUP_DIMENSIONS = {"proj": "proj_id", "user": "user_id"}
+# 有新事件、需要重新汇总的日期（UTC），文档形如 {"_id": "2015-01-01", "dirty_at": ...}
+DIRTY_COLLECTION = "rollup_dirty"
+DAY_FORMAT = "%Y-%m-%d"
+
+
+def get_rollup_collection_name(dimension, granularity):
+    # ("proj", "week") -> "rollup_proj_week"
+    return f"rollup_{dimension}_{granularity}"
+
+
+def to_day(value):
+    # 支持 date、datetime 与以 "YYYY-MM-DD" 开头的字符串
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date(int(value[0:4]), int(value[5:7]), int(value[8:10]))
+
+
+def bucket_start(day, granularity):
+    """
+    day 所在时间桶的第一天：week 从周一开始，month 从 1 号开始
+    """
+    if granularity == "week":
+        return day - datetime.timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket(day, granularity):
+    # 下一个时间桶的第一天，day 必须是某个桶的第一天
+    if granularity == "week":
+        return day + datetime.timedelta(days=7)
+    if granularity == "month":
+        return (day + datetime.timedelta(days=32)).replace(day=1)
+    return day + datetime.timedelta(days=1)
+
+
+def count_buckets(start, end, granularity):
+    count = 0
+    while start < end:
+        start = next_bucket(start, granularity)
+        count += 1
+    return count
+
+
+def merge_ranges(ranges):
+    # 合并相邻或重叠的 [start, end) 日期区间
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def plan_range(start, end, granularities=GRANULARITIES):
+    """
+    把 [start, end) 日期范围拆成 [(granularity, 段起点, 段终点), ...]，读取的文档数（桶数）最少：
+    中间整段用最粗的、能对齐的汇总，两端不足一个桶的部分用按日汇总；桶数相同时选择更粗的粒度
+    """
+    start = to_day(start)
+    end = to_day(end)
+    if start >= end:
+        return []
+    best = [("day", start, end)]
+    best_cost = (end - start).days
+    for granularity in GRANULARITIES:
+        if granularity == "day" or granularity not in granularities:
+            continue
+        first = bucket_start(start, granularity)
+        if first < start:
+            first = next_bucket(first, granularity)
+        last = bucket_start(end, granularity)
+        if first >= last:
+            continue
+        cost = (first - start).days + count_buckets(first, last, granularity) + (end - last).days
+        if cost <= best_cost:
+            segments = [("day", start, first), (granularity, first, last), ("day", last, end)]
+            best = [segment for segment in segments if segment[1] < segment[2]]
+            best_cost = cost
+    return best
+
+
+def mark_dirty_days(rollup_db, days):
+    """
+    把日期（"YYYY-MM-DD"）标记为需要重新汇总；写入端每批插入后调用，重复标记只更新 dirty_at
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    operations = [UpdateOne({"_id": day}, {"$set": {"dirty_at": now}}, upsert=True) for day in sorted(days)]
+    if operations:
+        rollup_db[DIRTY_COLLECTION].bulk_write(operations, ordered=False)
+
+
+def get_bucket_expression(granularity):
+    # 在聚合管道中把按日汇总的 bucket（"YYYY-MM-DD"）换算成所在周 / 月的第一天
+    if granularity == "month":
+        return {"$concat": [{"$substrCP": ["$bucket", 0, 7]}, "-01"]}
+    return {"$let": {
+        "vars": {"day": {"$dateFromString": {"dateString": "$bucket", "format": "%Y-%m-%d"}}},
+        "in": {"$dateToString": {"format": "%Y-%m-%d", "date": {"$subtract": [
+            "$$day", {"$multiply": [{"$subtract": [{"$isoDayOfWeek": "$$day"}, 1]}, 86400000]}]}}}
+    }}
+
+
+class GHArchiveMongoDBRollupUtil:
+    """
+    按时间桶物化的事件汇总：rollup_{proj|user}_{day|week|month} 集合中每个文档为
+    {proj_id 或 user_id, "bucket": 桶的第一天 "YYYY-MM-DD", "type", "count"}
+
+    按日汇总直接从月份事件集合聚合，周 / 月汇总再从按日汇总聚合；
+    refresh 只重新计算 rollup_dirty 中标记过的日期（写入端开启 rollup_tracking 时自动标记）及其所在的周 / 月，
+    结果以 $merge 写回（需要 MongoDB 4.2+）。查询时 plan_range 选出能回答该范围的最粗汇总
+    """
+
+    def __init__(self, mongodb_conn_str, source_db_name="gharchive", rollup_db_name=ROLLUP_DB_NAME,
+                 granularities=DEFAULT_GRANULARITIES, num_workers=4, compact_ids=False):
+        unknown = [granularity for granularity in granularities if granularity not in GRANULARITIES]
+        if unknown:
+            raise ValueError(f"Unknown granularities {unknown}, expected some of {GRANULARITIES}")
+        self.mongo_client = MongoClient(mongodb_conn_str)
+        self.mongo_source_db = self.mongo_client[source_db_name]
+        self.mongo_rollup_db = self.mongo_client[rollup_db_name]
+        self.granularities = tuple(g for g in GRANULARITIES if g == "day" or g in granularities)
+        self.num_workers = num_workers
+        # compact_ids 模式下汇总中的 proj_id / user_id 是整数代理键，查询时需要转换
+        self.id_dictionary = GHIdDictionary(self.mongo_source_db) if compact_ids else None
+        self.known_collections = None
+        self.indexed_sources = set()
+
+    def ensure_collections(self):
+        if self.known_collections is None:
+            self.known_collections = set(self.mongo_rollup_db.list_collection_names())
+        for dimension, field in ROLLUP_DIMENSIONS.items():
+            for granularity in self.granularities:
+                collection_name = get_rollup_collection_name(dimension, granularity)
+                if collection_name in self.known_collections:
+                    continue
+                collection = self.mongo_rollup_db[collection_name]
+                # $merge 的 on 字段必须有唯一索引；它同时服务于按项目 / 用户查询时间序列
+                collection.create_index([(field, ASCENDING), ("bucket", ASCENDING), ("type", ASCENDING)],
+                                        unique=True)
+                # 按时间桶重新汇总更粗的粒度、以及查询某一天最活跃的项目 / 用户
+                collection.create_index([("bucket", ASCENDING), (field, ASCENDING)])
+                self.known_collections.add(collection_name)
+                print(f"[{datetime.datetime.now()}] 汇总集合 {collection_name} 已创建")
+
+    def ensure_source_index(self, source_collection_name):
+        """
+        确保月份事件集合有 (created_at, id) 索引（与 GHArchiveMongoDBUtil.create_indexes 中的相同），
+        该索引加入之前建立的集合在第一次刷新时补建；索引已存在时 create_index 不做任何事
+        """
+        if source_collection_name in self.indexed_sources:
+            return
+        self.mongo_source_db[source_collection_name].create_index([("created_at", ASCENDING), ("id", ASCENDING)])
+        self.indexed_sources.add(source_collection_name)
+
+    def discover_source_collections(self):
+        """
+        返回 {"YYYY-MM": source_collection_name}；同一个月同时存在 _neo 与非 _neo 集合时使用 _neo
+        """
+        months = {}
+        for collection_name in self.mongo_source_db.list_collection_names():
+            match = SOURCE_COLLECTION_PATTERN.match(collection_name)
+            if match is None:
+                continue
+            year, month, neo = match.groups()
+            if f"{year}-{month}" not in months or neo:
+                months[f"{year}-{month}"] = collection_name
+        return months
+
+    def mark_dirty(self, start=None, end=None):
+        """
+        把 [start, end) 内的每一天标记为需要重新汇总，用于首次建立汇总或回填；
+        不指定时覆盖所有已存在的月份集合。返回标记的天数
+        """
+        months = sorted(self.discover_source_collections())
+        if not months:
+            return 0
+        start = to_day(start) if start is not None else to_day(f"{months[0]}-01")
+        end = to_day(end) if end is not None else next_bucket(to_day(f"{months[-1]}-01"), "month")
+        days = []
+        day = start
+        while day < end:
+            days.append(day.strftime(DAY_FORMAT))
+            day = next_bucket(day, "day")
+        for i in range(0, len(days), 1000):
+            mark_dirty_days(self.mongo_rollup_db, days[i:i + 1000])
+        return len(days)
+
+    def __merge_stage(self, dimension, granularity):
+        return {"$merge": {
+            "into": {"db": self.mongo_rollup_db.name, "coll": get_rollup_collection_name(dimension, granularity)},
+            "on": [ROLLUP_DIMENSIONS[dimension], "bucket", "type"],
+            "whenMatched": "merge",
+            "whenNotMatched": "insert"
+        }}
+
+    def __project_stage(self, dimension):
+        return {"$project": {"_id": 0, ROLLUP_DIMENSIONS[dimension]: "$_id.key", "bucket": "$_id.bucket",
+                             "type": "$_id.type", "count": 1}}
+
+    def refresh_days(self, source_collection_name, dimension, day_ranges):
+        """
+        从一个月份事件集合重新汇总 day_ranges（[[date, date), ...]）内的按日计数
+
+        $match 的日期范围走 (created_at, id) 索引，只读取这些天的事件，而不是整个月份集合；
+        每个维度各聚合一次，所以一次刷新读取的事件数约为脏日期内事件数的 len(ROLLUP_DIMENSIONS) 倍
+        """
+        field = ROLLUP_DIMENSIONS[dimension]
+        pipeline = [
+            {"$match": {"$or": [{"created_at": {"$gte": f"{start.strftime(DAY_FORMAT)}T00:00:00Z",
+                                                "$lt": f"{end.strftime(DAY_FORMAT)}T00:00:00Z"}}
+                                for start, end in day_ranges]}},
+            {"$group": {
+                "_id": {"key": f"${field}", "bucket": {"$substrCP": ["$created_at", 0, 10]}, "type": "$type"},
+                "count": {"$sum": 1}
+            }},
+            self.__project_stage(dimension),
+            self.__merge_stage(dimension, "day"),
+        ]
+        start_time = time.time()
+        self.mongo_source_db[source_collection_name].aggregate(pipeline, allowDiskUse=True)
+        return time.time() - start_time
+
+    def refresh_derived(self, dimension, granularity, bucket_ranges):
+        """
+        从按日汇总重新汇总 bucket_ranges 内的周 / 月计数
+        """
+        pipeline = [
+            {"$match": {"$or": [{"bucket": {"$gte": start.strftime(DAY_FORMAT), "$lt": end.strftime(DAY_FORMAT)}}
+                                for start, end in bucket_ranges]}},
+            {"$group": {
+                "_id": {"key": f"${ROLLUP_DIMENSIONS[dimension]}", "bucket": get_bucket_expression(granularity),
+                        "type": "$type"},
+                "count": {"$sum": "$count"}
+            }},
+            self.__project_stage(dimension),
+            self.__merge_stage(dimension, granularity),
+        ]
+        start_time = time.time()
+        self.mongo_rollup_db[get_rollup_collection_name(dimension, "day")].aggregate(pipeline, allowDiskUse=True)
+        return time.time() - start_time
+
+    def refresh(self):
+        """
+        重新汇总所有标记过的日期；刷新期间再次被标记的日期保留到下一次。返回刷新的天数
+        """
+        self.ensure_collections()
+        snapshot = datetime.datetime.now(datetime.timezone.utc)
+        dirty_collection = self.mongo_rollup_db[DIRTY_COLLECTION]
+        dirty_days = sorted(doc["_id"] for doc in dirty_collection.find({"dirty_at": {"$lte": snapshot}}, {"_id": 1}))
+        if not dirty_days:
+            print(f"[{datetime.datetime.now()}] 没有需要刷新的日期")
+            return 0
+        print(f"[{datetime.datetime.now()}] 刷新 {len(dirty_days)} 天: {dirty_days[0]} ~ {dirty_days[-1]}")
+        source_collections = self.discover_source_collections()
+        days_by_month = {}
+        for day in dirty_days:
+            days_by_month.setdefault(day[0:7], []).append(to_day(day))
+        day_tasks = []
+        for month, days in sorted(days_by_month.items()):
+            if month not in source_collections:
+                # 没有事件集合的月份不会有汇总，直接清除标记
+                continue
+            day_ranges = merge_ranges([(day, next_bucket(day, "day")) for day in days])
+            self.ensure_source_index(source_collections[month])
+            for dimension in ROLLUP_DIMENSIONS:
+                day_tasks.append((source_collections[month], dimension, day_ranges))
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            list(executor.map(lambda task: self.refresh_days(*task), day_tasks))
+        # 周 / 月汇总依赖按日汇总，必须在其之后
+        derived_tasks = []
+        for granularity in self.granularities[1:]:
+            bucket_ranges = merge_ranges([(bucket_start(to_day(day), granularity),
+                                           next_bucket(bucket_start(to_day(day), granularity), granularity))
+                                          for day in dirty_days])
+            for dimension in ROLLUP_DIMENSIONS:
+                derived_tasks.append((dimension, granularity, bucket_ranges))
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            list(executor.map(lambda task: self.refresh_derived(*task), derived_tasks))
+        dirty_collection.delete_many({"_id": {"$in": dirty_days}, "dirty_at": {"$lte": snapshot}})
+        print(f"[{datetime.datetime.now()}] 刷新完成: {len(day_tasks)} 个按日汇总任务, "
+              f"{len(derived_tasks)} 个周 / 月汇总任务")
+        return len(dirty_days)
+
+    def __key_filter(self, dimension, key, type=None):
+        field = ROLLUP_DIMENSIONS[dimension]
+        key_filter = {field: key}
+        if self.id_dictionary is not None:
+            key_filter = self.id_dictionary.encode_filter(key_filter)
+        if type is not None:
+            key_filter["type"] = type
+        return key_filter
+
+    def plan(self, start, end):
+        return plan_range(start, end, self.granularities)
+
+    def series(self, dimension, key, start, end, granularity="day", type=None):
+        """
+        返回 [(bucket, count), ...]：key（项目或用户）在 [start, end) 内每个时间桶的事件数，没有事件的桶不出现；
+        start 所在的桶按整桶返回，type 为 None 时汇总所有事件类型
+        """
+        if granularity not in self.granularities:
+            raise ValueError(f"Granularity {granularity} is not materialized, expected one of {self.granularities}")
+        query = self.__key_filter(dimension, key, type)
+        query["bucket"] = {"$gte": bucket_start(to_day(start), granularity).strftime(DAY_FORMAT),
+                           "$lt": to_day(end).strftime(DAY_FORMAT)}
+        counts = {}
+        collection = self.mongo_rollup_db[get_rollup_collection_name(dimension, granularity)]
+        for doc in collection.find(query, {"_id": 0, "bucket": 1, "count": 1}):
+            counts[doc["bucket"]] = counts.get(doc["bucket"], 0) + doc["count"]
+        return sorted(counts.items())
+
+    def total(self, dimension, key, start, end, type=None):
+        """
+        key 在 [start, end) 内的事件总数，按 plan 拆分到最粗的可用汇总上读取
+        """
+        count = 0
+        for granularity, segment_start, segment_end in self.plan(start, end):
+            query = self.__key_filter(dimension, key, type)
+            query["bucket"] = {"$gte": segment_start.strftime(DAY_FORMAT), "$lt": segment_end.strftime(DAY_FORMAT)}
+            collection = self.mongo_rollup_db[get_rollup_collection_name(dimension, granularity)]
+            for doc in collection.find(query, {"_id": 0, "count": 1}):
+                count += doc["count"]
+        return count
+
+    def close(self):
+        self.mongo_client.close()
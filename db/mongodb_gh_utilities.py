@@ -1,35 +1,108 @@
+import bisect
 import datetime
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-from pymongo import MongoClient, ASCENDING
+from bson.raw_bson import RawBSONDocument
+from pymongo import MongoClient, ASCENDING, UpdateOne
 from pymongo.errors import BulkWriteError
 
+from db.mongodb_gh_count import create_count_collection, get_count_collection_name
+from db.mongodb_gh_dictionary import GHIdDictionary
+from db.mongodb_gh_rollup import ROLLUP_DB_NAME, COMPACT_ROLLUP_DB_NAME, mark_dirty_days
+
+# compact_ids 模式（proj_id / user_id 存为整数代理键）使用单独的库，避免与字符串格式的集合混在一起
+COMPACT_DB_NAME = "gharchive_compact"
+COMPACT_COUNT_DB_NAME = "gharchive_compact_count"
+
 
 class GHArchiveMongoDBUtil:
+    # 自适应批大小：根据最近一次 insert_many 的耗时向目标耗时靠拢
+    MIN_BATCH_SIZE = 5000
+    MAX_BATCH_SIZE = 200000
+    TARGET_WRITE_SECONDS = 2.0
+    # insert_many 抛出 BulkWriteError 以外的异常（断线、超时、主节点切换等）时最多重试的次数
+    MAX_WRITE_RETRIES = 3
+    WRITE_RETRY_BACKOFF = 1.0
 
-    def __init__(self, mongodb_conn_str):
+    def __init__(self, mongodb_conn_str, async_write=False, max_in_flight=2, batch_size=50000, bulk_load=False,
+                 incremental_counts=False, compact_ids=False, metrics=None, metrics_labels=None, rollup_tracking=False,
+                 time_index=False):
+        """
+        async_write=True 时 insert_many 在后台线程执行，每个集合最多 max_in_flight 个写入同时进行，
+        填充下一批缓冲与当前的网络写入重叠
+        bulk_load=True 时新集合先不建索引，以事件 id 作为 _id 去重，月份完成后再建索引
+        incremental_counts=True 时每批实际插入的事件按 (proj_id, user_id, type) 以 $inc 累加到 gharchive_count
+        compact_ids=True 时 proj_id / user_id 经 GHIdDictionary 换成整数，写入 gharchive_compact 库
+        metrics 为 MetricsRecorder 时按集合记录插入数、重复数和 insert_many 耗时，metrics_labels 附加到每个指标上
+        rollup_tracking=True 时把每批实际插入的事件所在的日期标记到 rollup_dirty，供汇总增量刷新
+        time_index=True 时新集合同时建 (created_at, id) 索引，供按时间顺序读取；每次插入都要多维护一个索引，
+        不使用读取接口时保持关闭，需要时由 GHArchiveMongoDBQuery.ensure_indexes 补建
+        """
         self.mongo_client = MongoClient(mongodb_conn_str)
-        self.mongo_db = self.mongo_client['gharchive']
+        self.compact_ids = compact_ids
+        self.mongo_db = self.mongo_client[COMPACT_DB_NAME if compact_ids else 'gharchive']
         # for year in [2012, 2013, 2014, 2015, 2016, 2017, 2018, 2019, 2020, 2021, 2022, 2023, 2024, 2025]:
         #     for month in ["01", "02", "03", "04", "05", "06", "07", "08", "09", "10", "11", "12"]:
         #         collection_name = f"events_id_{year}_{month}"
         #         self.safe_create_collection_with_indexes(collection_name)
         self.buffer = {}
+        self.buffer_sources = {}
+        self.source_stats = {}
+        self.batch_size = batch_size
+        self.async_write = async_write
+        self.max_in_flight = max_in_flight
+        self.in_flight = {}
+        self.executor = None
+        if async_write:
+            self.executor = ThreadPoolExecutor(max_workers=max_in_flight * 4)
+        self.bulk_load = bulk_load
+        self.known_collections = None
+        self.ready_collections = set()
+        self.deferred_collections = set()
+        self.index_executor = None
+        self.incremental_counts = incremental_counts
+        self.count_db = self.mongo_client[COMPACT_COUNT_DB_NAME if compact_ids else 'gharchive_count']
+        self.id_dictionary = GHIdDictionary(self.mongo_db) if compact_ids else None
+        self.known_count_collections = None
+        self.metrics = metrics
+        self.metrics_labels = metrics_labels if metrics_labels is not None else {}
+        self.rollup_tracking = rollup_tracking
+        self.rollup_db = self.mongo_client[COMPACT_ROLLUP_DB_NAME if compact_ids else ROLLUP_DB_NAME]
+        self.time_index = time_index
 
     def safe_create_collection_with_indexes(self, collection_name):
         """
         安全地创建集合和索引（先检查集合是否存在）
+        集合与索引的状态缓存在进程内，只在第一次用到时查询一次服务器；
+        bulk_load 模式下只建集合，索引推迟到 build_deferred_indexes
         """
-        # 获取集合列表
-        collection_names = self.mongo_db.list_collection_names()
+        if collection_name in self.ready_collections:
+            return
+        # 获取集合列表（每个进程只取一次）
+        if self.known_collections is None:
+            self.known_collections = set(self.mongo_db.list_collection_names())
 
-        if collection_name not in collection_names:
+        if collection_name not in self.known_collections:
             # 显式创建集合（可以添加选项如 capped, size 等）
             self.mongo_db.create_collection(collection_name)
+            self.known_collections.add(collection_name)
             print(f"集合 {collection_name} 已创建")
-        else:
-            return
-            # print(f"集合 {collection_name} 已存在")
+            if self.bulk_load:
+                self.deferred_collections.add(collection_name)
+            else:
+                self.create_indexes(collection_name)
+        elif self.bulk_load and "id_1" not in self.mongo_db[collection_name].index_information():
+            # 上一次批量导入中断留下的无索引集合
+            self.deferred_collections.add(collection_name)
+        # print(f"集合 {collection_name} 已存在")
+        self.ready_collections.add(collection_name)
 
+    def create_indexes(self, collection_name, time_index=None):
+        """
+        time_index 为 None 时按构造参数决定是否建 (created_at, id) 索引
+        """
         collection = self.mongo_db[collection_name]
 
         # 定义要创建的索引
@@ -53,6 +126,9 @@ class GHArchiveMongoDBUtil:
                 "keys": [("user_id", ASCENDING), ("type", ASCENDING)],
             },
         ]
+        if time_index if time_index is not None else self.time_index:
+            # 按时间范围读取（GHArchiveMongoDBQuery 按 created_at, id 排序、汇总按日期范围刷新）走索引扫描
+            indexes_to_create.append({"keys": [("created_at", ASCENDING), ("id", ASCENDING)]})
 
         # 获取现有索引
         existing_indexes = collection.index_information()
@@ -74,21 +150,90 @@ class GHArchiveMongoDBUtil:
             else:
                 print(f"索引已存在: {index_name}")
 
-    def insert_gh_record(self, gh_record):
-        date_str = gh_record["created_at"]
-        year = date_str.split('-')[0]
-        month = date_str.split('-')[1]
+    def build_deferred_indexes(self, col_id=None):
+        """
+        为 bulk_load 模式下推迟建索引的集合建索引；col_id 为 None 时处理全部
+        索引在后台线程中建立，close() 会等待其完成
+        """
+        if col_id is None:
+            collection_names = sorted(self.deferred_collections)
+        else:
+            collection_names = [name for name in [f"events_id_{col_id}"] if name in self.deferred_collections]
+        for collection_name in collection_names:
+            self.deferred_collections.discard(collection_name)
+            if self.index_executor is None:
+                self.index_executor = ThreadPoolExecutor(max_workers=1)
+            print(f"[{datetime.datetime.now()}] 开始为 {collection_name} 建立索引")
+            self.index_executor.submit(self.create_indexes, collection_name)
+
+    @staticmethod
+    def get_col_id(created_at):
+        year = created_at[0:4]
+        month = created_at[5:7]
         if int(year) <= 2021:
-            col_id = f"{year}_{month}_neo"
+            return f"{year}_{month}_neo"
         else:
-            col_id = f"{year}_{month}"
-        return self.__buffer_flush(gh_record, col_id)
+            return f"{year}_{month}"
 
-    def __buffer_flush(self, extended_gh_record, col_id: str):
+    @staticmethod
+    def get_shard_idx(col_id, num_shards):
+        # 按月份轮转分配，相邻月份落在不同的写入进程上
+        return (int(col_id[0:4]) * 12 + int(col_id[5:7])) % num_shards
+
+    def insert_gh_record(self, gh_record, source=None):
+        col_id = self.get_col_id(gh_record["created_at"])
+        return self.__buffer_flush(gh_record, col_id, source)
+
+    def insert_gh_records(self, gh_records, source=None, col_ids=None):
+        """
+        col_ids 为解析时已经附上的、与 gh_records 一一对应的目标集合，给定时不再从 created_at 计算
+        """
+        inserted_ids = -1
+        write_errors = -1
+        for i, gh_record in enumerate(gh_records):
+            if col_ids is not None:
+                s, e = self.__buffer_flush(gh_record, col_ids[i], source)
+            else:
+                s, e = self.insert_gh_record(gh_record, source)
+            if s >= 0:
+                inserted_ids = max(inserted_ids, 0) + s
+                write_errors = max(write_errors, 0) + e
+        return inserted_ids, write_errors
+
+    def insert_raw_records(self, col_docs, source=None):
+        """
+        插入 worker 预先编码好的 BSON：{col_id: [bytes, ...]}，写入端不再解码或重新编码
+        """
+        if self.compact_ids:
+            raise ValueError("raw BSON input cannot be combined with compact_ids")
+        inserted_ids = -1
+        write_errors = -1
+        for col_id, raw_docs in col_docs.items():
+            for raw_doc in raw_docs:
+                s, e = self.__buffer_flush(RawBSONDocument(raw_doc), col_id, source)
+                if s >= 0:
+                    inserted_ids = max(inserted_ids, 0) + s
+                    write_errors = max(write_errors, 0) + e
+        return inserted_ids, write_errors
+
+    def __buffer_flush(self, extended_gh_record, col_id: str, source=None):
+        if self.bulk_load and not isinstance(extended_gh_record, RawBSONDocument):
+            # 没有唯一索引时由 _id 保证同一个事件只插入一次
+            extended_gh_record["_id"] = extended_gh_record["id"]
         if col_id not in self.buffer:
             self.buffer[col_id] = []
+            self.buffer_sources[col_id] = []
         self.buffer[col_id].append(extended_gh_record)
-        if len(self.buffer[col_id]) >= 50000:
+        # 以 [source, 条数] 的游程记录缓冲区中每段记录的来源文件
+        runs = self.buffer_sources[col_id]
+        if runs and runs[-1][0] == source:
+            runs[-1][1] += 1
+        else:
+            runs.append([source, 1])
+        if len(self.buffer[col_id]) >= self.batch_size:
+            if self.async_write:
+                self.__submit_insert_many(col_id)
+                return self.__collect_done()
             return self.__do_insert_many(col_id)
         else:
             return -1, -1
@@ -96,25 +241,173 @@ class GHArchiveMongoDBUtil:
     def get_collection(self, collection_name):
         return self.mongo_db[collection_name]
 
+    def pop_source_stats(self, source):
+        """
+        返回并清除某个来源文件在本进程中的 (插入条数, 重复条数)
+        """
+        return tuple(self.source_stats.pop(source, (0, 0)))
+
     def flush(self):
         inserted_ids = 0
         write_errors = 0
         for col_id in self.buffer:
             if len(self.buffer[col_id]) > 0:
-                s, e = self.__do_insert_many(col_id)
+                if self.async_write:
+                    self.__submit_insert_many(col_id)
+                else:
+                    s, e = self.__do_insert_many(col_id)
+                    inserted_ids += s
+                    write_errors += e
+        if self.async_write:
+            s, e = self.__collect_done(wait_all=True)
+            if s >= 0:
                 inserted_ids += s
                 write_errors += e
         return inserted_ids, write_errors
 
-    def __do_insert_many(self, col_id: str):
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        if self.index_executor is not None:
+            self.index_executor.shutdown(wait=True)
+        self.mongo_client.close()
+
+    def __adapt_batch_size(self, num_docs, seconds):
+        if num_docs < self.batch_size or seconds <= 0:
+            # 不满一批的 flush 不能反映满批的耗时
+            return
+        ratio = min(2.0, max(0.5, self.TARGET_WRITE_SECONDS / seconds))
+        self.batch_size = int(min(self.MAX_BATCH_SIZE, max(self.MIN_BATCH_SIZE, self.batch_size * ratio)))
+
+    def __take_buffer(self, col_id: str):
+        docs = self.buffer[col_id]
+        sources = self.buffer_sources[col_id]
+        self.buffer[col_id] = []
+        self.buffer_sources[col_id] = []
+        if self.id_dictionary is not None:
+            # 字典只在提交线程中使用，整批查询/分配代理键
+            self.id_dictionary.encode_records(docs)
+        return docs, sources
+
+    def __apply_count_deltas(self, col_id, docs, write_errors):
+        # 只统计真正插入的文档：重复 id（11000）等写入失败的文档不计数
+        failed = {write_error["index"] for write_error in write_errors}
+        deltas = {}
+        for i, doc in enumerate(docs):
+            if i not in failed:
+                key = (doc["proj_id"], doc["user_id"], doc["type"])
+                deltas[key] = deltas.get(key, 0) + 1
+        if not deltas:
+            return
+        count_collection_name = get_count_collection_name(col_id)
+        if self.known_count_collections is None:
+            self.known_count_collections = set(self.count_db.list_collection_names())
+        if count_collection_name not in self.known_count_collections:
+            create_count_collection(self.count_db, count_collection_name)
+            self.known_count_collections.add(count_collection_name)
+        operations = [UpdateOne({"proj_id": proj_id, "user_id": user_id, "type": type},
+                                {"$inc": {"count": count}}, upsert=True)
+                      for (proj_id, user_id, type), count in deltas.items()]
+        try:
+            self.count_db[count_collection_name].bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            print(f"[{datetime.datetime.now()}] 增量计数写入错误 {count_collection_name}: {e.details['writeErrors'][:3]}")
+
+    def __mark_rollup_dirty(self, docs, write_errors):
+        # 重复 id 等写入失败的文档不会改变汇总结果
+        failed = {write_error["index"] for write_error in write_errors}
+        days = {doc["created_at"][0:10] for i, doc in enumerate(docs) if i not in failed}
+        try:
+            mark_dirty_days(self.rollup_db, days)
+        except BulkWriteError as e:
+            print(f"[{datetime.datetime.now()}] 汇总标记写入错误: {e.details['writeErrors'][:3]}")
+
+    def __finish_write(self, col_id, docs, sources, inserted_ids, write_errors, seconds):
+        self.__adapt_batch_size(len(docs), seconds)
+        if self.incremental_counts:
+            self.__apply_count_deltas(col_id, docs, write_errors)
+        if self.rollup_tracking:
+            self.__mark_rollup_dirty(docs, write_errors)
+        # 按来源文件统计插入与重复（重复 id 的错误码为 11000），写入失败的文档不计入插入
+        run_ends = list(itertools.accumulate(count for _, count in sources))
+        for source, count in sources:
+            self.source_stats.setdefault(source, [0, 0])[0] += count
+        for write_error in write_errors:
+            stats = self.source_stats[sources[bisect.bisect_right(run_ends, write_error["index"])][0]]
+            stats[0] -= 1
+            if write_error.get("code") == 11000:
+                stats[1] += 1
+        if self.metrics is not None:
+            duplicates = sum(1 for write_error in write_errors if write_error.get("code") == 11000)
+            labels = dict(self.metrics_labels, collection=col_id)
+            self.metrics.inc("gharchive_inserted_docs_total", inserted_ids, **labels)
+            self.metrics.inc("gharchive_duplicates_total", duplicates, **labels)
+            self.metrics.inc("gharchive_write_errors_total", len(write_errors) - duplicates, **labels)
+            self.metrics.observe("gharchive_bulk_write_seconds", seconds, **labels)
+        return inserted_ids, len(write_errors)
+
+    def __submit_insert_many(self, col_id: str):
         events_collection_name = f"events_id_{col_id}"
+        # 建集合和索引在提交线程里完成，避免多个写入线程同时建同一个集合
         self.safe_create_collection_with_indexes(events_collection_name)
-        print(f"[{datetime.datetime.now()}] Do insert many {events_collection_name}")
+        docs, sources = self.__take_buffer(col_id)
+        writes = self.in_flight.setdefault(col_id, [])
+        # 达到单集合的并发上限时等待最早的一个写入完成
+        while len([w for w in writes if not w[0].done()]) >= self.max_in_flight:
+            wait([w[0] for w in writes], return_when=FIRST_COMPLETED)
+        writes.append((self.executor.submit(self.__insert_docs, events_collection_name, docs), docs, sources, 0))
+
+    @staticmethod
+    def __failed_write_errors(docs, e):
+        # 重试用尽时整批计为写入失败（非重复），与 BulkWriteError 的 writeErrors 格式相同
+        return [{"index": i, "code": None, "errmsg": f"{type(e).__name__}: {e}"} for i in range(len(docs))]
+
+    def __collect_done(self, wait_all=False):
+        inserted_ids = -1
+        write_errors = -1
+        for col_id in self.in_flight:
+            writes = self.in_flight[col_id]
+            while True:
+                if wait_all:
+                    wait([w[0] for w in writes])
+                pending = []
+                for future, docs, sources, attempts in writes:
+                    if not future.done():
+                        pending.append((future, docs, sources, attempts))
+                        continue
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        if attempts < self.MAX_WRITE_RETRIES:
+                            # 失败的写入从 in_flight 中移除，原样重新提交
+                            print(f"[{datetime.datetime.now()}] 写入 events_id_{col_id} 失败，重试 "
+                                  f"{attempts + 1}/{self.MAX_WRITE_RETRIES}: {type(e).__name__}: {e}")
+                            time.sleep(self.WRITE_RETRY_BACKOFF * 2 ** attempts)
+                            pending.append((self.executor.submit(self.__insert_docs, f"events_id_{col_id}", docs),
+                                            docs, sources, attempts + 1))
+                            continue
+                        print(f"[{datetime.datetime.now()}] 写入 events_id_{col_id} 失败 {len(docs)} 条，放弃: "
+                              f"{type(e).__name__}: {e}")
+                        result = (0, self.__failed_write_errors(docs, e), 0)
+                    s, e = self.__finish_write(col_id, docs, sources, *result)
+                    inserted_ids = max(inserted_ids, 0) + s
+                    write_errors = max(write_errors, 0) + e
+                writes = pending
+                # wait_all 时等到重新提交的写入也全部结束
+                if not wait_all or not writes:
+                    break
+            self.in_flight[col_id] = writes
+        return inserted_ids, write_errors
+
+    def __insert_docs(self, events_collection_name, docs):
+        print(f"[{datetime.datetime.now()}] Do insert many {events_collection_name} ({len(docs)})")
         collection = self.mongo_db[events_collection_name]
+        start_time = time.time()
         try:
-            result = collection.insert_many(self.buffer[col_id], ordered=False)
+            result = collection.insert_many(docs, ordered=False)
             # print(f"成功插入 {len(result.inserted_ids)} 个文档")
-            inserted_ids = len(result.inserted_ids)
+            # RawBSONDocument 不会出现在 result.inserted_ids 中，按文档数计数
+            inserted_ids = len(docs)
             write_errors = []
         except BulkWriteError as e:
             # 获取成功插入的文档
@@ -123,8 +416,25 @@ class GHArchiveMongoDBUtil:
             #
             # print(f"成功插入 {inserted_ids} 个文档")
             # print(f"有 {len(write_errors)} 个文档插入失败")
-        finally:
-            self.buffer[col_id] = []
-        return inserted_ids, len(write_errors)
+        return inserted_ids, write_errors, time.time() - start_time
+
+    def __do_insert_many(self, col_id: str):
+        events_collection_name = f"events_id_{col_id}"
+        self.safe_create_collection_with_indexes(events_collection_name)
+        docs, sources = self.__take_buffer(col_id)
+        for attempts in range(self.MAX_WRITE_RETRIES + 1):
+            try:
+                result = self.__insert_docs(events_collection_name, docs)
+                break
+            except Exception as e:
+                if attempts < self.MAX_WRITE_RETRIES:
+                    print(f"[{datetime.datetime.now()}] 写入 {events_collection_name} 失败，重试 "
+                          f"{attempts + 1}/{self.MAX_WRITE_RETRIES}: {type(e).__name__}: {e}")
+                    time.sleep(self.WRITE_RETRY_BACKOFF * 2 ** attempts)
+                    continue
+                print(f"[{datetime.datetime.now()}] 写入 {events_collection_name} 失败 {len(docs)} 条，放弃: "
+                      f"{type(e).__name__}: {e}")
+                result = (0, self.__failed_write_errors(docs, e), 0)
+        return self.__finish_write(col_id, docs, sources, *result)
 
 # singleton_gh_mongo = GHArchiveMongoDBUtil(config.get_config("mongodb_conn_str"))
\ No newline at end of file
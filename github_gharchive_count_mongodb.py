@@ -1,10 +1,90 @@
+import argparse
+import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
 from db.mongodb_gh_count import GHArchiveMongoDBCountUtil
+from db.mongodb_gh_utilities import COMPACT_DB_NAME, COMPACT_COUNT_DB_NAME
 import config
 
-count_db_util = GHArchiveMongoDBCountUtil(config.get_config("mongodb_conn_str"))
+_count_db_utils = {}
+
+
+def get_count_db_util(compact=False):
+    # 每个进程一个 MongoClient（线程之间共享）
+    if compact not in _count_db_utils:
+        if compact:
+            _count_db_utils[compact] = GHArchiveMongoDBCountUtil(config.get_config("mongodb_conn_str"),
+                                                                 COMPACT_DB_NAME, COMPACT_COUNT_DB_NAME)
+        else:
+            _count_db_utils[compact] = GHArchiveMongoDBCountUtil(config.get_config("mongodb_conn_str"))
+    return _count_db_utils[compact]
+
+
+def count_month(source_collection_name, target_collection_name, count_mode, compact=False):
+    count_db_util = get_count_db_util(compact)
+    # 先取源集合的文档数，统计期间新写入的文档会让下次运行重新统计该月
+    source_count = count_db_util.mongo_source_db[source_collection_name].estimated_document_count()
+    start_time = time.time()
+    result = count_db_util.count_events(source_collection_name, target_collection_name, count_mode)
+    seconds = time.time() - start_time
+    if result is not None:
+        count_db_util.mark_counted(source_collection_name, target_collection_name, source_count, seconds, count_mode)
+    return seconds
+
+
+def exec(num_workers=4, count_mode="merge", use_processes=False, force=False, compact=False):
+    count_db_util = get_count_db_util(compact)
+    months = count_db_util.discover_source_collections()
+    if not force:
+        # 断点续跑：跳过已统计完成、且源集合没有变化的月份
+        pending = [(s, t) for s, t in months if not count_db_util.is_counted(s, t)]
+        print(f"[{datetime.datetime.now()}] 发现 {len(months)} 个月份，{len(months) - len(pending)} 个已统计，跳过")
+        months = pending
+    executor_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    exec_start_time = time.time()
+    month_seconds = {}
+    with executor_cls(max_workers=num_workers) as executor:
+        futures = {executor.submit(count_month, s, t, count_mode, compact): s for s, t in months}
+        for future in as_completed(futures):
+            source_collection_name = futures[future]
+            try:
+                month_seconds[source_collection_name] = future.result()
+                print(f"[{datetime.datetime.now()}] 完成 {source_collection_name}: "
+                      f"{month_seconds[source_collection_name] / 60:.2f} 分钟 ({len(month_seconds)}/{len(months)})")
+            except Exception as e:
+                print(f"[{datetime.datetime.now()}] 统计失败 {source_collection_name}: {e}")
+    print("每个月份的耗时:")
+    for source_collection_name in sorted(month_seconds):
+        print(f"  {source_collection_name}: {month_seconds[source_collection_name] / 60:.2f} 分钟")
+    print(f"Terminated at {datetime.datetime.now()}, total time cost {(time.time() - exec_start_time) / 3600:.2f} hours.")
+
+
+def reconcile(num_workers=4, compact=False):
+    # 增量计数与完整重算的对账
+    count_db_util = get_count_db_util(compact)
+    months = count_db_util.discover_source_collections()
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        reports = list(executor.map(lambda m: (m[0], count_db_util.reconcile(m[0], m[1])), months))
+    bad = [(s, r) for s, r in reports if r["mismatched"] or r["missing"] or r["extra"]]
+    print(f"对账完成: {len(reports)} 个月份，{len(bad)} 个月份不一致")
+    for source_collection_name, report in bad:
+        print(f"  {source_collection_name}: {report}")
+
 
-for year in range(2011, 2021):
-    for month in range(1, 13):
-        if year == 2020 and month >= 11:
-            break
-        count_db_util.count_events(f"events_id_{year}_{month:02d}_neo", f"events_count_{year}_{month:02d}")
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="并行统计每个月的 (proj_id, user_id, type) 事件数")
+    arg_parser.add_argument("--num-workers", type=int, default=4, help="同时统计的月份数")
+    # merge: 服务器端 $merge（MongoDB 4.2+）；stream: 流式游标 + 批量 upsert；list: 旧实现
+    arg_parser.add_argument("--mode", choices=GHArchiveMongoDBCountUtil.COUNT_MODES,
+                            default=config.get_config("count_mode", "merge"))
+    arg_parser.add_argument("--processes", action="store_true",
+                            help="使用进程池（stream/list 模式下客户端 CPU 是瓶颈时）")
+    arg_parser.add_argument("--force", action="store_true", help="重新统计所有月份")
+    arg_parser.add_argument("--reconcile", action="store_true", help="只对比已有计数与完整重算结果，不写入")
+    arg_parser.add_argument("--compact", action="store_true", help="统计 compact_ids 模式写入的库")
+    args = arg_parser.parse_args()
+    if args.reconcile:
+        reconcile(args.num_workers, args.compact)
+    else:
+        exec(args.num_workers, args.mode, args.processes, args.force, args.compact)
@@ -1,13 +1,27 @@
+import argparse
 import multiprocessing
 import gzip
 import os.path
+import queue
+import signal
 import time
+from multiprocessing.managers import SyncManager
 
-from utils import gharchive_receiver, gharchive_gzreader
+from db.gh_sinks import SINK_TYPES
+from db.mongodb_gh_utilities import GHArchiveMongoDBUtil
+from utils import gharchive_receiver, gharchive_gzreader, gharchive_downloader, gharchive_flow, gharchive_metrics, \
+    task_planner
+from utils.ingest_manifest import IngestManifest
 import datetime
 import config
 
-do_inverse = False
+# 任务顺序：oldest 从最早开始回填，recent 最近优先，mixed 两端交替
+priority = "oldest"
+# 新的小时文件在该小时结束后多久开始尝试下载
+publish_delay_minutes = 10
+# follow 模式下失败文件的重试间隔与次数
+retry_interval_minutes = 30
+retry_limit = 3
 
 
 def check_ok(file_path):
@@ -19,89 +33,263 @@ def check_ok(file_path):
         return False
 
 
-def before_current_time(year, month, day, hour):
-    # determine if the input time in UTC 0 is before the current system time
+def generate_file_urls(start_year, end_year, completed_file_names=(), priority=priority, now=None):
+    return task_planner.plan_file_urls(start_year, end_year, completed_file_names, priority, now)
+
+
+def get_manifest_path():
+    manifest_path = config.get_config("manifest_path", None)
+    if manifest_path is None:
+        manifest_path = os.path.splitext(config.get_config("complete_log_path"))[0] + ".manifest.sqlite"
+    return manifest_path
+
+
+def get_metrics_snapshot_path(manifest_path):
+    metrics_snapshot_path = config.get_config("metrics_snapshot_path", None)
+    if metrics_snapshot_path is None:
+        metrics_snapshot_path = os.path.splitext(manifest_path)[0] + ".metrics.json"
+    return metrics_snapshot_path
+
+
+def open_manifest(manifest_path):
+    manifest = IngestManifest(manifest_path)
+    if not manifest.completed_file_names():
+        # 第一次使用 manifest 时导入旧的 complete_log
+        complete_log_path = config.get_config("complete_log_path", None)
+        imported = manifest.import_complete_log(complete_log_path)
+        if imported:
+            print(f"[{datetime.datetime.now()}] 从 {complete_log_path} 导入 {imported} 条完成记录")
+    return manifest
+
+
+def count_pending_files_per_month(file_urls):
+    month_file_counts = {}
+    for file_url in file_urls:
+        col_id = GHArchiveMongoDBUtil.get_col_id(os.path.basename(file_url))
+        month_file_counts[col_id] = month_file_counts.get(col_id, 0) + 1
+    return month_file_counts
+
+
+def follow_new_hours(task_qu, completion_qu, manifest_path, last_scheduled_hour, tracked_file_urls=(),
+                     poll_seconds=60):
+    """
+    常驻调度：last_scheduled_hour 为回填计划的最后一个小时，此后每个小时文件发布后立即放入任务队列
+    （回填运行期间发布的小时在第一次循环时补上），只跟踪最近调度的文件，不再扫描历史。
+    tracked_file_urls 为回填已放入任务队列、但可能在发布前就被调度的文件，同样跟踪其完成与重试。
+    Ctrl-C 或 SIGTERM 停止调度后返回，由调用方排空各阶段
+    """
+    manifest = IngestManifest(manifest_path)
+    publish_delay = datetime.timedelta(minutes=publish_delay_minutes)
+    retry_interval = datetime.timedelta(minutes=retry_interval_minutes)
+    # file_url -> [已调度次数, 调度时间]；只跟踪确实放入过任务队列的文件
+    started_at = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    scheduled = {file_url: [1, started_at] for file_url in tracked_file_urls}
+    # SIGTERM 与 Ctrl-C 一样结束调度循环，子进程忽略 SIGINT，由这里统一排空
+    previous_sigterm = signal.signal(signal.SIGTERM, signal.default_int_handler)
     try:
-        input_time = time.strptime(f"{year}-{month:02d}-{day:02d} {hour}:00:00", "%Y-%m-%d %H:%M:%S")
-    except:
-        return 0
-    current_time = time.gmtime()
-    rounded_current_time = time.strptime(time.strftime("%Y-%m-%d %H:00:00", current_time), "%Y-%m-%d %H:%M:%S")
-    if input_time >= rounded_current_time:
-        return 1
-    else:
-        return 2
-
-
-def generate_file_urls(start_year, end_year):
-    file_urls = []
-    for year in range(start_year, end_year + 1):
-        for month in range(1, 13):
-            for day in range(1, 32):
-                for hour in range(24):
-                    bct_res = before_current_time(year, month, day, hour)
-                    if bct_res == 1:
-                        return file_urls
-                    elif bct_res == 2:
-                        file_url = f"http://data.gharchive.org/{year}-{month:02d}-{day:02d}-{hour}.json.gz"
-                        if do_inverse:
-                            file_urls.insert(0, file_url)
+        while True:
+            now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+            # 小时 H 在 H+1:00 结束，再等 publish_delay 后发布
+            while last_scheduled_hour + datetime.timedelta(hours=2) + publish_delay <= now:
+                last_scheduled_hour += datetime.timedelta(hours=1)
+                file_url = task_planner.hour_file_url(last_scheduled_hour)
+                task_qu.put(file_url)
+                completion_qu.put({"type": "tasks_added", "content": 1})
+                scheduled[file_url] = [1, now]
+                print(f"[{datetime.datetime.now()}] Follow: 新任务 {file_url}")
+            # 只检查最近调度过的文件：完成的移除，失败的按间隔重试
+            if scheduled:
+                states = manifest.get_states(os.path.basename(file_url) for file_url in scheduled)
+                for file_url in list(scheduled):
+                    completed, failed_at = states.get(os.path.basename(file_url), (0, None))
+                    attempts, scheduled_at = scheduled[file_url]
+                    if completed:
+                        del scheduled[file_url]
+                    elif failed_at is not None and now - scheduled_at >= retry_interval:
+                        if attempts >= retry_limit:
+                            print(f"[{datetime.datetime.now()}] Follow: 放弃 {file_url}")
+                            del scheduled[file_url]
                         else:
-                            file_urls.append(file_url)
-    return file_urls
+                            task_qu.put(file_url)
+                            completion_qu.put({"type": "tasks_added", "content": 1})
+                            scheduled[file_url] = [attempts + 1, now]
+            time.sleep(poll_seconds)
+    except KeyboardInterrupt:
+        print(f"[{datetime.datetime.now()}] Follow: 停止调度，等待已调度的文件写入完成")
+    finally:
+        signal.signal(signal.SIGTERM, previous_sigterm)
+        manifest.close()
 
 
-def load_completed(complete_log_path):
-    completed_list = set()
-    try:
-        if not os.path.exists(complete_log_path):
-            return completed_list
-        with open(complete_log_path, "r", encoding="utf-8") as fd:
-            for line in fd:
-                completed_list.add(line.strip())
-    except Exception as e:
-        print(e)
-    return completed_list
+def drop_pending_tasks(task_qu):
+    dropped = 0
+    while True:
+        try:
+            task_qu.get_nowait()
+        except queue.Empty:
+            return dropped
+        dropped += 1
 
 
-def exec(start_year, end_year, num_process=10):
+def exec(start_year, end_year, num_process=10, num_writers=1, async_write=True, bulk_load=False, priority=priority,
+         follow=False, num_download_threads=8, prefetch=16, incremental_counts=False, compact_ids=False,
+         raw_bson=False, memory_budget_mb=gharchive_flow.DEFAULT_MEMORY_BUDGET_MB, metrics_port=0,
+         metrics_interval=30, profile_dir=None, sink="mongodb", sink_output=None, rollup_tracking=False,
+         time_index=False):
+    if follow and bulk_load:
+        raise ValueError("bulk_load cannot be combined with follow mode")
+    if sink != "mongodb":
+        if bulk_load or incremental_counts or compact_ids or rollup_tracking or time_index:
+            raise ValueError("bulk_load, incremental_counts, compact_ids, rollup_tracking and time_index "
+                             "only apply to the mongodb sink")
+        if sink_output is None:
+            sink_output = config.get_config("columnar_output_root")
+    if raw_bson and compact_ids:
+        # 代理键需要在写入端改写文档，预编码的 BSON 无法再修改
+        raise ValueError("raw_bson cannot be combined with compact_ids")
+    if follow:
+        # follow 模式从回填的最后一个小时接着调度，回填必须覆盖到当前年份
+        end_year = max(end_year, datetime.datetime.now(datetime.timezone.utc).year)
     # 设置下载的起始年份和结束年份
     start_year = start_year
     end_year = end_year
     print(f"[{datetime.datetime.now()}] 开始处理 {start_year} 到 {end_year} 年的文件")
-    file_urls = generate_file_urls(start_year, end_year)
-    complete_log_path = config.get_config("complete_log_path")
-    completed_list = load_completed(complete_log_path)
+    manifest_path = get_manifest_path()
+    manifest = open_manifest(manifest_path)
+    # 只把 manifest 中尚未完成的文件放进任务队列；follow 模式用同一个时间点确定回填的最后一个小时
+    plan_now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    file_urls = generate_file_urls(start_year, end_year, manifest.completed_file_names(), priority, plan_now)
+    manifest.close()
 
     exec_start_time = time.time()
+    # Manager 与其他子进程都忽略 SIGINT，Ctrl-C 只由主进程处理，否则排空时各进程已被中断
+    manager = SyncManager()
+    manager.start(gharchive_flow.ignore_sigint)
     # put tasks into queue and assemble the arg dicts
-    task_qu = multiprocessing.Manager().Queue()
+    task_qu = manager.Queue()
     for file_url in file_urls:
         task_qu.put(file_url)
-    total_length = task_qu.qsize()
-    # create and start message receiving worker
-    msg_qu = multiprocessing.Manager().Queue()
-    msg_rec = gharchive_receiver.GHReceiver(complete_log_path, msg_qu, total_length)
-    msg_rec.start()
+    total_length = len(file_urls)
+    # create and start message receiving workers, one queue per writer shard
+    msg_qus = [manager.Queue() for _ in range(num_writers)]
+    # 解析进程发出、写入进程尚未处理完的消息总字节数不超过内存预算
+    memory_budget = gharchive_flow.MemoryBudget(manager, memory_budget_mb * 1024 * 1024)
+    # 各阶段把指标增量推送到 metrics_qu，由 GHMetricsCollector 汇总输出
+    metrics_qu = manager.Queue()
+    completion_qu = manager.Queue()
+    tracker = gharchive_receiver.GHCompletionTracker(manifest_path, completion_qu, total_length, num_writers,
+                                                     msg_qus)
+    tracker.start()
+    download_root = config.get_config("download_root")
+    quarantine_root = gharchive_gzreader.get_quarantine_root()
+    # bulk_load 模式：先插入无索引的集合，每个月的文件全部完成后再建索引
+    db_options = {"async_write": async_write, "bulk_load": bulk_load, "incremental_counts": incremental_counts,
+                  "compact_ids": compact_ids, "rollup_tracking": rollup_tracking, "time_index": time_index}
+    month_file_counts = count_pending_files_per_month(file_urls) if bulk_load else None
+    msg_recs = []
+    for shard_idx in range(num_writers):
+        msg_rec = gharchive_receiver.GHReceiver(msg_qus[shard_idx], completion_qu, shard_idx, db_options,
+                                                month_file_counts, memory_budget, metrics_qu, profile_dir,
+                                                sink_type=sink, sink_output=sink_output)
+        msg_rec.start()
+        msg_recs.append(msg_rec)
+    # start the download stage: at most `prefetch` downloaded files wait on disk for the parse workers
+    ready_qu = manager.Queue(prefetch)
+    sampled_queues = {"ready": ready_qu, "tasks": task_qu}
+    for shard_idx, msg_qu in enumerate(msg_qus):
+        sampled_queues[f"writer_{shard_idx}"] = msg_qu
+    metrics_collector = gharchive_metrics.GHMetricsCollector(metrics_qu, get_metrics_snapshot_path(manifest_path),
+                                                             metrics_port, metrics_interval, sampled_queues,
+                                                             memory_budget)
+    metrics_collector.start()
+    downloader = gharchive_downloader.PrefetchDownloader(task_qu, ready_qu, download_root, manifest_path,
+                                                         num_download_threads, num_process, follow,
+                                                         metrics_queue=metrics_qu, profile_dir=profile_dir)
+    downloader.start()
     # start main workers
     arg_list = []
     for i in range(num_process):
         arg_list.append(
-            {"task_queue": task_qu, "message_queue": msg_qu, "worker_idx": i,
-             "download_root": config.get_config("download_root"), "complated_list": completed_list})
-    print(f"Starting {num_process} workers on {total_length} projects")
-    with multiprocessing.Pool(num_process) as p:
-        p.map(gharchive_gzreader.gz_reader, arg_list)
-    msg_qu.put({"type": "terminate", "content": None})
-    msg_rec.join()
+            {"ready_queue": ready_qu, "message_queues": msg_qus, "worker_idx": i, "manifest_path": manifest_path,
+             "raw_bson": raw_bson, "bulk_load": bulk_load, "memory_budget": memory_budget,
+             "metrics_queue": metrics_qu, "profile_dir": profile_dir, "quarantine_root": quarantine_root})
+    print(f"Starting {num_download_threads} download threads, {num_process} workers and {num_writers} writers "
+          f"on {total_length} projects")
+    with multiprocessing.Pool(num_process, initializer=gharchive_flow.ignore_sigint) as p:
+        if follow:
+            result = p.map_async(gharchive_gzreader.gz_reader, arg_list)
+            last_hour = task_planner.last_planned_hour(end_year, plan_now)
+            last_file_url = task_planner.hour_file_url(last_hour)
+            # 最后一个回填的小时可能在发布前就被调度，只有确实放入了任务队列才需要跟踪
+            tracked_file_urls = [last_file_url] if last_file_url in file_urls else []
+            follow_new_hours(task_qu, completion_qu, manifest_path, last_hour, tracked_file_urls)
+            for _ in range(num_download_threads):
+                task_qu.put(None)
+            result.wait()
+        else:
+            result = p.map_async(gharchive_gzreader.gz_reader, arg_list)
+            try:
+                result.wait()
+            except KeyboardInterrupt:
+                # 丢弃尚未开始下载的任务，已下载的文件照常解析写入，下次运行从 manifest 继续
+                dropped = drop_pending_tasks(task_qu)
+                print(f"[{datetime.datetime.now()}] 中断：丢弃 {dropped} 个未开始的任务，等待已开始的文件写入完成")
+                result.wait()
+            result.get()
+    downloader.join()
+    for msg_qu in msg_qus:
+        msg_qu.put({"type": "terminate", "content": None})
+    for msg_rec in msg_recs:
+        msg_rec.join()
+    completion_qu.put({"type": "terminate", "content": None})
+    tracker.join()
+    metrics_qu.put({"type": "terminate", "content": None})
+    metrics_collector.join()
+    manager.shutdown()
     total_exec_time = (time.time() - exec_start_time) / 3600
     print(
         f"Terminated at {datetime.datetime.now()}, total time cost {total_exec_time:.2f} hours.")
 
 
 if __name__ == "__main__":
-    exec(2012, 2014, 20)
-    # while True:
-    #     year = datetime.datetime.now().year
-    #     exec(2011, int(year), 20)
-    #     time.sleep(30 * 60)  # 30min
+    arg_parser = argparse.ArgumentParser(description="Build an indexed gharchive database")
+    arg_parser.add_argument("--start-year", type=int, default=2012)
+    arg_parser.add_argument("--end-year", type=int, default=2014)
+    arg_parser.add_argument("--num-process", type=int, default=20, help="解析进程数")
+    arg_parser.add_argument("--num-download-threads", type=int, default=8)
+    arg_parser.add_argument("--prefetch", type=int, default=16, help="提前下载好、等待解析的文件数上限")
+    arg_parser.add_argument("--num-writers", type=int, default=4)
+    arg_parser.add_argument("--priority", choices=task_planner.PRIORITIES, default=priority)
+    arg_parser.add_argument("--bulk-load", action="store_true")
+    arg_parser.add_argument("--incremental-counts", action="store_true",
+                            help="导入时把实际插入的事件按 (proj_id, user_id, type) 累加到 gharchive_count")
+    arg_parser.add_argument("--compact-ids", action="store_true",
+                            help="proj_id / user_id 以整数代理键写入 gharchive_compact 库")
+    arg_parser.add_argument("--rollup-tracking", action="store_true",
+                            help="导入时标记有新事件的日期，供 github_gharchive_rollup_mongodb.py 增量刷新按日 / 周汇总")
+    arg_parser.add_argument("--time-index", action="store_true",
+                            help="新的月份集合同时建 (created_at, id) 索引，供按时间顺序读取；每次插入多维护一个索引")
+    arg_parser.add_argument("--raw-bson", action="store_true",
+                            help="解析进程直接编码 BSON，写入进程以 RawBSONDocument 插入，不再解码重编码")
+    arg_parser.add_argument("--memory-budget-mb", type=int, default=gharchive_flow.DEFAULT_MEMORY_BUDGET_MB,
+                            help="解析进程与写入进程之间排队消息的内存上限（MB），超出时解析进程阻塞")
+    arg_parser.add_argument("--metrics-port", type=int, default=0,
+                            help="在 127.0.0.1 上提供 Prometheus 文本格式 /metrics 的端口，0 表示不启动")
+    arg_parser.add_argument("--metrics-interval", type=int, default=30, help="写出 JSON 指标快照的间隔（秒）")
+    arg_parser.add_argument("--profile", default=None, metavar="DIR",
+                            help="在下载、解析和写入进程中开启采样分析，定期输出到 DIR，"
+                                 "用 github_gharchive_profile_report.py 汇总")
+    arg_parser.add_argument("--sink", choices=SINK_TYPES, default="mongodb",
+                            help="写入端：mongodb，或按年月分区的 parquet / arrow 列式文件")
+    arg_parser.add_argument("--sink-output", default=None,
+                            help="列式文件的输出目录，默认使用 config.yaml 中的 columnar_output_root")
+    arg_parser.add_argument("--follow", action="store_true",
+                            help="回填完成后继续运行，每个新的小时文件发布后立即导入")
+    args = arg_parser.parse_args()
+    exec(args.start_year, args.end_year, args.num_process, args.num_writers, bulk_load=args.bulk_load,
+         priority=args.priority, follow=args.follow, num_download_threads=args.num_download_threads,
+         prefetch=args.prefetch, incremental_counts=args.incremental_counts,
+         compact_ids=args.compact_ids, raw_bson=args.raw_bson,
+         memory_budget_mb=args.memory_budget_mb, metrics_port=args.metrics_port,
+         metrics_interval=args.metrics_interval, profile_dir=args.profile, sink=args.sink,
+         sink_output=args.sink_output, rollup_tracking=args.rollup_tracking, time_index=args.time_index)
@@ -0,0 +1,93 @@
+import argparse
+import glob
+import json
+import os
+
+# 按调用栈从叶子往根找到的第一个匹配的帧归类；匹配的是帧标签 "函数 (模块路径:行)"，
+# 模块路径从顶层包开始（如 dateutil/parser/_parser.py），"dateutil/" 这类模式覆盖包内所有嵌套模块
+CATEGORIES = (
+    ("timestamp", ("gharchive_time.py", "dateutil/", "_strptime.py")),
+    ("hashing", ("generate_sha_hash", "hashlib")),
+    ("json", ("json/",)),
+    ("bson", ("bson/", "encode_raw_records")),
+    ("mongo", ("pymongo/", "db/mongodb_gh_")),
+    ("ipc", ("multiprocessing/", "pickle", "gharchive_flow.py")),
+    ("gzip", ("gzip.py", "isal/", "_compression.py")),
+    ("download", ("pySmartDL/", "urllib/", "http/client.py", "smart_download")),
+)
+
+
+def load_profiles(profile_dir, process_prefix=None):
+    profiles = []
+    for path in sorted(glob.glob(os.path.join(profile_dir, "*.json"))):
+        with open(path, "r", encoding="utf-8") as fd:
+            profile = json.load(fd)
+        if process_prefix is None or profile["process"].startswith(process_prefix):
+            profiles.append(profile)
+    return profiles
+
+
+def merge_stacks(profiles):
+    stacks = {}
+    for profile in profiles:
+        for stack, count in profile["stacks"].items():
+            stacks[stack] = stacks.get(stack, 0) + count
+    return stacks
+
+
+def categorize(frames):
+    for frame in reversed(frames):
+        for category, patterns in CATEGORIES:
+            if any(pattern in frame for pattern in patterns):
+                return category
+    return "other"
+
+
+def summarize(stacks):
+    """
+    返回 (自身样本数, 累计样本数, 分类样本数)：自身只算栈顶的帧，累计对每个栈中出现的帧只算一次
+    """
+    self_counts = {}
+    total_counts = {}
+    category_counts = {}
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        self_counts[frames[-1]] = self_counts.get(frames[-1], 0) + count
+        for frame in set(frames):
+            total_counts[frame] = total_counts.get(frame, 0) + count
+        category = categorize(frames)
+        category_counts[category] = category_counts.get(category, 0) + count
+    return self_counts, total_counts, category_counts
+
+
+def print_table(title, counts, total_samples, top):
+    print(title)
+    for label, count in sorted(counts.items(), key=lambda x: -x[1])[:top]:
+        print(f"  {count / total_samples * 100:6.2f}%  {count:>9}  {label}")
+    print()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="合并 --profile 输出的采样文件，生成热点函数报告")
+    arg_parser.add_argument("profile_dir")
+    arg_parser.add_argument("--process", default=None, help="只统计名称以此开头的进程，例如 parse / writer")
+    arg_parser.add_argument("--top", type=int, default=25)
+    arg_parser.add_argument("--collapsed", default=None, help="另外写出 flamegraph 可用的 collapsed 栈文件")
+    args = arg_parser.parse_args()
+
+    profiles = load_profiles(args.profile_dir, args.process)
+    if not profiles:
+        print(f"No profiles found in {args.profile_dir}")
+        exit(1)
+    stacks = merge_stacks(profiles)
+    total_samples = sum(stacks.values())
+    processes = sorted({f"{p['process']}-{p['pid']}" for p in profiles})
+    print(f"{len(profiles)} profile files from {len(processes)} processes, {total_samples} stack samples\n")
+    self_counts, total_counts, category_counts = summarize(stacks)
+    print_table("By category (innermost matching frame):", category_counts, total_samples, args.top)
+    print_table("Hot functions (self):", self_counts, total_samples, args.top)
+    print_table("Hot functions (cumulative):", total_counts, total_samples, args.top)
+    if args.collapsed is not None:
+        with open(args.collapsed, "w", encoding="utf-8") as fd:
+            for stack, count in sorted(stacks.items()):
+                fd.write(f"{stack} {count}\n")
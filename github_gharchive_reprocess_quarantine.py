@@ -0,0 +1,98 @@
+import argparse
+import datetime
+import json
+
+from db.gh_sinks import SINK_TYPES, create_sink
+from utils.gharchive_gzreader import get_quarantine_root
+from utils.gharchive_normalizer import GHArchiveNormalizer, unparseable_reason
+from utils.quarantine import iter_quarantine_files, read_quarantine_file, write_quarantine_file, \
+    REASON_EXCEPTION, REASON_JSON_ERROR, REASON_WRITE_ERROR
+
+
+def reprocess_entries(entries):
+    """
+    用当前的解析代码重新解析隔离的行，返回 (records, col_ids, record_entries, 仍然失败的条目, 跳过的行数)
+    record_entries 与 records 一一对应，是解析出该记录的隔离条目
+    """
+    # 隔离的行来自同一个小时文件，共用一个 normalizer
+    normalizer = GHArchiveNormalizer()
+    records = []
+    col_ids = []
+    record_entries = []
+    still_failing = []
+    skipped = 0
+    for entry in entries:
+        try:
+            record = json.loads(entry["line"])
+        except ValueError as e:
+            still_failing.append(dict(entry, reason=REASON_JSON_ERROR, error=f"{type(e).__name__}: {e}"))
+            continue
+        try:
+            if record["type"] == "GistEvent":
+                # 与导入时一样忽略 GistEvent
+                skipped += 1
+                continue
+            normalized = normalizer.normalize(record)
+        except Exception as e:
+            still_failing.append(dict(entry, reason=REASON_EXCEPTION, error=f"{type(e).__name__}: {e}"))
+            continue
+        if normalized is None:
+            still_failing.append(dict(entry, reason=unparseable_reason(record), error=None))
+            continue
+        records.append(normalized[0])
+        col_ids.append(normalized[1])
+        record_entries.append(entry)
+    return records, col_ids, record_entries, still_failing, skipped
+
+
+def exec(quarantine_root, pattern="*", sink="mongodb", sink_output=None, dry_run=False):
+    files = iter_quarantine_files(quarantine_root, pattern)
+    print(f"[{datetime.datetime.now()}] {len(files)} 个隔离文件: {quarantine_root}")
+    writer = None if dry_run else create_sink(sink, sink_output=sink_output)
+    total_entries = 0
+    total_recovered = 0
+    total_skipped = 0
+    total_inserted = 0
+    for path in files:
+        entries = read_quarantine_file(path)
+        records, col_ids, record_entries, still_failing, skipped = reprocess_entries(entries)
+        total_entries += len(entries)
+        total_skipped += skipped
+        if records and writer is not None:
+            # 以单独的来源名写入，列式写入端不会覆盖该小时原有的输出文件
+            source = f"{entries[0]['source'].replace('.json.gz', '')}-quarantine.json.gz"
+            writer.insert_gh_records(records, source, col_ids)
+            writer.flush()
+            inserted, duplicates = writer.pop_source_stats(source)
+            total_inserted += inserted
+            if inserted + duplicates < len(records):
+                # 写入端不报告是哪几条失败，整批保留在隔离区，下次重新处理时已写入的会计为重复
+                write_failed = len(records) - inserted - duplicates
+                still_failing += [dict(entry, reason=REASON_WRITE_ERROR, error=None) for entry in record_entries]
+                print(f"[{datetime.datetime.now()}] {path}: {write_failed} 条写入失败，"
+                      f"{len(records)} 条解析成功的行保留在隔离区")
+            print(f"[{datetime.datetime.now()}] {path}: 恢复 {len(entries) - len(still_failing) - skipped}/"
+                  f"{len(entries)} 行, 跳过 {skipped} 行, 插入 {inserted} 条, 重复 {duplicates} 条")
+        else:
+            print(f"[{datetime.datetime.now()}] {path}: 可恢复 {len(entries) - len(still_failing) - skipped}/"
+                  f"{len(entries)} 行, 跳过 {skipped} 行")
+        total_recovered += len(entries) - len(still_failing) - skipped
+        if not dry_run:
+            # 只保留仍然无法解析或没有写入的行；跳过的 GistEvent 与导入时一样丢弃
+            write_quarantine_file(path, still_failing)
+    if writer is not None:
+        writer.close()
+    print(f"[{datetime.datetime.now()}] 共 {total_entries} 行，恢复 {total_recovered} 行，跳过 {total_skipped} 行，"
+          f"插入 {total_inserted} 条")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="修复解析代码后，只重新导入隔离区中的行，而不必重新导入整个小时文件")
+    arg_parser.add_argument("--quarantine-root", default=None, help="默认使用 config.yaml 中的 quarantine_root")
+    arg_parser.add_argument("--pattern", default="*", help="只处理匹配的小时，例如 2012-08-*")
+    arg_parser.add_argument("--sink", choices=SINK_TYPES, default="mongodb")
+    arg_parser.add_argument("--sink-output", default=None, help="parquet / arrow 写入端的输出目录")
+    arg_parser.add_argument("--dry-run", action="store_true", help="只统计能恢复多少行，不写入也不修改隔离文件")
+    args = arg_parser.parse_args()
+    quarantine_root = args.quarantine_root if args.quarantine_root is not None else get_quarantine_root()
+    exec(quarantine_root, args.pattern, args.sink, args.sink_output, args.dry_run)
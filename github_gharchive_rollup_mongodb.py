@@ -0,0 +1,48 @@
+import argparse
+import datetime
+import time
+
+from db.mongodb_gh_rollup import GHArchiveMongoDBRollupUtil, GRANULARITIES, DEFAULT_GRANULARITIES, \
+    ROLLUP_DB_NAME, COMPACT_ROLLUP_DB_NAME, plan_range
+from db.mongodb_gh_utilities import COMPACT_DB_NAME
+import config
+
+
+def get_rollup_db_util(granularities, num_workers=4, compact=False):
+    if compact:
+        return GHArchiveMongoDBRollupUtil(config.get_config("mongodb_conn_str"), COMPACT_DB_NAME,
+                                          COMPACT_ROLLUP_DB_NAME, granularities, num_workers, compact_ids=True)
+    return GHArchiveMongoDBRollupUtil(config.get_config("mongodb_conn_str"), "gharchive", ROLLUP_DB_NAME,
+                                      granularities, num_workers)
+
+
+def exec(granularities=DEFAULT_GRANULARITIES, num_workers=4, rebuild=False, start=None, end=None, compact=False):
+    rollup_db_util = get_rollup_db_util(granularities, num_workers, compact)
+    if rebuild or start is not None or end is not None:
+        # 首次建立汇总、修改粒度或回填历史数据后，重新汇总指定范围（默认全部月份）
+        days = rollup_db_util.mark_dirty(start, end)
+        print(f"[{datetime.datetime.now()}] 标记 {days} 天需要重新汇总")
+    exec_start_time = time.time()
+    rollup_db_util.refresh()
+    rollup_db_util.close()
+    print(f"Terminated at {datetime.datetime.now()}, total time cost {(time.time() - exec_start_time) / 60:.2f} minutes.")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="增量刷新按日 / 周（/ 月）的项目与用户事件汇总")
+    arg_parser.add_argument("--granularities", nargs="+", choices=GRANULARITIES,
+                            default=config.get_config("rollup_granularities", list(DEFAULT_GRANULARITIES)),
+                            help="要物化的粒度，day 总会建立")
+    arg_parser.add_argument("--num-workers", type=int, default=4, help="同时执行的聚合数")
+    arg_parser.add_argument("--rebuild", action="store_true", help="重新汇总所有月份")
+    arg_parser.add_argument("--start", default=None, help="只重新汇总从该日期（YYYY-MM-DD）开始的数据")
+    arg_parser.add_argument("--end", default=None, help="只重新汇总到该日期（不含）为止的数据")
+    arg_parser.add_argument("--compact", action="store_true", help="汇总 compact_ids 模式写入的库")
+    arg_parser.add_argument("--plan", nargs=2, metavar=("START", "END"), default=None,
+                            help="只打印查询 [START, END) 时使用的汇总，不连接数据库")
+    args = arg_parser.parse_args()
+    if args.plan is not None:
+        for granularity, segment_start, segment_end in plan_range(args.plan[0], args.plan[1], args.granularities):
+            print(f"{granularity:>5}: {segment_start} ~ {segment_end}")
+    else:
+        exec(args.granularities, args.num_workers, args.rebuild, args.start, args.end, args.compact)
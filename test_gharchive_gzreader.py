@@ -0,0 +1,88 @@
+import gzip
+import json
+import os
+import queue
+import tempfile
+
+from db.mongodb_gh_utilities import GHArchiveMongoDBUtil
+from utils.gharchive_gzreader import unzip2queue
+
+
+def make_events(n):
+    # 两个月份的事件，分别路由到不同的写入分片
+    events = []
+    for i in range(n):
+        month = 1 + i % 2
+        events.append({"id": str(i), "type": "PushEvent", "repo": {"name": f"owner/repo{i % 7}"},
+                       "actor": {"login": f"user{i % 5}"}, "payload": {},
+                       "created_at": f"2016-{month:02d}-01T00:00:{i % 60:02d}Z"})
+    return events
+
+
+def write_gz(path, events):
+    with gzip.open(path, "wt", encoding="utf-8") as fd:
+        for event in events:
+            fd.write(json.dumps(event) + "\n")
+
+
+def drain(qus):
+    ids = []
+    completes = []
+    for qu in qus:
+        while not qu.empty():
+            msg = qu.get()
+            if msg["type"] == "records":
+                ids.extend(record["id"] for record in msg["content"]["records"])
+            elif msg["type"] == "complete":
+                completes.append(msg["content"]["events_parsed"])
+    return ids, completes
+
+
+def test_retry_after_partial_stream_sends_only_the_tail():
+    # 解压流按 1MB 缓冲读取，文件要足够大，截断前才会先发出若干批次
+    events = make_events(20000)
+    # 确认两个月份确实落在不同分片上
+    assert len({GHArchiveMongoDBUtil.get_shard_idx(GHArchiveMongoDBUtil.get_col_id(f"2016-0{m}"), 2)
+                for m in (1, 2)}) == 2
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "2016-01-01-0.json.gz")
+        write_gz(path, events)
+        with open(path, "rb") as fd:
+            data = fd.read()
+        # 第一次读到的文件在流中间截断：已经发出若干批次后解压失败
+        with open(path, "wb") as fd:
+            fd.write(data[:len(data) * 3 // 4])
+        qus = [queue.Queue(), queue.Queue()]
+        sent_counts = [0, 0]
+        assert not unzip2queue(path, qus, batch_size=500, sent_counts=sent_counts)
+        first_ids, first_completes = drain(qus)
+        assert first_ids and not first_completes
+        assert sum(sent_counts) == len(first_ids)
+        # 重新下载到完整的文件后再次解析，只发送剩下的记录
+        with open(path, "wb") as fd:
+            fd.write(data)
+        assert unzip2queue(path, qus, batch_size=500, sent_counts=sent_counts)
+        second_ids, completes = drain(qus)
+        assert not set(first_ids) & set(second_ids)
+        assert sorted(first_ids + second_ids, key=int) == [event["id"] for event in events]
+        # 完成消息中的解析条数仍是整个文件的事件数
+        assert completes == [len(events), len(events)]
+
+
+def test_retry_with_shorter_file_fails():
+    events = make_events(100)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "2016-01-01-0.json.gz")
+        write_gz(path, events)
+        qus = [queue.Queue()]
+        # 上一次已发送的记录比这次文件中的还多，无法对应，不能当作成功
+        assert not unzip2queue(path, qus, batch_size=20, sent_counts=[len(events) + 1])
+        _, completes = drain(qus)
+        assert not completes
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_"):
+            func()
+            print(f"{name} ok")
@@ -0,0 +1,184 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import utils.github_api as github_api
+import utils.token_manager as tm
+
+
+class FakeGitHub:
+    """
+    本地的 GitHub API 替身：
+    /repos/<n>        带 ETag 的 200，If-None-Match 匹配时返回 304（不扣额度）
+    /flaky/<n>        前 n 次返回 500，之后 200
+    /throttled/<n>    第一次返回 429 + Retry-After: n，之后 200
+    /limited/<n>      第一次返回额度耗尽的 403（X-RateLimit-Reset 在 n 秒后），之后 200
+    /missing          404
+    每个请求处理时睡 delay 秒，用来测量并发数
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.hits = {}
+        self.statuses = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.client_ports = set()
+        self.remaining = 5000
+        self.throttled_at = {}
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 才能保持连接
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                with fake.lock:
+                    fake.in_flight += 1
+                    fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+                    fake.client_ports.add(self.client_address[1])
+                    hits = fake.hits[self.path] = fake.hits.get(self.path, 0) + 1
+                time.sleep(fake.delay)
+                status, headers, body = fake.route(self.path, hits, self.headers)
+                with fake.lock:
+                    fake.in_flight -= 1
+                    fake.statuses.append(status)
+                    if status != 304:
+                        fake.remaining -= 1
+                    remaining = fake.remaining
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                if "X-RateLimit-Remaining" not in headers:
+                    self.send_header("X-RateLimit-Limit", "5000")
+                    self.send_header("X-RateLimit-Remaining", str(remaining))
+                    self.send_header("X-RateLimit-Reset", str(int(time.time()) + 3600))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def route(self, path, hits, request_headers):
+        parts = path.strip("/").split("/")
+        if parts[0] == "repos":
+            body = f'{{"name": "{parts[1]}"}}'.encode()
+            etag = f'"{hashlib.sha1(body).hexdigest()}"'
+            if request_headers.get("If-None-Match") == etag:
+                return 304, {"ETag": etag}, b""
+            return 200, {"ETag": etag, "Content-Type": "application/json; charset=utf-8"}, body
+        if parts[0] == "flaky":
+            if hits <= int(parts[1]):
+                return 500, {}, b"error"
+            return 200, {}, b'{"ok": true}'
+        if parts[0] == "throttled":
+            if hits == 1:
+                self.throttled_at[path] = time.time()
+                return 429, {"Retry-After": parts[1]}, b"slow down"
+            return 200, {"X-Retried-After": str(time.time() - self.throttled_at[path])}, b'{"ok": true}'
+        if parts[0] == "limited":
+            if hits == 1:
+                self.throttled_at[path] = time.time()
+                return 403, {"X-RateLimit-Limit": "60", "X-RateLimit-Remaining": "0",
+                             "X-RateLimit-Reset": str(int(time.time()) + int(parts[1]))}, b"rate limit exceeded"
+            return 200, {"X-Retried-After": str(time.time() - self.throttled_at[path])}, b'{"ok": true}'
+        return 404, {}, b"not found"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def new_fetcher(**kwargs):
+    return github_api.GitHubFetcher(token_manager=tm.TokenManager(["t1", "t2"]), backoff_base=0.01, **kwargs)
+
+
+def test_concurrent_pooled_fetch():
+    fake = FakeGitHub(delay=0.2)
+    fetcher = new_fetcher(max_workers=4)
+    urls = [f"{fake.base_url}/repos/{i}" for i in range(16)]
+    start = time.time()
+    responses = fetcher.fetch_many(urls)
+    seconds = time.time() - start
+    assert [r.json()["name"] for r in responses] == [str(i) for i in range(16)]
+    # 16 个请求、4 个并发、每个 0.2s：约 0.8s，而串行需要 3.2s
+    assert fake.max_in_flight == 4, fake.max_in_flight
+    assert seconds < 2.0, seconds
+    # keep-alive：连接数不超过并发数
+    assert len(fake.client_ports) <= 4, fake.client_ports
+    fetcher.close()
+    fake.close()
+
+
+def test_etag_cache_across_runs():
+    fake = FakeGitHub()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_path = os.path.join(tmp_dir, "cache", "github_api.sqlite")
+        urls = [f"{fake.base_url}/repos/{i}" for i in range(10)]
+        fetcher = new_fetcher(cache_path=cache_path)
+        first = [r.json() for r in fetcher.fetch_many(urls)]
+        fetcher.close()
+        remaining_after_first = fake.remaining
+        # 第二次运行（新的抓取器，同一个缓存文件）全部是条件请求
+        fetcher = new_fetcher(cache_path=cache_path)
+        second = fetcher.fetch_many(urls)
+        assert [r.json() for r in second] == first
+        assert all(r.status_code == 200 and r.headers["Content-Type"].startswith("application/json") for r in second)
+        assert fetcher.stats["not_modified"] == 10, fetcher.stats
+        assert fake.statuses.count(304) == 10, fake.statuses
+        # 304 不扣额度
+        assert fake.remaining == remaining_after_first
+        fetcher.close()
+    fake.close()
+
+
+def test_retry_backoff_and_retry_after():
+    fake = FakeGitHub()
+    fetcher = new_fetcher()
+    assert fetcher.fetch(f"{fake.base_url}/flaky/2").json() == {"ok": True}
+    assert fake.hits["/flaky/2"] == 3
+    response = fetcher.fetch(f"{fake.base_url}/throttled/1")
+    assert response.status_code == 200
+    assert float(response.headers["X-Retried-After"]) >= 1.0, response.headers["X-Retried-After"]
+    # 重试用尽与 404 都返回 None
+    assert fetcher.fetch(f"{fake.base_url}/flaky/100") is None
+    assert fake.hits["/flaky/100"] == fetcher.max_retries + 1
+    assert fetcher.fetch(f"{fake.base_url}/missing") is None
+    assert fake.hits["/missing"] == 1
+    fetcher.close()
+    fake.close()
+
+
+def test_anonymous_rate_limit_waits_for_reset():
+    # 没有配置 token 时 token_manager 不会等待，由抓取器睡到 X-RateLimit-Reset，而不是立即连续重试
+    fake = FakeGitHub()
+    fetcher = github_api.GitHubFetcher(token_manager=tm.TokenManager([]), backoff_base=0.01)
+    response = fetcher.fetch(f"{fake.base_url}/limited/1")
+    assert response.status_code == 200
+    assert fake.hits["/limited/1"] == 2, fake.hits
+    assert float(response.headers["X-Retried-After"]) >= 1.0, response.headers["X-Retried-After"]
+    fetcher.close()
+    fake.close()
+
+
+def test_parse_retry_after():
+    assert github_api.parse_retry_after({"Retry-After": "7"}) == 7
+    assert github_api.parse_retry_after({}) is None
+    http_date = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 30))
+    assert 25 < github_api.parse_retry_after({"Retry-After": http_date}) <= 30
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_"):
+            func()
+            print(f"{name} ok")
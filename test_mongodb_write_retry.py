@@ -0,0 +1,88 @@
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from db.mongodb_gh_utilities import GHArchiveMongoDBUtil
+
+
+class FlakyCollection:
+    """
+    insert_many 的替身：前 failures 次抛出 error，之后成功；id 重复的文档以 BulkWriteError 报告
+    """
+
+    def __init__(self, failures, error):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+        self.ids = set()
+
+    def insert_many(self, docs, ordered=False):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        write_errors = []
+        for i, doc in enumerate(docs):
+            if doc["id"] in self.ids:
+                write_errors.append({"index": i, "code": 11000, "errmsg": "duplicate key"})
+            self.ids.add(doc["id"])
+        if write_errors:
+            raise BulkWriteError({"nInserted": len(docs) - len(write_errors), "writeErrors": write_errors})
+
+
+class FakeDB(dict):
+    def __missing__(self, name):
+        raise KeyError(name)
+
+
+def new_util(collection, async_write):
+    # MongoClient 在第一次操作前不会连接；集合直接替换成替身
+    util = GHArchiveMongoDBUtil("mongodb://127.0.0.1:1", async_write=async_write, batch_size=10)
+    util.WRITE_RETRY_BACKOFF = 0
+    util.ready_collections.add("events_id_2015_01_neo")
+    util.mongo_db = FakeDB(events_id_2015_01_neo=collection)
+    return util
+
+
+def records(source, start, count):
+    return [{"id": str(start + i), "proj_id": "github:a/b", "user_id": "github:u", "type": "PushEvent",
+             "created_at": "2015-01-01T15:00:00Z"} for i in range(count)]
+
+
+def test_async_write_retries_network_error():
+    collection = FlakyCollection(2, AutoReconnect("connection reset"))
+    util = new_util(collection, async_write=True)
+    util.insert_gh_records(records("a", 0, 25), "a")
+    util.flush()
+    assert not any(util.in_flight.values()), util.in_flight
+    assert util.pop_source_stats("a") == (25, 0)
+    assert len(collection.ids) == 25
+    # 之后的 flush 不会再次抛出早已处理过的异常
+    assert util.flush() == (0, 0)
+    util.close()
+
+
+def test_async_write_gives_up_after_retries():
+    collection = FlakyCollection(100, AutoReconnect("primary stepped down"))
+    util = new_util(collection, async_write=True)
+    util.insert_gh_records(records("a", 0, 15), "a")
+    util.flush()
+    assert not any(util.in_flight.values()), util.in_flight
+    # 所有文档都计为非重复的写入失败
+    assert util.pop_source_stats("a") == (0, 0)
+    assert collection.calls == 2 * (GHArchiveMongoDBUtil.MAX_WRITE_RETRIES + 1), collection.calls
+    assert util.flush() == (0, 0)
+    util.close()
+
+
+def test_sync_write_retries_network_error():
+    collection = FlakyCollection(1, AutoReconnect("timed out"))
+    util = new_util(collection, async_write=False)
+    util.insert_gh_records(records("a", 0, 12) + records("a", 0, 3), "a")
+    util.flush()
+    assert util.pop_source_stats("a") == (12, 3)
+    util.close()
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_"):
+            func()
+            print(f"{name} ok")
@@ -0,0 +1,149 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import utils.token_manager as tm
+
+
+class FakeGitHub:
+    """
+    本地的 GitHub API 替身：每个 token 有自己的额度与重置时间，响应带 X-RateLimit-* 响应头，额度用完返回 403
+    """
+
+    def __init__(self, quotas, reset_after):
+        self.reset = int(time.time() + reset_after)
+        self.quotas = dict(quotas)
+        self.limits = dict(quotas)
+        self.requests = {token: 0 for token in quotas}
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                token = self.headers.get("Authorization", "").split(" ")[-1]
+                with fake.lock:
+                    if time.time() >= fake.reset:
+                        fake.quotas = dict(fake.limits)
+                        fake.reset = int(time.time() + 3600)
+                    fake.requests[token] += 1
+                    remaining = fake.quotas[token]
+                    status = 200 if remaining > 0 else 403
+                    if remaining > 0:
+                        fake.quotas[token] = remaining = remaining - 1
+                body = json.dumps({"token": token}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("X-RateLimit-Limit", str(fake.limits[token]))
+                self.send_header("X-RateLimit-Remaining", str(remaining))
+                self.send_header("X-RateLimit-Reset", str(fake.reset))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/repos/a/b"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def fetch(manager, url):
+    token = manager.get_token()
+    response = requests.get(url, headers={"Authorization": f"token {token}"})
+    manager.update_from_headers(token, response.headers)
+    return token, response.status_code
+
+
+def test_lazy_start():
+    # 导入模块与创建实例都不读取配置、不发请求
+    assert tm.singleton_token_manager.states is None
+    assert tm.TokenManager(["a"]).states is None
+    assert tm.TokenManager([]).get_token() is None
+
+
+def test_most_headroom():
+    fake = FakeGitHub({"small": 3, "large": 20}, reset_after=3600)
+    manager = tm.TokenManager(["small", "large"])
+    # 未收到响应头之前两个 token 的估计额度相同，各用一次后以服务端的真实额度为准
+    assert {fetch(manager, fake.url)[0] for _ in range(2)} == {"small", "large"}
+    for _ in range(10):
+        token, status = fetch(manager, fake.url)
+        assert token == "large" and status == 200, (token, status)
+    remaining = dict(zip(manager.tokens_pool, [r for r, _ in manager.status()]))
+    assert remaining["large"] < 20 and remaining["small"] <= 2, remaining
+    fake.close()
+
+
+def test_wait_until_reset():
+    fake = FakeGitHub({"a": 2, "b": 1}, reset_after=2)
+    manager = tm.TokenManager(["a", "b"])
+    statuses = [fetch(manager, fake.url)[1] for _ in range(3)]
+    assert statuses == [200, 200, 200], statuses
+    # 三次请求用完了两个 token，第四次必须睡到重置时间，而不是轮询或立即返回
+    start = time.time()
+    until_reset = fake.reset - start
+    token, status = fetch(manager, fake.url)
+    waited = time.time() - start
+    assert status == 200, status
+    assert until_reset - 0.5 < waited < until_reset + tm.RESET_MARGIN + 0.5, waited
+    assert sum(fake.requests.values()) == 4, fake.requests
+    fake.close()
+
+
+def test_concurrent_get_token():
+    manager = tm.TokenManager([f"t{i}" for i in range(4)])
+    for i, token in enumerate(manager.tokens_pool):
+        manager.update_from_headers(token, {"X-RateLimit-Limit": "5000", "X-RateLimit-Remaining": str(1000 * (i + 1)),
+                                            "X-RateLimit-Reset": str(int(time.time()) + 3600)})
+    counts = {}
+    counts_lock = threading.Lock()
+
+    def worker():
+        for _ in range(500):
+            token = manager.get_token()
+            with counts_lock:
+                counts[token] = counts.get(token, 0) + 1
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 额度最多的 t3 先被用到与 t2 持平，之后轮流分配
+    assert sum(counts.values()) == 4000, counts
+    assert counts["t3"] > counts.get("t2", 0) and "t0" not in counts, counts
+
+
+def test_github_api_switches_exhausted_token():
+    import utils.github_api as github_api
+    fake = FakeGitHub({"x": 1, "y": 1}, reset_after=3600)
+    manager = tm.singleton_token_manager
+    saved = (manager.tokens_pool, manager.states, manager.states_by_token, github_api._default_fetcher)
+    try:
+        manager.tokens_pool, manager.states, manager.states_by_token = ["x", "y"], None, None
+        # 不读取 config.yaml，使用不带磁盘缓存的默认抓取器
+        github_api._default_fetcher = github_api.GitHubFetcher()
+        assert github_api.make_github_request(fake.url).status_code == 200
+        assert github_api.make_github_request(fake.url).status_code == 200
+        assert fake.requests == {"x": 1, "y": 1}, fake.requests
+    finally:
+        # 恢复单例与默认抓取器，之后的测试不会用到替身的 token 和缓存的额度
+        github_api._default_fetcher.close()
+        manager.tokens_pool, manager.states, manager.states_by_token, github_api._default_fetcher = saved
+        fake.close()
+    assert (manager.tokens_pool, manager.states, manager.states_by_token, github_api._default_fetcher) == saved
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_"):
+            func()
+            print(f"{name} ok")
@@ -0,0 +1,195 @@
+import datetime
+import gzip
+import os
+import queue
+import threading
+import time
+from multiprocessing import Process
+
+from pySmartDL import SmartDL
+
+from utils.gharchive_flow import ignore_sigint
+from utils.gharchive_metrics import MetricsRecorder
+from utils.ingest_manifest import IngestManifest
+from utils.sampling_profiler import start_profiler, stop_profiler
+
+
+class StageUtilization:
+    """
+    记录一个流水线阶段的忙碌时间与等待时间（等待上游 / 被下游阻塞）
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.busy = 0.0
+        self.wait_input = 0.0
+        self.wait_output = 0.0
+        self.items = 0
+
+    def add(self, busy=0.0, wait_input=0.0, wait_output=0.0, items=0):
+        with self.lock:
+            self.busy += busy
+            self.wait_input += wait_input
+            self.wait_output += wait_output
+            self.items += items
+
+    def report(self):
+        with self.lock:
+            total = self.busy + self.wait_input + self.wait_output
+            if total <= 0:
+                return f"{self.name}: idle"
+            return (f"{self.name}: {self.items} files, utilization {self.busy / total * 100:.1f}%, "
+                    f"waiting for input {self.wait_input / total * 100:.1f}%, "
+                    f"blocked on output {self.wait_output / total * 100:.1f}%")
+
+
+def smart_download(url, dest_path):
+    try:
+        if os.path.exists(dest_path):
+            if not check_ok(dest_path):
+                print(f"[{datetime.datetime.now()}] 发现破损文件... {dest_path}")
+                os.remove(dest_path)  # 删除无效文件
+            else:
+                return dest_path
+        print(f"[{datetime.datetime.now()}] 发现缺失文件... {dest_path}")
+        obj = SmartDL(url, dest_path, threads=8, timeout=120, progress_bar=False)
+        obj.start()
+
+        if obj.isSuccessful():
+            print(f"[{datetime.datetime.now()}] 下载完成: {obj.get_dest()}")
+            return dest_path
+        else:
+            print(f"[{datetime.datetime.now()}] 下载失败: {url}\n{obj.get_errors()}")
+            return None
+    except Exception as e:
+        print(f"[{datetime.datetime.now()}] 下载失败: {url}\n{e}")
+        return None
+
+
+def check_ok(file_path):
+    try:
+        with gzip.open(file_path, 'rb') as f:
+            f.read(1)  # 读取一个字节，确保文件可以正常读取
+        return True
+    except:
+        return False
+
+
+def local_file_path(download_root, file_url):
+    filename = os.path.basename(file_url)
+    year = filename.split('-')[0]
+    dest_dir = os.path.join(download_root, year)
+    # 确保目标目录存在
+    os.makedirs(dest_dir, exist_ok=True)
+    return os.path.join(dest_dir, filename)
+
+
+def ensure_local_file(file_url, file_path, manifest, max_attempt=3, metrics=None, worker=0):
+    """
+    保证本地有一份校验通过的文件，返回 True/False
+    metrics 为 MetricsRecorder 时记录实际下载的字节数与耗时
+    """
+    filename = os.path.basename(file_url)
+    # 检查文件是否已存在且有效（manifest 中已校验且大小未变时不再重新打开）
+    if os.path.exists(file_path):
+        size = os.path.getsize(file_path)
+        if manifest.is_verified(filename, size) or check_ok(file_path):
+            manifest.mark_verified(filename, file_path, size)
+            return True
+    # 下载文件（最多重试3次）
+    for attempt in range(max_attempt):
+        download_start = time.time()
+        if smart_download(file_url, file_path):
+            manifest.mark_downloaded(filename, file_path, os.path.getsize(file_path))
+            if metrics is not None:
+                metrics.inc("gharchive_download_bytes_total", os.path.getsize(file_path), worker=worker)
+                metrics.inc("gharchive_download_seconds_total", time.time() - download_start, worker=worker)
+                metrics.inc("gharchive_files_downloaded_total", worker=worker)
+            # 验证下载的文件
+            if check_ok(file_path):
+                manifest.mark_verified(filename, file_path, os.path.getsize(file_path))
+                return True
+            os.remove(file_path)  # 删除无效文件
+            manifest.mark_invalid(filename)
+    manifest.mark_failed(filename)
+    print(f"[{datetime.datetime.now()}] Failed after {max_attempt} attempts: {file_url}")
+    return False
+
+
+class PrefetchDownloader:
+    """
+    下载阶段：在独立进程中用 num_threads 个线程下载，ready_queue 的容量限制了磁盘上提前准备好的文件数
+    解析 worker 只从 ready_queue 取 (file_url, file_path)；全部下载完成后放入 num_consumers 个 None
+    """
+
+    def __init__(self, task_queue, ready_queue, download_root, manifest_path, num_threads, num_consumers,
+                 follow=False, report_interval=600, metrics_queue=None, profile_dir=None):
+        self.task_qu = task_queue
+        self.ready_qu = ready_queue
+        self.download_root = download_root
+        self.manifest_path = manifest_path
+        self.num_threads = num_threads
+        self.num_consumers = num_consumers
+        self.follow = follow
+        self.report_interval = report_interval
+        self.metrics_qu = metrics_queue
+        self.profile_dir = profile_dir
+        self.p = None
+
+    def _download_thread(self, utilization, metrics, thread_idx):
+        manifest = IngestManifest(self.manifest_path)
+        while True:
+            wait_start = time.time()
+            try:
+                if self.follow:
+                    file_url = self.task_qu.get()
+                else:
+                    file_url = self.task_qu.get_nowait()
+            except queue.Empty:
+                file_url = None
+            busy_start = time.time()
+            utilization.add(wait_input=busy_start - wait_start)
+            if file_url is None:
+                break
+            try:
+                file_path = local_file_path(self.download_root, file_url)
+                ok = ensure_local_file(file_url, file_path, manifest, metrics=metrics, worker=thread_idx)
+            except Exception as e:
+                print(e)
+                ok = False
+            put_start = time.time()
+            if ok:
+                self.ready_qu.put((file_url, file_path))
+            utilization.add(busy=put_start - busy_start, wait_output=time.time() - put_start, items=1)
+            metrics.inc("gharchive_stall_seconds_total", time.time() - put_start, stage="download", worker=thread_idx)
+        manifest.close()
+
+    def _worker(self):
+        ignore_sigint()
+        utilization = StageUtilization("Download stage")
+        metrics = MetricsRecorder(self.metrics_qu)
+        profiler = start_profiler(self.profile_dir, "download")
+        threads = [threading.Thread(target=self._download_thread, args=(utilization, metrics, i), daemon=True)
+                   for i in range(self.num_threads)]
+        for t in threads:
+            t.start()
+        last_report = time.time()
+        while any(t.is_alive() for t in threads):
+            for t in threads:
+                t.join(timeout=1)
+            if time.time() - last_report >= self.report_interval:
+                print(f"[{datetime.datetime.now()}] {utilization.report()}")
+                last_report = time.time()
+        for _ in range(self.num_consumers):
+            self.ready_qu.put(None)
+        print(f"[{datetime.datetime.now()}] {utilization.report()}")
+        metrics.flush(force=True)
+        stop_profiler(profiler)
+
+    def start(self):
+        self.p = Process(target=self._worker, args=())
+        self.p.start()
+
+    def join(self):
+        self.p.join()
@@ -0,0 +1,70 @@
+import signal
+import sys
+import time
+
+# 解析出的一条记录在写入进程中的大致内存开销（dict 本身 + 各个键值对象），字符串长度另计
+RECORD_OVERHEAD_BYTES = 600
+# 默认的内存预算：解析进程发出、写入进程尚未消费完的消息总字节数上限
+DEFAULT_MEMORY_BUDGET_MB = 1024
+
+
+def ignore_sigint():
+    """
+    子进程（Manager、解析进程池、下载 / 写入 / 汇总进程）忽略 Ctrl-C：SIGINT 会发给整个进程组，
+    只由主进程响应，再按正常顺序通知各阶段排空退出，避免写入进程丢失缓冲的批次
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def estimate_records_size(records):
+    """
+    估算一批解析后记录的内存字节数，只看字符串长度，避免逐条序列化
+    """
+    size = 0
+    for record in records:
+        size += RECORD_OVERHEAD_BYTES
+        for value in record.values():
+            if isinstance(value, str):
+                size += len(value)
+    return size
+
+
+def estimate_raw_size(col_docs):
+    return sum(len(raw_doc) + sys.getsizeof(b"") for raw_docs in col_docs.values() for raw_doc in raw_docs)
+
+
+class MemoryBudget:
+    """
+    跨进程的内存预算：生产者发送消息前 acquire 消息字节数，预算不足时在条件变量上阻塞；
+    消费者处理完消息后 release，并唤醒等待的生产者。
+    条件变量与计数都由 Manager 持有，对象本身可以作为参数传给 Pool / Process。
+    """
+
+    def __init__(self, manager, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.cond = manager.Condition()
+        self.used = manager.Value("q", 0)
+        # 本进程内累计被阻塞的时间（每个进程持有自己的一份副本）
+        self.stall_seconds = 0.0
+
+    def acquire(self, nbytes):
+        """
+        占用 nbytes 的预算，返回本次被阻塞的秒数。
+        预算为空时总是放行，单条消息超过整个预算也不会死锁
+        """
+        start = time.time()
+        with self.cond:
+            while self.used.value > 0 and self.used.value + nbytes > self.budget_bytes:
+                self.cond.wait()
+            self.used.value += nbytes
+        stalled = time.time() - start
+        self.stall_seconds += stalled
+        return stalled
+
+    def release(self, nbytes):
+        with self.cond:
+            self.used.value = max(0, self.used.value - nbytes)
+            self.cond.notify_all()
+
+    def used_bytes(self):
+        return self.used.value
@@ -1,15 +1,39 @@
 import datetime
 import gzip
+import io
 import json
 import os
-import queue
 import time
 
-import numpy as np
-from pySmartDL import SmartDL
+import bson
 
 import config
-from dateutil import parser
+from db.mongodb_gh_utilities import GHArchiveMongoDBUtil
+from utils.gharchive_downloader import StageUtilization, ensure_local_file
+from utils.gharchive_flow import estimate_raw_size, estimate_records_size
+from utils.gharchive_metrics import MetricsRecorder
+from utils.gharchive_normalizer import GHArchiveNormalizer, generate_sha_hash, unparseable_reason
+from utils.ingest_manifest import IngestManifest
+from utils.quarantine import QuarantineStore, REASON_EXCEPTION, REASON_JSON_ERROR
+from utils.sampling_profiler import start_profiler, stop_profiler
+
+try:
+    # 可选的快速 gzip 实现（python-isal），未安装时回退到标准库
+    from isal import igzip as fast_gzip
+except ImportError:
+    fast_gzip = None
+
+# 每个消息携带的记录条数，按批发送以减少 Manager 队列的往返次数
+RECORD_BATCH_SIZE = 5000
+# 解压流的读缓冲区大小，逐行读取时每个 worker 只保留这一块缓冲
+GZ_READ_BUFFER_SIZE = 1024 * 1024
+
+
+def get_quarantine_root():
+    quarantine_root = config.get_config("quarantine_root", None)
+    if quarantine_root is None:
+        quarantine_root = os.path.join(os.path.dirname(config.get_config("unable_to_parse_log_path")), "quarantine")
+    return quarantine_root
 
 
 def log_unable_to_parse(line):
@@ -18,195 +42,204 @@ def log_unable_to_parse(line):
         fd.write('\n')
 
 
-import hashlib
-
-
-def generate_sha_hash(input_str, sha_version="sha256"):
+def open_gz_lines(gz_file_path):
     """
-    生成字符串的SHA哈希值
-
-    参数：
-        input_str: 输入的字符串
-        sha_version: SHA版本，支持'sha1'、'sha256'、'sha512'（默认sha256）
-
-    返回：
-        十六进制格式的SHA哈希值字符串
+    以流的方式打开 gz 文件，按行迭代，内存占用与文件大小无关
     """
-    # 检查支持的SHA版本
-    supported_versions = ["sha1", "sha256", "sha512"]
-    if sha_version not in supported_versions:
-        raise ValueError(f"不支持的SHA版本，可选：{supported_versions}")
+    if fast_gzip is not None:
+        raw = fast_gzip.open(gz_file_path, "rb")
+    else:
+        raw = gzip.open(gz_file_path, "rb")
+    return io.BufferedReader(raw, buffer_size=GZ_READ_BUFFER_SIZE)
 
-    # 字符串转字节流（必须指定编码，如utf-8）
-    byte_data = input_str.encode("utf-8")
 
-    # 创建哈希对象并计算哈希值
-    hash_obj = hashlib.new(sha_version, byte_data)
-
-    # 返回十六进制结果
-    return hash_obj.hexdigest()
-
-
-def unzip2queue(gz_file_path, msg_out_qu):
+def encode_raw_records(records, id_as_key=False, col_ids=None):
+    """
+    在 worker 中把记录编码成 BSON，按目标集合分组：{col_id: [bytes, ...]}
+    id_as_key=True（bulk_load 模式）时写入端无法再修改文档，由这里设置 _id
+    col_ids 为解析时已经算好的、与 records 一一对应的目标集合
+    """
+    col_docs = {}
+    for i, record in enumerate(records):
+        if id_as_key:
+            record["_id"] = record["id"]
+        col_id = col_ids[i] if col_ids is not None else GHArchiveMongoDBUtil.get_col_id(record["created_at"])
+        if col_id not in col_docs:
+            col_docs[col_id] = []
+        col_docs[col_id].append(bson.encode(record))
+    return col_docs
+
+
+def send_records(records, gz_file_path, msg_out_qu, raw_bson=False, id_as_key=False, budget=None, col_ids=None):
+    """
+    发送一批记录；给定 MemoryBudget 时先按消息字节数占用预算，预算不足时阻塞到写入端释放为止
+    col_ids 与 records 一一对应，随消息发给写入端
+    """
+    if raw_bson:
+        col_docs = encode_raw_records(records, id_as_key, col_ids)
+        msg = {"type": "raw_records", "content": {"col_docs": col_docs, "gz_file_path": gz_file_path}}
+        size = estimate_raw_size(col_docs)
+    else:
+        msg = {"type": "records", "content": {"records": records, "col_ids": col_ids, "gz_file_path": gz_file_path}}
+        size = estimate_records_size(records)
+    if budget is not None:
+        budget.acquire(size)
+        msg["content"]["size"] = size
+    msg_out_qu.put(msg)
+
+
+def unzip2queue(gz_file_path, msg_out_qus, batch_size=RECORD_BATCH_SIZE, raw_bson=False, id_as_key=False,
+                budget=None, metrics=None, worker_idx=0, quarantine=None, sent_counts=None):
+    # msg_out_qus 是各写入分片的队列列表，记录按目标集合（月份）路由
+    # budget 为 MemoryBudget 时按字节数限制尚未被写入端消费的消息总量
+    # metrics 为 MetricsRecorder 时每发送一批记录一次解压字节数与解析条数
+    # quarantine 为 QuarantineStore 时无法解析的行连同原因写入隔离区，否则追加到 unable_to_parse 日志
+    # raw_bson=True 时记录在 worker 中编码为 BSON，写入端直接以 RawBSONDocument 插入
+    # sent_counts 为每个分片已经发给写入端的记录数，每发送一批就累加；同一个文件解析到一半失败、
+    # 重新下载后再次调用时传入同一个列表，每个分片跳过前面已发送的记录，只发送剩下的部分
+    num_shards = len(msg_out_qus)
+    if sent_counts is None:
+        sent_counts = [0] * num_shards
+    # 本次要跳过的记录数与已跳过的记录数
+    skip_counts = list(sent_counts)
+    skipped_counts = [0] * num_shards
     try:
         print(f"[{datetime.datetime.now()}] 开始处理: {gz_file_path}")
-        with gzip.open(f"{gz_file_path}") as ghfd:
-            lines = ghfd.readlines()
-        for line in lines:
-            try:
-                record = json.loads(line.strip())
-                if record["type"] == "GistEvent":
-                    # omit GistEvents
-                    continue
-                record_to_send = {}
-                if "id" in record:
-                    record_to_send["id"] = record["id"]
-
-                if "repo" in record:
-                    repo_name = record["repo"]["name"]
-                elif "repository" in record:
-                    repo_name = f"{record['repository']['owner']}/{record['repository']['name']}"
-                elif "url" in record:
-                    repo_name = f"{record['url'].replace('https://github.com/', '')}"
-                else:
-                    log_unable_to_parse(line)
-                    continue
-
-                if "actor_attributes" in record:
-                    actor_login = record["actor_attributes"]["login"]
-                elif "actor" in record:
-                    actor_login = record["actor"]["login"]
-                else:
-                    log_unable_to_parse(line)
-                    continue
-                record_to_send["proj_id"] = f"github:{repo_name}"
-                record_to_send["user_id"] = f"github:{actor_login}"
-                record_to_send["type"] = record["type"]
-                # 统一时间格式
-                created_at=record["created_at"]
-                created_at=parser.parse(created_at)
-                record_to_send["created_at"] = created_at.astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
-                # record_to_send["created_at"] = record["created_at"]
-                if "id" not in record:
-                    id_str = f'{record_to_send["proj_id"]}_{record_to_send["user_id"]}_{record_to_send["type"]}_{record_to_send["created_at"]}'
-                    record_to_send["id"] = generate_sha_hash(id_str)
-                if "payload" in record:
-                    if "action" in record["payload"]:
-                        record_to_send["action"] = record["payload"]["action"]
-
-                    if "issue" in record["payload"]:
-                        if isinstance(record["payload"]["issue"], dict):
-                            if "number" in record["payload"]["issue"]:
-                                record_to_send["number"] = record["payload"]["issue"]["number"]
-                        else:
-                            record_to_send["number"] = record["payload"]["number"]
-                    elif "issue_id" in record["payload"]:
-                        record_to_send["number"] = record["payload"]["issue_id"]
-
-                    if "pull_request" in record["payload"]:
-                        if isinstance(record["payload"]["pull_request"], dict):
-                            if "number" in record["payload"]["pull_request"]:
-                                record_to_send["number"] = record["payload"]["pull_request"]["number"]
+        if quarantine is not None:
+            quarantine.begin(gz_file_path)
+        with open_gz_lines(gz_file_path) as ghfd:
+            # normalizer 在解析时附上目标集合，同一个月份只计算一次
+            normalizer = GHArchiveNormalizer()
+            shard_records = [[] for _ in range(num_shards)]
+            shard_col_ids = [[] for _ in range(num_shards)]
+            shard_idxs = {}
+            events_parsed = 0
+            bytes_read = 0
+            reported_events = 0
+            reported_bytes = 0
+            for line in ghfd:
+                bytes_read += len(line)
+                record = None
+                try:
+                    record = json.loads(line.strip())
+                    if record["type"] == "GistEvent":
+                        # omit GistEvents
+                        continue
+                    normalized = normalizer.normalize(record)
+                    if normalized is None:
+                        if quarantine is not None:
+                            quarantine.add(gz_file_path, line, unparseable_reason(record))
                         else:
-                            record_to_send["number"] = record["payload"]["number"]
-                if "action" not in record_to_send:
-                    record_to_send["action"] = ""
-                if "number" not in record_to_send:
-                    record_to_send["number"] = np.nan
-
-                while msg_out_qu.qsize() > 1000000:
-                    print(f"\r[{datetime.datetime.now()}] Worker waiting for queue space.", end="")
-                    time.sleep(1)
-                msg_out_qu.put({"type": "record", "content": {"record": record_to_send, "gz_file_path": gz_file_path}})
-            except Exception as e:
-                print(e)
-                print(record)
-        msg_out_qu.put({"type": "complete", "content": gz_file_path})
+                            log_unable_to_parse(line)
+                        continue
+                    record_to_send, col_id = normalized
+
+                    shard_idx = shard_idxs.get(col_id)
+                    if shard_idx is None:
+                        shard_idx = GHArchiveMongoDBUtil.get_shard_idx(col_id, num_shards)
+                        shard_idxs[col_id] = shard_idx
+                    events_parsed += 1
+                    if skipped_counts[shard_idx] < skip_counts[shard_idx]:
+                        # 上一次解析时已经发送过
+                        skipped_counts[shard_idx] += 1
+                        continue
+                    records = shard_records[shard_idx]
+                    records.append(record_to_send)
+                    shard_col_ids[shard_idx].append(col_id)
+                    if len(records) >= batch_size:
+                        send_records(records, gz_file_path, msg_out_qus[shard_idx], raw_bson, id_as_key, budget,
+                                     shard_col_ids[shard_idx])
+                        sent_counts[shard_idx] += len(records)
+                        shard_records[shard_idx] = []
+                        shard_col_ids[shard_idx] = []
+                        if metrics is not None:
+                            metrics.inc("gharchive_decompressed_bytes_total", bytes_read - reported_bytes,
+                                        worker=worker_idx)
+                            metrics.inc("gharchive_events_parsed_total", events_parsed - reported_events,
+                                        worker=worker_idx)
+                            reported_bytes, reported_events = bytes_read, events_parsed
+                except Exception as e:
+                    if quarantine is not None:
+                        reason = REASON_JSON_ERROR if isinstance(e, ValueError) and record is None else REASON_EXCEPTION
+                        quarantine.add(gz_file_path, line, reason, f"{type(e).__name__}: {e}")
+                    else:
+                        print(e)
+                        print(record)
+            for shard_idx, records in enumerate(shard_records):
+                if records:
+                    send_records(records, gz_file_path, msg_out_qus[shard_idx], raw_bson, id_as_key, budget,
+                                 shard_col_ids[shard_idx])
+                    sent_counts[shard_idx] += len(records)
+            if skipped_counts != skip_counts:
+                # 重新下载的文件比第一次读到的记录还少，说明两次内容不一致，已发送的部分无法对应
+                raise ValueError(f"re-read {skipped_counts} records per shard, {skip_counts} were already sent")
+            if any(skip_counts):
+                print(f"[{datetime.datetime.now()}] 跳过上一次已发送的 {sum(skip_counts)} 条记录: {gz_file_path}")
+            if metrics is not None:
+                metrics.inc("gharchive_decompressed_bytes_total", bytes_read - reported_bytes, worker=worker_idx)
+                metrics.inc("gharchive_events_parsed_total", events_parsed - reported_events, worker=worker_idx)
+                metrics.inc("gharchive_files_parsed_total", worker=worker_idx)
+        if quarantine is not None:
+            quarantined = quarantine.finish(gz_file_path)
+            if quarantined > 0:
+                print(f"[{datetime.datetime.now()}] 隔离 {quarantined} 行无法解析的记录: {gz_file_path}")
+        # 每个分片都要收到完成消息，由 GHCompletionTracker 汇总
+        for msg_out_qu in msg_out_qus:
+            msg_out_qu.put({"type": "complete", "content": {"gz_file_path": gz_file_path, "events_parsed": events_parsed}})
         return True
     except Exception as e:
         print(f"[{datetime.datetime.now()}] 解压失败: {gz_file_path}\n{str(e)[:100]}")
         return False
 
 
-def smart_download(url, dest_path):
-    try:
-        if os.path.exists(dest_path):
-            if not check_ok(dest_path):
-                print(f"[{datetime.datetime.now()}] 发现破损文件... {dest_path}")
-                os.remove(dest_path)  # 删除无效文件
-            else:
-                return dest_path
-        print(f"[{datetime.datetime.now()}] 发现缺失文件... {dest_path}")
-        obj = SmartDL(url, dest_path, threads=8, timeout=120)
-        obj.start()
-
-        if obj.isSuccessful():
-            print(f"[{datetime.datetime.now()}] 下载完成: {obj.get_dest()}")
-            return dest_path
-        else:
-            print(f"[{datetime.datetime.now()}] 下载失败: {url}\n{obj.get_errors()}")
-            return None
-    except Exception as e:
-        print(f"[{datetime.datetime.now()}] 下载失败: {url}\n{e}")
-        return None
-
-
-def check_ok(file_path):
-    try:
-        with gzip.open(file_path, 'rb') as f:
-            f.read(1)  # 读取一个字节，确保文件可以正常读取
-        return True
-    except:
-        return False
-
-
 def gz_reader(arg_dict):
-    task_in_qu = arg_dict["task_queue"]
-    message_out_qu = arg_dict["message_queue"]
+    """
+    解析阶段：从 ready_queue 取已下载好的文件解析入队，收到 None 时退出
+    """
+    ready_in_qu = arg_dict["ready_queue"]
+    message_out_qus = arg_dict["message_queues"]
     worker_idx = int(arg_dict["worker_idx"])
-    download_root = arg_dict["download_root"]
-    complated_list = arg_dict["complated_list"]
-    continue_flag = True
-    while continue_flag:
+    manifest = IngestManifest(arg_dict["manifest_path"])
+    raw_bson = arg_dict.get("raw_bson", False)
+    id_as_key = arg_dict.get("bulk_load", False)
+    budget = arg_dict.get("memory_budget")
+    metrics = MetricsRecorder(arg_dict.get("metrics_queue"))
+    profiler = start_profiler(arg_dict.get("profile_dir"), f"parse-{worker_idx}")
+    quarantine_root = arg_dict.get("quarantine_root")
+    quarantine = QuarantineStore(quarantine_root) if quarantine_root is not None else None
+    utilization = StageUtilization(f"Parse worker {worker_idx}")
+    while True:
+        wait_start = time.time()
+        task = ready_in_qu.get()
+        busy_start = time.time()
+        utilization.add(wait_input=busy_start - wait_start)
+        if task is None:
+            break
+        file_url, file_path = task
+        stall_start = budget.stall_seconds if budget is not None else 0.0
+        # 解析到一半失败时已经发出的批次不会撤回，重新解析时只发送之后的记录，避免重复写入
+        sent_counts = [0] * len(message_out_qus)
         try:
-            file_url = task_in_qu.get_nowait()
-            filename = os.path.basename(file_url)
-            year = filename.split('-')[0]
-            dest_dir = os.path.join(download_root, year)
-            # 确保目标目录存在
-            os.makedirs(dest_dir, exist_ok=True)
-            file_path = os.path.join(dest_dir, filename)
-
-            # 检查文件是否已存在且有效
-            if os.path.exists(file_path) and check_ok(file_path):
-                if file_path not in complated_list:
-                    if unzip2queue(file_path, message_out_qu):
-                        continue
-                    else:
-                        os.remove(file_path)
-                else:
-                    print(f"\rSkipped (already exists): {file_url}", end="")
-                    continue
-
-            # 下载文件（最多重试3次）
-            max_attempt = 3
-            for attempt in range(max_attempt):
-                try:
-                    if smart_download(file_url, file_path):
-                        # 验证下载的文件
-                        if not check_ok(file_path):
-                            os.remove(file_path)  # 删除无效文件
-                            raise ValueError("Downloaded file is invalid")
-                        if unzip2queue(file_path, message_out_qu):
-                            break
-                        else:
-                            os.remove(file_path)
-                except Exception as download_error:
-                    if attempt == 2:  # 最后一次尝试也失败
-                        raise Exception(f"Failed after 3 attempts: {file_url} - Error: {str(download_error)[:100]}")
-        except queue.Empty:
-            # the queue is empty
-            print(f"Empty {worker_idx}")
-            continue_flag = False
+            if not unzip2queue(file_path, message_out_qus, raw_bson=raw_bson, id_as_key=id_as_key, budget=budget,
+                               metrics=metrics, worker_idx=worker_idx, quarantine=quarantine,
+                               sent_counts=sent_counts):
+                # 解析失败时删除文件，重新下载一次再解析
+                os.remove(file_path)
+                manifest.mark_invalid(os.path.basename(file_path))
+                if not (ensure_local_file(file_url, file_path, manifest, max_attempt=1)
+                        and unzip2queue(file_path, message_out_qus, raw_bson=raw_bson, id_as_key=id_as_key,
+                                        budget=budget, metrics=metrics, worker_idx=worker_idx,
+                                        quarantine=quarantine, sent_counts=sent_counts)):
+                    manifest.mark_failed(os.path.basename(file_path))
         except Exception as e:
             print(e)
+        # 等待内存预算的时间记为被下游阻塞
+        stalled = budget.stall_seconds - stall_start if budget is not None else 0.0
+        utilization.add(busy=time.time() - busy_start - stalled, wait_output=stalled, items=1)
+        metrics.inc("gharchive_stall_seconds_total", stalled, stage="parse", worker=worker_idx)
+    print(f"[{datetime.datetime.now()}] {utilization.report()}")
+    metrics.flush(force=True)
+    stop_profiler(profiler)
+    if quarantine is not None:
+        quarantine.close()
+    manifest.close()
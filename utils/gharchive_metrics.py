@@ -0,0 +1,263 @@
+import bisect
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Process
+
+from utils.gharchive_flow import ignore_sigint
+
+# 写入耗时直方图的桶上界（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+# 各进程把本地累计的增量推送给汇总进程的间隔（秒）
+PUSH_INTERVAL = 5.0
+# 快照中的派生指标：(名称, 分子计数器, 除数)，按速率计算
+DERIVED_RATES = (
+    ("download_bytes_per_second", "gharchive_download_bytes_total", 1),
+    ("decompress_mb_per_second", "gharchive_decompressed_bytes_total", 1024 * 1024),
+    ("events_parsed_per_second", "gharchive_events_parsed_total", 1),
+    ("insert_docs_per_second", "gharchive_inserted_docs_total", 1),
+)
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class MetricsRecorder:
+    """
+    进程内的指标记录器：计数器、仪表和直方图先在本地累加，每隔 push_interval 秒把增量发给 GHMetricsCollector
+    metrics_queue 为 None 时所有调用都是空操作
+    """
+
+    def __init__(self, metrics_queue, push_interval=PUSH_INTERVAL):
+        self.qu = metrics_queue
+        self.push_interval = push_interval
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.last_push = time.time()
+
+    def inc(self, name, value=1, **labels):
+        if self.qu is None:
+            return
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self.flush()
+
+    def set(self, name, value, **labels):
+        if self.qu is None:
+            return
+        with self.lock:
+            self.gauges[_key(name, labels)] = value
+        self.flush()
+
+    def observe(self, name, value, **labels):
+        if self.qu is None:
+            return
+        key = _key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+            histogram = self.histograms[key]
+            histogram[0][bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+        self.flush()
+
+    def flush(self, force=False):
+        if self.qu is None or not (force or time.time() - self.last_push >= self.push_interval):
+            return
+        with self.lock:
+            content = {"counters": self.counters, "gauges": self.gauges, "histograms": self.histograms}
+            self.counters = {}
+            self.gauges = {}
+            self.histograms = {}
+            self.last_push = time.time()
+        if content["counters"] or content["gauges"] or content["histograms"]:
+            self.qu.put({"type": "metrics", "content": content})
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class GHMetricsCollector:
+    """
+    汇总各阶段推送的指标：定期写出 JSON 快照文件，并在 127.0.0.1:port 提供 Prometheus 文本格式的 /metrics
+    同时采样各队列的深度和内存预算的占用
+    """
+
+    def __init__(self, metrics_queue, snapshot_path, port=0, snapshot_interval=30, sampled_queues=None,
+                 memory_budget=None):
+        self.qu = metrics_queue
+        self.snapshot_path = snapshot_path
+        self.port = port
+        self.snapshot_interval = snapshot_interval
+        # {队列名: 队列}，每次快照前采样 qsize
+        self.sampled_queues = sampled_queues if sampled_queues is not None else {}
+        self.memory_budget = memory_budget
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.last_counters = {}
+        self.start_time = time.time()
+        self.last_snapshot = time.time()
+        self.p = None
+
+    def __merge(self, content):
+        with self.lock:
+            for key, value in content["counters"].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            self.gauges.update(content["gauges"])
+            for key, (buckets, total, count) in content["histograms"].items():
+                if key not in self.histograms:
+                    self.histograms[key] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+                histogram = self.histograms[key]
+                histogram[0] = [a + b for a, b in zip(histogram[0], buckets)]
+                histogram[1] += total
+                histogram[2] += count
+
+    def sample(self):
+        gauges = {}
+        for name, qu in self.sampled_queues.items():
+            try:
+                gauges[_key("gharchive_queue_depth", {"queue": name})] = qu.qsize()
+            except Exception:
+                pass
+        if self.memory_budget is not None:
+            gauges[_key("gharchive_memory_budget_used_bytes", {})] = self.memory_budget.used_bytes()
+        with self.lock:
+            self.gauges.update(gauges)
+
+    def __sum_counter(self, counters, name):
+        return sum(value for (counter_name, _), value in counters.items() if counter_name == name)
+
+    def snapshot(self):
+        """
+        返回当前指标的 JSON 结构；rate 为距上一次快照的平均速率
+        """
+        now = time.time()
+        with self.lock:
+            interval = max(now - self.last_snapshot, 1e-9)
+            counters = dict(self.counters)
+            last_counters = self.last_counters
+            snapshot = {
+                "time": datetime.datetime.now().isoformat(),
+                "uptime_seconds": now - self.start_time,
+                "counters": [{"name": name, "labels": dict(labels), "value": value,
+                              "rate": (value - last_counters.get((name, labels), 0)) / interval}
+                             for (name, labels), value in sorted(counters.items())],
+                "gauges": [{"name": name, "labels": dict(labels), "value": value}
+                           for (name, labels), value in sorted(self.gauges.items())],
+                "histograms": [{"name": name, "labels": dict(labels),
+                                "buckets": dict(zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"], buckets)),
+                                "sum": total, "count": count}
+                               for (name, labels), (buckets, total, count) in sorted(self.histograms.items())],
+            }
+            self.last_counters = counters
+            self.last_snapshot = now
+        derived = {}
+        for derived_name, counter_name, divisor in DERIVED_RATES:
+            delta = self.__sum_counter(counters, counter_name) - self.__sum_counter(last_counters, counter_name)
+            derived[derived_name] = delta / divisor / interval
+        inserted = self.__sum_counter(counters, "gharchive_inserted_docs_total")
+        duplicates = self.__sum_counter(counters, "gharchive_duplicates_total")
+        derived["duplicate_rate"] = duplicates / (inserted + duplicates) if inserted + duplicates > 0 else 0.0
+        snapshot["derived"] = derived
+        return snapshot
+
+    def prometheus_text(self):
+        lines = []
+        with self.lock:
+            for kind, values in (("counter", self.counters), ("gauge", self.gauges)):
+                typed = set()
+                for (name, labels), value in sorted(values.items()):
+                    if name not in typed:
+                        lines.append(f"# TYPE {name} {kind}")
+                        typed.add(name)
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+            typed = set()
+            for (name, labels), (buckets, total, count) in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, bucket_count in zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"], buckets):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def __write_snapshot(self):
+        self.sample()
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fd:
+            json.dump(self.snapshot(), fd, indent=1)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def __serve(self):
+        collector = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                collector.sample()
+                body = collector.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"[{datetime.datetime.now()}] Metrics endpoint: http://127.0.0.1:{server.server_address[1]}/metrics")
+        return server
+
+    def _worker(self):
+        ignore_sigint()
+        server = self.__serve() if self.port else None
+        self.start_time = time.time()
+        self.last_snapshot = self.start_time
+        continue_flag = True
+        while continue_flag:
+            try:
+                msg = self.qu.get(timeout=1)
+                if msg["type"] == "metrics":
+                    self.__merge(msg["content"])
+                elif msg["type"] == "terminate":
+                    continue_flag = False
+                else:
+                    print(f"Error: unrecognized message type: {msg['type']}")
+            except queue.Empty:
+                pass
+            if not continue_flag or time.time() - self.last_snapshot >= self.snapshot_interval:
+                try:
+                    self.__write_snapshot()
+                except Exception as e:
+                    print(f"[{datetime.datetime.now()}] 写入指标快照失败: {e}")
+        if server is not None:
+            server.shutdown()
+
+    def start(self):
+        self.p = Process(target=self._worker, args=())
+        self.p.start()
+
+    def join(self):
+        self.p.join()
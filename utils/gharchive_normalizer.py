@@ -0,0 +1,133 @@
+import hashlib
+
+import numpy as np
+
+from db.mongodb_gh_utilities import GHArchiveMongoDBUtil
+from utils.gharchive_time import normalize_created_at
+from utils.quarantine import REASON_MISSING_ACTOR, REASON_MISSING_REPO
+
+
+def generate_sha_hash(input_str, sha_version="sha256"):
+    """
+    生成字符串的SHA哈希值
+
+    参数：
+        input_str: 输入的字符串
+        sha_version: SHA版本，支持'sha1'、'sha256'、'sha512'（默认sha256）
+
+    返回：
+        十六进制格式的SHA哈希值字符串
+    """
+    # 检查支持的SHA版本
+    supported_versions = ["sha1", "sha256", "sha512"]
+    if sha_version not in supported_versions:
+        raise ValueError(f"不支持的SHA版本，可选：{supported_versions}")
+
+    # 字符串转字节流（必须指定编码，如utf-8）
+    byte_data = input_str.encode("utf-8")
+
+    # 创建哈希对象并计算哈希值
+    hash_obj = hashlib.new(sha_version, byte_data)
+
+    # 返回十六进制结果
+    return hash_obj.hexdigest()
+
+
+def _finish_record(record, record_to_send, repo_name, actor_login):
+    # 各时代共用的后半段：字段顺序与原来逐条解析的结果完全一致
+    record_to_send["proj_id"] = f"github:{repo_name}"
+    record_to_send["user_id"] = f"github:{actor_login}"
+    record_to_send["type"] = record["type"]
+    # 统一时间格式
+    record_to_send["created_at"] = normalize_created_at(record["created_at"])
+    if "id" not in record:
+        id_str = f'{record_to_send["proj_id"]}_{record_to_send["user_id"]}_{record_to_send["type"]}_{record_to_send["created_at"]}'
+        record_to_send["id"] = generate_sha_hash(id_str)
+    if "payload" in record:
+        payload = record["payload"]
+        if "action" in payload:
+            record_to_send["action"] = payload["action"]
+
+        if "issue" in payload:
+            if isinstance(payload["issue"], dict):
+                if "number" in payload["issue"]:
+                    record_to_send["number"] = payload["issue"]["number"]
+            else:
+                record_to_send["number"] = payload["number"]
+        elif "issue_id" in payload:
+            record_to_send["number"] = payload["issue_id"]
+
+        if "pull_request" in payload:
+            if isinstance(payload["pull_request"], dict):
+                if "number" in payload["pull_request"]:
+                    record_to_send["number"] = payload["pull_request"]["number"]
+            else:
+                record_to_send["number"] = payload["number"]
+    if "action" not in record_to_send:
+        record_to_send["action"] = ""
+    if "number" not in record_to_send:
+        record_to_send["number"] = np.nan
+    return record_to_send
+
+
+def normalize_record(record):
+    """
+    通用路径：兼容所有时代的格式，逐个探测字段；无法解析时返回 None
+    """
+    record_to_send = {}
+    if "id" in record:
+        record_to_send["id"] = record["id"]
+
+    if "repo" in record:
+        repo_name = record["repo"]["name"]
+    elif "repository" in record:
+        repo_name = f"{record['repository']['owner']}/{record['repository']['name']}"
+    elif "url" in record:
+        repo_name = f"{record['url'].replace('https://github.com/', '')}"
+    else:
+        return None
+
+    if "actor_attributes" in record:
+        actor_login = record["actor_attributes"]["login"]
+    elif "actor" in record:
+        actor_login = record["actor"]["login"]
+    else:
+        return None
+    return _finish_record(record, record_to_send, repo_name, actor_login)
+
+
+def unparseable_reason(record):
+    """
+    normalize_record 返回 None 时的原因
+    """
+    if "repo" not in record and "repository" not in record and "url" not in record:
+        return REASON_MISSING_REPO
+    return REASON_MISSING_ACTOR
+
+
+class GHArchiveNormalizer:
+    """
+    一个小时文件内的记录共用的解析状态：按通用路径解析，同时附上目标集合 col_id（按 "YYYY-MM" 缓存），
+    路由与写入端都不必再拆分 created_at。
+    按时代分派专用解析函数在基准测试中没有可测量的收益，因此不再区分
+    """
+
+    def __init__(self):
+        self.col_ids = {}
+
+    def normalize(self, record):
+        """
+        返回 (record_to_send, col_id)；记录缺少仓库或用户信息时返回 None
+        """
+        record_to_send = normalize_record(record)
+        if record_to_send is None:
+            return None
+        return record_to_send, self.col_id(record_to_send["created_at"])
+
+    def col_id(self, created_at):
+        month = created_at[0:7]
+        col_id = self.col_ids.get(month)
+        if col_id is None:
+            col_id = GHArchiveMongoDBUtil.get_col_id(created_at)
+            self.col_ids[month] = col_id
+        return col_id
@@ -1,20 +1,34 @@
+import os
+import queue
 import time
 import datetime
 from multiprocessing import Process
 
-import config
+from db.gh_sinks import create_sink
 from db.mongodb_gh_utilities import GHArchiveMongoDBUtil
+from utils.gharchive_downloader import StageUtilization
+from utils.gharchive_flow import ignore_sigint
+from utils.gharchive_metrics import MetricsRecorder
+from utils.ingest_manifest import IngestManifest
+from utils.sampling_profiler import start_profiler, stop_profiler
 
 
-class GHReceiver:
-    def __init__(self, complete_log_path, msg_queue, total_task_count):
-        self.complete_log_path = complete_log_path
-        self.qu = msg_queue
+class GHCompletionTracker:
+    """
+    汇总各写入分片的完成消息：一个文件只有在所有分片都 flush 之后才在 manifest 中记为完成
+    """
+
+    def __init__(self, manifest_path, completion_queue, total_task_count, num_shards, shard_queues=None):
+        self.manifest_path = manifest_path
+        self.manifest = None
+        self.qu = completion_queue
+        self.shard_queues = shard_queues if shard_queues is not None else []
         self.p = None
-        self.start_time_str = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
         self.start_time = time.time()
         self.total_task_count = total_task_count
+        self.num_shards = num_shards
         self.complete_count = 0
+        self.pending = {}
 
     def __print_estimate_time(self):
         self.complete_count += 1
@@ -25,53 +39,187 @@ class GHReceiver:
             f"Message receiver: {self.complete_count}/{self.total_task_count} "
             f"{self.complete_count / self.total_task_count * 100.:.2f}% "
             f"time cost {time_cost:.2f} hours, est. left {time_left:.2f} hours, "
-            f"qsize: {self.qu.qsize()}")
+            f"qsize: {sum(qu.qsize() for qu in self.shard_queues)}")
+
+    def __record_completed(self, gz_path, stats):
+        try:
+            self.manifest.mark_completed(os.path.basename(gz_path), gz_path, stats["events_parsed"],
+                                         stats["events_inserted"], stats["duplicates"])
+            self.__print_estimate_time()
+        except Exception as e:
+            print(e)
+
+    def __shard_completed(self, content):
+        gz_path = content["gz_file_path"]
+        if gz_path not in self.pending:
+            self.pending[gz_path] = {"shards": 0, "events_parsed": content["events_parsed"],
+                                     "events_inserted": 0, "duplicates": 0}
+        stats = self.pending[gz_path]
+        stats["shards"] += 1
+        stats["events_inserted"] += content["events_inserted"]
+        stats["duplicates"] += content["duplicates"]
+        if stats["shards"] >= self.num_shards:
+            del self.pending[gz_path]
+            self.__record_completed(gz_path, stats)
+
+    def _worker(self):
+        ignore_sigint()
+        self.manifest = IngestManifest(self.manifest_path)
+        continue_flag = True
+        self.start_time = time.time()
+        while continue_flag:
+            msg = self.qu.get()
+            type = msg["type"]
+            content = msg["content"]
+            if type == "shard_complete":
+                self.__shard_completed(content)
+            elif type == "tasks_added":
+                # follow 模式下新发布的小时文件
+                self.total_task_count += content
+            elif type == "terminate":
+                if self.pending:
+                    print(f"[{datetime.datetime.now()}] GHCompletionTracker: {len(self.pending)} 个文件未在所有分片完成")
+                print(f"[{datetime.datetime.now()}] GHCompletionTracker out.")
+                continue_flag = False
+            else:
+                print(f"Error: unrecognized message type: {type}")
+        self.manifest.close()
+
+    def start(self):
+        self.p = Process(target=self._worker, args=())
+        self.p.start()
+
+    def join(self):
+        self.p.join()
+
+
+class GHReceiver:
+    """
+    写入分片：消费一个消息队列，使用独立的缓冲区和 Mongo 连接写入自己负责的集合
+    """
+
+    def __init__(self, msg_queue, completion_queue, shard_idx=0, db_options=None, month_file_counts=None,
+                 memory_budget=None, metrics_queue=None, profile_dir=None, db_factory=None, sink_type="mongodb",
+                 sink_output=None):
+        self.qu = msg_queue
+        # 写入端类型（见 db.gh_sinks.SINK_TYPES），列式写入端输出到 sink_output 目录
+        self.sink_type = sink_type
+        self.sink_output = sink_output
+        # 不为 None 时调用 db_factory() 得到与 GHArchiveMongoDBUtil 接口相同的写入端，例如基准测试中的内存写入端
+        self.db_factory = db_factory
+        # 不为 None 时在写入进程中运行采样分析器，输出到该目录
+        self.profile_dir = profile_dir
+        self.metrics_qu = metrics_queue
+        # 与解析进程共享的 MemoryBudget，处理完一条消息后释放它占用的字节数
+        self.memory_budget = memory_budget
+        # 传给 GHArchiveMongoDBUtil 的额外参数，例如 {"async_write": True}
+        self.db_options = db_options if db_options is not None else {}
+        # bulk_load 模式下每个 col_id 还有多少个文件未完成，归零时为该集合建索引
+        self.month_file_counts = dict(month_file_counts) if month_file_counts is not None else {}
+        self.completion_qu = completion_queue
+        self.shard_idx = shard_idx
+        self.p = None
+        self.start_time_str = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        self.start_time = time.time()
 
     def __flush(self, msg):
         inserted_ids, write_errors = self.gh_mongo_db.flush()
         if inserted_ids >= 0:
             print(
-                f"[{datetime.datetime.now()}] 完成并Flush: 插入 {inserted_ids} 条, 失败 {write_errors} 条, {msg}")
+                f"[{datetime.datetime.now()}] 分片 {self.shard_idx} 完成并Flush: 插入 {inserted_ids} 条, 失败 {write_errors} 条, {msg}")
+
+    def __month_completed(self, gz_path):
+        col_id = GHArchiveMongoDBUtil.get_col_id(os.path.basename(gz_path))
+        if col_id in self.month_file_counts:
+            self.month_file_counts[col_id] -= 1
+            if self.month_file_counts[col_id] <= 0:
+                del self.month_file_counts[col_id]
+                self.gh_mongo_db.build_deferred_indexes(col_id)
 
-    def __record_completed(self, gz_path):
+    def __record_completed(self, gz_path, events_parsed):
         try:
-            with open(self.complete_log_path, "a", encoding="utf-8") as fd:
-                fd.write(gz_path)
-                fd.write("\n")
             self.__flush(gz_path)
-            self.__print_estimate_time()
+            self.__month_completed(gz_path)
+            events_inserted, duplicates = self.gh_mongo_db.pop_source_stats(gz_path)
+            self.completion_qu.put({"type": "shard_complete",
+                                    "content": {"gz_file_path": gz_path, "shard_idx": self.shard_idx,
+                                                "events_parsed": events_parsed, "events_inserted": events_inserted,
+                                                "duplicates": duplicates}})
         except Exception as e:
             print(e)
 
     def __mongo_insert(self, record, gz_file_path):
-        inserted_ids, write_errors = self.gh_mongo_db.insert_gh_record(record)
+        inserted_ids, write_errors = self.gh_mongo_db.insert_gh_record(record, gz_file_path)
+        if inserted_ids >= 0:
+            print(
+                f"[{datetime.datetime.now()}] 解压并导入进度: 插入 {inserted_ids} 条, 失败 {write_errors} 条, {gz_file_path}")
+
+    def __mongo_insert_records(self, records, gz_file_path, col_ids=None):
+        inserted_ids, write_errors = self.gh_mongo_db.insert_gh_records(records, gz_file_path, col_ids)
+        if inserted_ids >= 0:
+            print(
+                f"[{datetime.datetime.now()}] 解压并导入进度: 插入 {inserted_ids} 条, 失败 {write_errors} 条, {gz_file_path}")
+
+    def __mongo_insert_raw_records(self, col_docs, gz_file_path):
+        inserted_ids, write_errors = self.gh_mongo_db.insert_raw_records(col_docs, gz_file_path)
         if inserted_ids >= 0:
             print(
                 f"[{datetime.datetime.now()}] 解压并导入进度: 插入 {inserted_ids} 条, 失败 {write_errors} 条, {gz_file_path}")
 
     def _worker(self):
-        self.gh_mongo_db = GHArchiveMongoDBUtil(config.get_config("mongodb_conn_str"))
+        ignore_sigint()
+        metrics = MetricsRecorder(self.metrics_qu)
+        profiler = start_profiler(self.profile_dir, f"writer-{self.shard_idx}")
+        if self.db_factory is not None:
+            self.gh_mongo_db = self.db_factory()
+        else:
+            self.gh_mongo_db = create_sink(self.sink_type, self.db_options, self.sink_output, metrics=metrics,
+                                           metrics_labels={"shard": self.shard_idx})
+        utilization = StageUtilization(f"Writer shard {self.shard_idx}")
         continue_flag = True
         self.start_time = time.time()
         while continue_flag:
+            busy_start = time.time()
             try:
-                msg = self.qu.get_nowait()
+                # 阻塞等待新消息，空闲 10 秒后 flush 一次缓冲区
+                msg = self.qu.get(timeout=10)
                 type = msg["type"]
                 content = msg["content"]
-                if type == "complete":
-                    self.__record_completed(content)
-                elif type == "record":
-                    self.__mongo_insert(content["record"], content["gz_file_path"])
-                elif type == "terminate":
-                    print(f"[{datetime.datetime.now()}] GHReceiver out.")
-                    continue_flag = False
-                else:
-                    print(f"Error: unrecognized message type: {type}")
+                try:
+                    if type == "complete":
+                        self.__record_completed(content["gz_file_path"], content["events_parsed"])
+                    elif type == "records":
+                        self.__mongo_insert_records(content["records"], content["gz_file_path"],
+                                                    content.get("col_ids"))
+                    elif type == "raw_records":
+                        self.__mongo_insert_raw_records(content["col_docs"], content["gz_file_path"])
+                    elif type == "record":
+                        self.__mongo_insert(content["record"], content["gz_file_path"])
+                    elif type == "terminate":
+                        print(f"[{datetime.datetime.now()}] GHReceiver {self.shard_idx} out.")
+                        continue_flag = False
+                    else:
+                        print(f"Error: unrecognized message type: {type}")
+                finally:
+                    # 写入失败也要归还预算，否则解析进程会永久阻塞
+                    if self.memory_budget is not None and isinstance(content, dict) and "size" in content:
+                        self.memory_budget.release(content["size"])
+                utilization.add(busy=time.time() - busy_start)
+            except queue.Empty:
+                self.__flush("Receiver flush when waiting.")
+                utilization.add(wait_input=time.time() - busy_start)
             except Exception as e:
                 time.sleep(10)
                 self.__flush("Receiver flush when waiting.")
+                utilization.add(wait_input=time.time() - busy_start)
                 print(f"[{datetime.datetime.now()}] GHReceiver waiting. {e}")
         self.__flush("Receiver final flush.")
+        print(f"[{datetime.datetime.now()}] {utilization.report()}")
+        # 未能全部完成的月份也在退出前建好索引
+        self.gh_mongo_db.build_deferred_indexes()
+        self.gh_mongo_db.close()
+        metrics.flush(force=True)
+        stop_profiler(profiler)
 
     def start(self):
         self.p = Process(target=self._worker, args=())
@@ -0,0 +1,66 @@
+import datetime
+import functools
+
+from dateutil import parser
+
+UTC_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# 已见过的时区偏移，例如 "-07:00" -> timedelta(hours=-7)
+_offset_table = {}
+
+
+@functools.lru_cache(maxsize=4096)
+def _valid_date(date_str):
+    # date_str 形如 "2012-08-31"，同一个小时文件里只会出现极少几种
+    try:
+        datetime.date(int(date_str[0:4]), int(date_str[5:7]), int(date_str[8:10]))
+        return True
+    except ValueError:
+        return False
+
+
+def _has_shape(s):
+    # "YYYY-MM-DDTHH:MM:SS" 的分隔符与数字位置
+    return (s[4] == "-" and s[7] == "-" and s[10] == "T" and s[13] == ":" and s[16] == ":"
+            and s[0:4].isdigit() and s[5:7].isdigit() and s[8:10].isdigit()
+            and s[11:13].isdigit() and s[14:16].isdigit() and s[17:19].isdigit()
+            and int(s[11:13]) < 24 and int(s[14:16]) < 60 and int(s[17:19]) < 60
+            and _valid_date(s[0:10]))
+
+
+def _get_offset(offset_str):
+    offset = _offset_table.get(offset_str)
+    if offset is None:
+        if not (offset_str[0] in "+-" and offset_str[3] == ":"
+                and offset_str[1:3].isdigit() and offset_str[4:6].isdigit() and int(offset_str[4:6]) < 60):
+            return None
+        minutes = int(offset_str[1:3]) * 60 + int(offset_str[4:6])
+        if offset_str[0] == "-":
+            minutes = -minutes
+        offset = datetime.timedelta(minutes=minutes)
+        _offset_table[offset_str] = offset
+    return offset
+
+
+def _parse_slow(created_at):
+    return parser.parse(created_at).astimezone(datetime.timezone.utc).strftime(UTC_FORMAT)
+
+
+def normalize_created_at(created_at):
+    """
+    把 GH Archive 的 created_at 统一成 UTC 的 "YYYY-MM-DDTHH:MM:SSZ"
+
+    新数据形如 "2015-01-01T15:00:01Z"，直接校验后原样返回；
+    旧数据形如 "2012-08-31T17:57:27-07:00"，按缓存的时区偏移换算；
+    其他格式交给 dateutil，结果与 parser.parse + astimezone + strftime 完全一致
+    """
+    length = len(created_at)
+    if length == 20 and created_at[19] == "Z" and _has_shape(created_at):
+        return created_at
+    if length == 25 and _has_shape(created_at):
+        offset = _get_offset(created_at[19:])
+        if offset is not None:
+            local_time = datetime.datetime(int(created_at[0:4]), int(created_at[5:7]), int(created_at[8:10]),
+                                           int(created_at[11:13]), int(created_at[14:16]), int(created_at[17:19]))
+            return (local_time - offset).strftime(UTC_FORMAT)
+    return _parse_slow(created_at)
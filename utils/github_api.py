@@ -1,34 +1,192 @@
+import datetime
+import email.utils
+import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
 
-from utils.token_manager import singleton_token_manager
+import config
+from utils.github_cache import GitHubResponseCache
+from utils.token_manager import singleton_token_manager, RESET_MARGIN
 
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_TIMEOUT = 30
+# 指数退避：第 n 次重试等待 BACKOFF_BASE * 2^n 秒（带随机抖动），最多 MAX_BACKOFF 秒
+BACKOFF_BASE = 1.0
+MAX_BACKOFF = 60.0
 
-def get_github_headers():
+
+def get_github_headers(token=None):
     headers = {
         "Accept": "application/vnd.github.v3+json",
         "User-Agent": "GitHubDataFetcher/1.0"
     }
-    token = singleton_token_manager.get_token()
     if token:
         headers['Authorization'] = f"token {token}"
     return headers
 
 
-def make_github_request(url: str) -> Optional[requests.Response]:
-    for retry in range(3):
-        try:
-            response = requests.get(url, headers=get_github_headers())
-            if response.status_code == 403:
-                wait_time = 10
-                time.sleep(wait_time)
+def parse_retry_after(headers):
+    # Retry-After 可以是秒数，也可以是 HTTP 日期
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0)
+
+
+def seconds_until_reset(headers):
+    # X-RateLimit-Reset 为 epoch 秒；没有或无法解析时返回 None
+    reset = headers.get("X-RateLimit-Reset")
+    if reset is None:
+        return None
+    try:
+        return max(float(reset) - time.time(), 0) + RESET_MARGIN
+    except ValueError:
+        return None
+
+
+def build_cached_response(url, cached):
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response.headers = CaseInsensitiveDict(cached["headers"])
+    response._content = cached["body"]
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    return response
+
+
+class GitHubFetcher:
+    """
+    GitHub API 批量抓取：一个 requests.Session 的连接池（keep-alive）上最多 max_workers 个并发请求。
+
+    传入 cache_path 时启用 ETag / Last-Modified 磁盘缓存，重复运行时发送条件请求，304 直接返回缓存的响应。
+    token 由 token_manager 按剩余额度分配，并用每个响应的额度响应头更新；
+    连接错误、5xx、429 与非额度耗尽的 403 按指数退避重试，有 Retry-After 时按它等待
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, cache_path=None, token_manager=None,
+                 max_retries=DEFAULT_MAX_RETRIES, timeout=DEFAULT_TIMEOUT, backoff_base=BACKOFF_BASE):
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.token_manager = token_manager if token_manager is not None else singleton_token_manager
+        self.cache = GitHubResponseCache(cache_path) if cache_path is not None else None
+        self.session = requests.Session()
+        # 连接数与并发数一致，pool_block 保证不会超出连接池新建临时连接
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_workers, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "not_modified": 0, "retries": 0, "failed": 0}
+
+    def __count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def __backoff(self, attempt):
+        return min(self.backoff_base * 2 ** attempt, MAX_BACKOFF) * random.uniform(0.5, 1.0)
+
+    def fetch(self, url) -> Optional[requests.Response]:
+        """
+        返回响应（304 时为缓存的响应），404、其他 4xx 或重试用尽时返回 None
+        """
+        cached = self.cache.get(url) if self.cache is not None else None
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                self.__count("retries")
+            token = self.token_manager.get_token()
+            headers = get_github_headers(token)
+            if cached is not None:
+                if cached["etag"]:
+                    headers["If-None-Match"] = cached["etag"]
+                if cached["last_modified"]:
+                    headers["If-Modified-Since"] = cached["last_modified"]
+            self.__count("requests")
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                print(f"[{datetime.datetime.now()}] Request failed: {url} {e}")
+                time.sleep(self.__backoff(attempt))
                 continue
-            if response.status_code == 404:
+            tracked = self.token_manager.update_from_headers(token, response.headers)
+            status = response.status_code
+            if status == 304 and cached is not None:
+                self.__count("not_modified")
+                return build_cached_response(url, cached)
+            if status in (403, 429) or status >= 500:
+                retry_after = parse_retry_after(response.headers)
+                if retry_after is None and status == 403 and response.headers.get("X-RateLimit-Remaining") == "0":
+                    if tracked:
+                        # 该 token 额度用完，下一次换 token，或由 token_manager 等到重置
+                        continue
+                    # 匿名访问或未被调度的 token：token_manager 不会等待，在这里等到额度重置
+                    retry_after = seconds_until_reset(response.headers)
+                    print(f"[{datetime.datetime.now()}] Rate limit exhausted without a tracked token, "
+                          f"wait {retry_after if retry_after is not None else 0:.1f}s: {url}")
+                time.sleep(retry_after if retry_after is not None else self.__backoff(attempt))
+                continue
+            if status == 404:
+                return None
+            if status >= 400:
+                print(f"[{datetime.datetime.now()}] Request failed: {url} {status}")
+                self.__count("failed")
                 return None
-            response.raise_for_status()
+            if self.cache is not None and ("ETag" in response.headers or "Last-Modified" in response.headers):
+                self.cache.put(url, response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                               dict(response.headers), response.content)
             return response
-        except requests.exceptions.RequestException as e:
-            print(f"Request failed: {str(e)}")
-    return None
+        print(f"[{datetime.datetime.now()}] Request failed after {self.max_retries + 1} attempts: {url}")
+        self.__count("failed")
+        return None
+
+    def fetch_many(self, urls):
+        """
+        并发抓取多个 URL，按 urls 的顺序返回响应列表（失败的位置为 None）
+        """
+        urls = list(urls)
+        if not urls:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(urls))) as executor:
+            return list(executor.map(self.fetch, urls))
+
+    def close(self):
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+_default_fetcher = None
+_default_fetcher_lock = threading.Lock()
+
+
+def get_default_fetcher():
+    # 第一次使用时创建；config.yaml 中配置了 github_api_cache_path 时启用磁盘缓存
+    global _default_fetcher
+    if _default_fetcher is None:
+        with _default_fetcher_lock:
+            if _default_fetcher is None:
+                _default_fetcher = GitHubFetcher(cache_path=config.get_config("github_api_cache_path", None))
+    return _default_fetcher
+
+
+def make_github_request(url: str) -> Optional[requests.Response]:
+    return get_default_fetcher().fetch(url)
+
+
+def make_github_requests(urls):
+    return get_default_fetcher().fetch_many(urls)
@@ -0,0 +1,56 @@
+import datetime
+import json
+import os
+import sqlite3
+import threading
+
+
+class GitHubResponseCache:
+    """
+    GitHub API 响应的磁盘缓存（SQLite），按 URL 保存 ETag / Last-Modified、响应头与响应体。
+    再次请求同一个 URL 时带上 If-None-Match / If-Modified-Since，服务端返回 304 时直接使用缓存的响应，
+    304 不消耗 rate limit 额度。
+
+    一个连接在多个抓取线程之间共享，读写都在锁内进行
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                headers TEXT,
+                body BLOB,
+                fetched_at TEXT
+            )""")
+
+    def get(self, url):
+        """
+        返回 {"etag", "last_modified", "headers", "body"}，没有缓存时返回 None
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT etag, last_modified, headers, body FROM responses WHERE url = ?",
+                                    (url,)).fetchone()
+        if row is None:
+            return None
+        return {"etag": row[0], "last_modified": row[1], "headers": json.loads(row[2]), "body": row[3]}
+
+    def put(self, url, etag, last_modified, headers, body):
+        now = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (url, etag, last_modified, headers, body, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (url, etag, last_modified, json.dumps(headers), body, now))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
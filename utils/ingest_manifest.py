@@ -0,0 +1,116 @@
+import datetime
+import os
+import sqlite3
+
+
+class IngestManifest:
+    """
+    记录每个小时文件的导入状态（SQLite），替代原来的 complete_log 文本文件
+
+    file_name 为 "2015-01-01-15.json.gz" 这样的文件名；多个进程可以同时打开同一个 manifest，
+    每个进程使用自己的连接
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                file_name TEXT PRIMARY KEY,
+                local_path TEXT,
+                downloaded INTEGER NOT NULL DEFAULT 0,
+                size INTEGER,
+                verified INTEGER NOT NULL DEFAULT 0,
+                events_parsed INTEGER,
+                events_inserted INTEGER,
+                duplicates INTEGER,
+                completed INTEGER NOT NULL DEFAULT 0,
+                failed_at TEXT,
+                downloaded_at TEXT,
+                completed_at TEXT,
+                updated_at TEXT
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS files_completed ON files (completed)")
+
+    @staticmethod
+    def __now():
+        return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    def __upsert(self, file_name, **fields):
+        fields["updated_at"] = self.__now()
+        columns = ", ".join(fields)
+        placeholders = ", ".join("?" for _ in fields)
+        updates = ", ".join(f"{k} = excluded.{k}" for k in fields)
+        self.conn.execute(
+            f"INSERT INTO files (file_name, {columns}) VALUES (?, {placeholders}) "
+            f"ON CONFLICT(file_name) DO UPDATE SET {updates}",
+            [file_name] + list(fields.values()))
+
+    def mark_downloaded(self, file_name, local_path, size):
+        self.__upsert(file_name, local_path=local_path, downloaded=1, size=size, verified=0,
+                      downloaded_at=self.__now())
+
+    def mark_verified(self, file_name, local_path, size):
+        self.__upsert(file_name, local_path=local_path, downloaded=1, size=size, verified=1)
+
+    def mark_invalid(self, file_name):
+        self.__upsert(file_name, downloaded=0, size=None, verified=0)
+
+    def mark_completed(self, file_name, local_path, events_parsed, events_inserted, duplicates):
+        now = self.__now()
+        self.__upsert(file_name, local_path=local_path, completed=1, events_parsed=events_parsed,
+                      events_inserted=events_inserted, duplicates=duplicates, completed_at=now)
+
+    def mark_failed(self, file_name):
+        self.__upsert(file_name, failed_at=self.__now())
+
+    def get_states(self, file_names):
+        """
+        返回 {file_name: (completed, failed_at)}，只查询给定的文件
+        """
+        states = {}
+        file_names = list(file_names)
+        for i in range(0, len(file_names), 500):
+            chunk = file_names[i:i + 500]
+            placeholders = ", ".join("?" for _ in chunk)
+            for row in self.conn.execute(
+                    f"SELECT file_name, completed, failed_at FROM files WHERE file_name IN ({placeholders})", chunk):
+                states[row[0]] = (row[1], row[2])
+        return states
+
+    def is_verified(self, file_name, size):
+        # 已校验过且文件大小没有变化时，不必再打开 gz 文件检查
+        row = self.conn.execute("SELECT size FROM files WHERE file_name = ? AND verified = 1",
+                                (file_name,)).fetchone()
+        return row is not None and row[0] == size
+
+    def completed_file_names(self):
+        return {row[0] for row in self.conn.execute("SELECT file_name FROM files WHERE completed = 1")}
+
+    def import_complete_log(self, complete_log_path):
+        """
+        把旧的 complete_log（每行一个本地路径）导入 manifest；已导入过的文件保持不变
+        """
+        if not complete_log_path or not os.path.exists(complete_log_path):
+            return 0
+        now = self.__now()
+        rows = []
+        with open(complete_log_path, "r", encoding="utf-8") as fd:
+            for line in fd:
+                local_path = line.strip()
+                if local_path:
+                    rows.append((os.path.basename(local_path), local_path, now, now))
+        self.conn.execute("BEGIN")
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO files (file_name, local_path, downloaded, verified, completed, completed_at, "
+            "updated_at) VALUES (?, ?, 1, 1, 1, ?, ?)", rows)
+        self.conn.execute("COMMIT")
+        return len(rows)
+
+    def close(self):
+        self.conn.close()
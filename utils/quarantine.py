@@ -0,0 +1,114 @@
+import datetime
+import glob
+import gzip
+import json
+import os
+
+# 每个来源文件缓冲多少条被拒绝的行后写出一次
+QUARANTINE_FLUSH_LINES = 1000
+QUARANTINE_SUFFIX = ".quarantine.jsonl.gz"
+
+REASON_JSON_ERROR = "json_error"
+REASON_MISSING_REPO = "missing_repo"
+REASON_MISSING_ACTOR = "missing_actor"
+REASON_EXCEPTION = "exception"
+# 重新处理时解析成功、但写入端没有写入
+REASON_WRITE_ERROR = "write_error"
+
+
+def get_quarantine_path(quarantine_root, source):
+    # 与下载目录一样按年份分目录：<root>/2012/2012-08-31-17.quarantine.jsonl.gz
+    name = os.path.basename(source)
+    if name.endswith(".json.gz"):
+        name = name[:-len(".json.gz")]
+    return os.path.join(quarantine_root, name.split("-")[0], name + QUARANTINE_SUFFIX)
+
+
+def iter_quarantine_files(quarantine_root, pattern="*"):
+    return sorted(glob.glob(os.path.join(quarantine_root, "*", pattern + QUARANTINE_SUFFIX)))
+
+
+def read_quarantine_file(path):
+    """
+    返回文件中的全部条目：[{"source", "reason", "error", "line", "time"}, ...]
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as fd:
+        return [json.loads(entry) for entry in fd if entry.strip()]
+
+
+def write_quarantine_file(path, entries):
+    """
+    用 entries 原子地替换整个隔离文件，entries 为空时删除文件
+    """
+    if not entries:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as fd:
+        for entry in entries:
+            fd.write(json.dumps(entry, ensure_ascii=False))
+            fd.write("\n")
+    os.replace(tmp_path, path)
+
+
+class QuarantineStore:
+    """
+    无法解析的原始行的隔离区：每个来源小时文件一个 gzip 压缩的 JSON Lines 文件，每条记录带原因与来源文件。
+    行先在内存中缓冲，满 flush_lines 条或来源文件结束时以一个 gzip member 追加写出；
+    同一进程中重新开始处理某个来源文件（begin）时覆盖它之前的隔离文件，重复导入不会累积重复行
+    """
+
+    def __init__(self, quarantine_root, flush_lines=QUARANTINE_FLUSH_LINES):
+        self.quarantine_root = quarantine_root
+        self.flush_lines = flush_lines
+        self.buffer = {}
+        self.counts = {}
+        # 本轮已经写过的来源文件，之后的写出改为追加
+        self.written = set()
+
+    def begin(self, source):
+        self.buffer[source] = []
+        self.counts[source] = 0
+        self.written.discard(source)
+        path = get_quarantine_path(self.quarantine_root, source)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def add(self, source, line, reason, error=None):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="replace")
+        entries = self.buffer.setdefault(source, [])
+        self.counts[source] = self.counts.get(source, 0) + 1
+        entries.append({"source": os.path.basename(source), "reason": reason, "error": error,
+                        "line": line.strip(), "time": datetime.datetime.now().isoformat()})
+        if len(entries) >= self.flush_lines:
+            self.__flush(source)
+
+    def __flush(self, source):
+        entries = self.buffer.get(source)
+        if not entries:
+            return
+        path = get_quarantine_path(self.quarantine_root, source)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # gzip 支持多个 member 直接拼接，读取时透明地连在一起
+        with gzip.open(path, "at" if source in self.written else "wt", encoding="utf-8") as fd:
+            for entry in entries:
+                fd.write(json.dumps(entry, ensure_ascii=False))
+                fd.write("\n")
+        self.written.add(source)
+        self.buffer[source] = []
+
+    def finish(self, source):
+        """
+        来源文件处理结束，写出剩余的缓冲，返回该文件被隔离的行数
+        """
+        self.__flush(source)
+        self.buffer.pop(source, None)
+        self.written.discard(source)
+        return self.counts.pop(source, 0)
+
+    def close(self):
+        for source in list(self.buffer):
+            self.finish(source)
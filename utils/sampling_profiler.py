@@ -0,0 +1,134 @@
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+
+# 默认采样间隔（秒）：每秒 100 次，只读取各线程当前的调用栈，开销远小于 cProfile 的逐调用计时
+DEFAULT_SAMPLE_INTERVAL = 0.01
+# 默认每隔多少秒把当前累计的调用栈写出一个文件
+DEFAULT_DUMP_INTERVAL = 60
+# 单个调用栈最多保留的帧数，避免递归过深的栈占用过多空间
+MAX_STACK_DEPTH = 128
+
+
+# 源文件路径 -> 帧标签中的模块路径，采样线程内缓存
+_module_paths = {}
+
+
+def module_path(file_name):
+    """
+    返回相对于 sys.path 中最近的根目录的模块路径，例如 "dateutil/parser/_parser.py"、
+    "pymongo/synchronous/collection.py"，保留顶层包名，报告按包名归类时嵌套模块也能匹配；
+    不在 sys.path 下时保留上一级目录
+    """
+    path = _module_paths.get(file_name)
+    if path is None:
+        path = os.path.join(os.path.basename(os.path.dirname(file_name)), os.path.basename(file_name))
+        root_length = -1
+        for root in sys.path:
+            root = os.path.join(os.path.abspath(root or "."), "")
+            if file_name.startswith(root) and len(root) > root_length:
+                path = file_name[len(root):]
+                root_length = len(root)
+        path = path.replace(os.sep, "/")
+        _module_paths[file_name] = path
+    return path
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({module_path(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame):
+    """
+    把一个帧及其调用者折叠成 "根;...;叶" 形式的字符串（与 flamegraph 的 collapsed 格式一致）
+    """
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class SamplingProfiler:
+    """
+    进程内的采样分析器：后台线程定期采样本进程所有其他线程的调用栈，
+    每隔 dump_interval 秒把本段时间的栈计数写成 output_dir/<name>-<pid>-<序号>.json
+    """
+
+    def __init__(self, output_dir, name, interval=DEFAULT_SAMPLE_INTERVAL, dump_interval=DEFAULT_DUMP_INTERVAL):
+        self.output_dir = output_dir
+        self.name = name
+        self.interval = interval
+        self.dump_interval = dump_interval
+        self.stacks = {}
+        self.samples = 0
+        self.dump_seq = 0
+        self.period_start = time.time()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def __sample(self):
+        own_id = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = collapse_stack(frame)
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        self.samples += 1
+
+    def __dump(self):
+        if not self.stacks:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"{self.name}-{os.getpid()}-{self.dump_seq:05d}.json")
+        with open(path, "w", encoding="utf-8") as fd:
+            json.dump({"process": self.name, "pid": os.getpid(), "interval": self.interval,
+                       "start": self.period_start, "end": time.time(), "samples": self.samples,
+                       "stacks": self.stacks}, fd)
+        self.dump_seq += 1
+        self.stacks = {}
+        self.samples = 0
+        self.period_start = time.time()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.__sample()
+                if time.time() - self.period_start >= self.dump_interval:
+                    self.__dump()
+            except Exception as e:
+                print(f"[{datetime.datetime.now()}] 采样失败 {self.name}: {e}")
+        self.__dump()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        停止采样并写出最后一段
+        """
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+
+
+def start_profiler(profile_dir, name, interval=DEFAULT_SAMPLE_INTERVAL):
+    """
+    profile_dir 为 None 时不启动，返回 None
+    """
+    if profile_dir is None:
+        return None
+    profiler = SamplingProfiler(profile_dir, name, interval)
+    profiler.start()
+    return profiler
+
+
+def stop_profiler(profiler):
+    if profiler is not None:
+        profiler.stop()
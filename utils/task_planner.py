@@ -0,0 +1,82 @@
+import datetime
+import os
+
+GHARCHIVE_URL_PREFIX = "http://data.gharchive.org/"
+# GH Archive 最早的小时文件
+FIRST_HOUR = datetime.datetime(2011, 2, 12, 0)
+PRIORITIES = ("oldest", "recent", "mixed")
+
+
+def hour_file_name(hour):
+    return f"{hour.year}-{hour.month:02d}-{hour.day:02d}-{hour.hour}.json.gz"
+
+
+def hour_file_url(hour):
+    return GHARCHIVE_URL_PREFIX + hour_file_name(hour)
+
+
+def file_url_hour(file_url):
+    # "2015-01-01-15.json.gz" -> datetime(2015, 1, 1, 15)
+    year, month, day, hour = os.path.basename(file_url).split(".")[0].split("-")
+    return datetime.datetime(int(year), int(month), int(day), int(hour))
+
+
+def latest_published_hour(now=None):
+    """
+    当前 UTC 小时之前的最后一个完整小时
+    """
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return now.replace(minute=0, second=0, microsecond=0) - datetime.timedelta(hours=1)
+
+
+def iter_hours(first_hour, last_hour):
+    # 逐小时递增，只会生成合法的日期
+    hour = first_hour
+    step = datetime.timedelta(hours=1)
+    while hour <= last_hour:
+        yield hour
+        hour += step
+
+
+def order_by_priority(items, priority):
+    """
+    items 按时间从早到晚排列
+    oldest: 从最早开始补；recent: 最近的优先；mixed: 两端交替，最近数据与历史回填同时推进
+    """
+    if priority == "oldest":
+        return list(items)
+    if priority == "recent":
+        return list(reversed(items))
+    if priority == "mixed":
+        ordered = []
+        left, right = 0, len(items) - 1
+        while left <= right:
+            ordered.append(items[right])
+            if left != right:
+                ordered.append(items[left])
+            left += 1
+            right -= 1
+        return ordered
+    raise ValueError(f"Unknown priority '{priority}', expected one of {PRIORITIES}")
+
+
+def last_planned_hour(end_year, now=None):
+    """
+    plan_file_urls 在同一个 now 下计划的最后一个小时；follow 模式从它之后接着调度
+    """
+    return min(latest_published_hour(now), datetime.datetime(end_year, 12, 31, 23))
+
+
+def plan_file_urls(start_year, end_year, completed_file_names=(), priority="oldest", now=None):
+    """
+    生成 start_year 到 end_year 之间已发布、且不在 completed_file_names 中的小时文件 URL
+    """
+    first_hour = max(FIRST_HOUR, datetime.datetime(start_year, 1, 1, 0))
+    last_hour = last_planned_hour(end_year, now)
+    pending = []
+    for hour in iter_hours(first_hour, last_hour):
+        file_name = hour_file_name(hour)
+        if file_name not in completed_file_names:
+            pending.append(GHARCHIVE_URL_PREFIX + file_name)
+    return order_by_priority(pending, priority)
@@ -1,78 +1,111 @@
 import datetime
-import json
+import threading
 import time
-from threading import RLock
-
-import requests
 
 import config
 
+# GitHub REST API 的限流窗口与默认额度，未收到响应头之前按此估计
+RATE_LIMIT_WINDOW = 3600
+DEFAULT_RATE_LIMIT = 5000
+# 到达重置时间后多等一会儿，避免本机与 GitHub 的时钟误差
+RESET_MARGIN = 1.0
+
+
+class TokenState:
+    __slots__ = ("token", "limit", "remaining", "reset")
+
+    def __init__(self, token):
+        self.token = token
+        self.limit = DEFAULT_RATE_LIMIT
+        self.remaining = DEFAULT_RATE_LIMIT
+        # 当前窗口的重置时间（epoch 秒），未知时为 None
+        self.reset = None
+
 
 class TokenManager:
-    def __init__(self):
-        self.tokens_pool = config.get_config("github_tokens")
-        self.lock = RLock()
-        self.rate_limit = [0 for i in range(len(self.tokens_pool))]
-        self._update_rate_limit(verbose=True)
+    """
+    按剩余额度调度 GitHub token：每个 token 的剩余额度与重置时间来自真实响应的 X-RateLimit-* 响应头
+    （update_from_headers），不再轮询 /rate_limit。
+
+    get_token 返回剩余额度最多的 token 并在本地预扣一次；预扣只是估计值，下一个响应头会校正它，
+    因此取 token 不需要加锁。所有 token 都用完时睡到最早的重置时间为止。
+    token 列表在第一次取 token 时才从 config.yaml 读取，导入模块不会产生任何网络请求。
+    """
+
+    def __init__(self, tokens=None):
+        self.tokens_pool = tokens
+        self.states = None
+        self.states_by_token = None
+        self.init_lock = threading.Lock()
+
+    def __get_states(self):
+        if self.states is None:
+            with self.init_lock:
+                if self.states is None:
+                    if self.tokens_pool is None:
+                        self.tokens_pool = config.get_config("github_tokens", [])
+                    states = [TokenState(token) for token in self.tokens_pool]
+                    self.states_by_token = {state.token: state for state in states}
+                    self.states = states
+        return self.states
 
     def get_token(self):
-        return self._get_token_block()
-
-    def _gen_headers(self, token):
-        headers = {
-            "Accept": "application/vnd.github+json",
-            "Authorization": f"Bearer {token}"
-        }
-        return headers
-
-    def _update_rate_limit(self, verbose=False):
-        # should work with lock
-        with self.lock:
-            for idx in range(len(self.tokens_pool)):
-                token = self.tokens_pool[idx]
-                try:
-                    with requests.get("https://api.github.com/rate_limit", headers=self._gen_headers(token)) as r:
-                        content = r.text
-                        doc = json.loads(content)
-                        if "rate" in doc:
-                            # print(doc)
-                            self.rate_limit[idx] = doc["rate"]["remaining"]
-                except Exception as e:
-                    print(f"[{datetime.datetime.now()}] Error: TokenManger _update_rate_limit {e}")
-            if verbose:
-                print("Token health check:")
-                for i in range(len(self.rate_limit)):
-                    print(f"{self.rate_limit[i]}  ", end='')
-                print()
-
-    def _get_token_block(self):
-        # block until a valid token is obtained
-        wait_cnt = 0
-        with self.lock:
-            ret_token = self._get_token_nowait()
-            if ret_token is None:
-                self._update_rate_limit()
-            else:
-                return ret_token
-            ret_token = self._get_token_nowait()
-            while ret_token is None:
-                print(f"\r[{datetime.datetime.now()}] Wait for tokens: {wait_cnt}                      ", end="")
-                self._update_rate_limit()
-                ret_token = self._get_token_nowait()
-                wait_cnt += 1
-                time.sleep(5)
-            print()
-        return ret_token
-
-    def _get_token_nowait(self):
-        # should work with lock
-        with self.lock:
-            for i in range(len(self.tokens_pool)):
-                if self.rate_limit[i] > 0:
-                    self.rate_limit[i] -= 1
-                    ret_token = self.tokens_pool[i]
-                    return ret_token
-        return None
+        # 阻塞直到拿到有剩余额度的 token；没有配置 token 时返回 None（匿名访问）
+        states = self.__get_states()
+        if not states:
+            return None
+        while True:
+            now = time.time()
+            best = None
+            for state in states:
+                if state.reset is not None and state.reset + RESET_MARGIN <= now:
+                    # 窗口已重置，额度恢复
+                    state.remaining = state.limit
+                    state.reset = None
+                if state.remaining > 0 and (best is None or state.remaining > best.remaining):
+                    best = state
+            if best is not None:
+                best.remaining -= 1
+                if best.remaining <= 0 and best.reset is None:
+                    best.reset = now + RATE_LIMIT_WINDOW
+                return best.token
+            wait_seconds = max(min(state.reset for state in states) + RESET_MARGIN - now, 0)
+            print(f"[{datetime.datetime.now()}] All {len(states)} tokens exhausted, wait {wait_seconds:.1f}s for reset")
+            time.sleep(wait_seconds)
+
+    def update_from_headers(self, token, headers):
+        """
+        用响应的 X-RateLimit-Limit / Remaining / Reset 响应头更新 token 的额度；headers 通常是 response.headers
+        返回是否更新了某个 token（匿名请求、未知 token 或没有额度响应头时为 False）
+        """
+        self.__get_states()
+        state = self.states_by_token.get(token)
+        remaining = headers.get("X-RateLimit-Remaining")
+        if state is None or remaining is None:
+            return False
+        try:
+            remaining = int(remaining)
+            limit = headers.get("X-RateLimit-Limit")
+            reset = headers.get("X-RateLimit-Reset")
+            state.limit = int(limit) if limit is not None else state.limit
+            state.reset = float(reset) if reset is not None else None
+        except ValueError:
+            return False
+        state.remaining = remaining
+        if remaining <= 0 and state.reset is None:
+            state.reset = time.time() + RATE_LIMIT_WINDOW
+        return True
+
+    def mark_exhausted(self, token, until=None):
+        # 收到限流错误（403 / 429）但没有额度响应头时，把 token 停用到 until
+        self.__get_states()
+        state = self.states_by_token.get(token)
+        if state is not None:
+            state.remaining = 0
+            state.reset = until if until is not None else time.time() + RATE_LIMIT_WINDOW
+
+    def status(self):
+        return [(state.remaining, state.reset) for state in self.__get_states()]
 
 
 singleton_token_manager = TokenManager()